@@ -0,0 +1,340 @@
+"""
+A local mock of the chat completions API of OpenAI and Groq.
+
+The server answers each request with the text it received, after a delay
+which models a real provider: a time to first token, then the generation
+of the completion at a given throughput.
+Some requests can fail, with a 429 or a 500 answer, to exercise the
+retries.
+The answers have the same format as the APIs of the providers, with the
+usage of the tokens, and can be streamed.
+
+Since the translation of a text is the text itself, the placeholders of
+the masking and the delimiters of the batches are kept, and the
+translators take the same path as with a real model.
+
+Run from the root of the repository, e.g. to try the app without API key:
+
+    python -m benchmarks.mock_server --port 8765 --latency 0.2
+
+then set GROQ_BASE_URL=http://127.0.0.1:8765 and GROQ_API_KEY to any value.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+from latex_translator.tokens import estimate_tokens
+
+# The prefix of the text in the messages of the translators
+TEXT_PREFIX = "Here is the text: "
+
+# The number of characters of a streamed chunk
+STREAM_CHUNK_SIZE = 20
+
+
+class MockChatServer:
+    def __init__(
+        self,
+        latency=0.05,
+        throughput=5000.0,
+        error_rate=0.0,
+        error_status=429,
+        retry_after=0.1,
+        seed=0,
+        host="127.0.0.1",
+        port=0,
+    ):
+        """Initialize the MockChatServer.
+
+        The server runs in a background thread, one thread per request.
+
+        Parameters
+        ----------
+        latency : float, optional
+            The time to first token, in seconds. Defaults to 0.05.
+        throughput : float, optional
+            The number of tokens generated per second. Defaults to 5000.
+        error_rate : float, in [0, 1], optional
+            The probability that a request fails. Defaults to 0.
+        error_status : int, optional
+            The HTTP status of the failed requests. Defaults to 429.
+        retry_after : float, optional
+            The retry-after header of the 429 answers, in seconds.
+            Defaults to 0.1.
+        seed : int, optional
+            The seed of the errors, so that a run can be reproduced.
+            Defaults to 0.
+        host : str, optional
+            The address of the server. Defaults to "127.0.0.1".
+        port : int, optional
+            The port of the server. Defaults to 0, a free port.
+        """
+        if error_rate < 0.0 or error_rate > 1.0:
+            raise ValueError(
+                f"The error rate must be in [0, 1], but error_rate={error_rate}"
+            )
+        if throughput <= 0.0:
+            raise ValueError(
+                f"The throughput must be positive, but throughput={throughput}"
+            )
+        self.latency = latency
+        self.throughput = throughput
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.host = host
+        self.port = port
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self.reset()
+
+    def reset(self) -> None:
+        """Reset the counters and the latencies."""
+        with self._lock:
+            self.requests = 0
+            self.errors = 0
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+            # The time to answer each successful request, in seconds
+            self.latencies = []
+
+    def get_statistics(self) -> dict:
+        """Return the counters of the server.
+
+        Returns
+        -------
+        statistics : dict
+            The number of requests, of failed requests, of prompt and
+            completion tokens, and the latencies of the successful
+            requests, in seconds.
+        """
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "latencies": list(self.latencies),
+            }
+
+    @property
+    def base_url(self) -> str:
+        """The URL of the server, e.g. the value of GROQ_BASE_URL."""
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> str:
+        """Start the server in a background thread.
+
+        Returns
+        -------
+        base_url : str
+            The URL of the server.
+        """
+        self._server = ThreadingHTTPServer((self.host, self.port), self._get_handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="mock-chat-server", daemon=True
+        )
+        self._thread.start()
+        return self.base_url
+
+    def stop(self) -> None:
+        """Stop the server."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exception):
+        self.stop()
+
+    def _draw_error(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            is_error = self._random.random() < self.error_rate
+            if is_error:
+                self.errors += 1
+            return is_error
+
+    def _record(self, prompt_tokens: int, completion_tokens: int, latency: float) -> None:
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.latencies.append(latency)
+
+    def _get_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, data: dict, headers=()):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(body)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _write_chunk(self, data: bytes):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+            def do_POST(self):
+                start_time = time.perf_counter()
+                length = int(self.headers.get("content-length", 0))
+                request = json.loads(self.rfile.read(length))
+                if not self.path.endswith("/chat/completions"):
+                    self._send_json(
+                        404, {"error": {"message": f"Unknown path {self.path}"}}
+                    )
+                    return
+                if server._draw_error():
+                    time.sleep(server.latency)
+                    headers = []
+                    if server.error_status == 429:
+                        headers.append(("retry-after", str(server.retry_after)))
+                    self._send_json(
+                        server.error_status,
+                        {"error": {"message": "Injected error of the mock server"}},
+                        headers,
+                    )
+                    return
+                messages = request["messages"]
+                content = messages[-1]["content"]
+                if content.startswith(TEXT_PREFIX):
+                    content = content[len(TEXT_PREFIX) :]
+                prompt_tokens = sum(
+                    estimate_tokens(message["content"]) for message in messages
+                )
+                completion_tokens = estimate_tokens(content)
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                }
+                generation_time = completion_tokens / server.throughput
+                time.sleep(server.latency)
+                if request.get("stream"):
+                    self._stream(request, content, usage, generation_time)
+                else:
+                    time.sleep(generation_time)
+                    self._send_json(
+                        200,
+                        {
+                            "id": "mock",
+                            "object": "chat.completion",
+                            "created": int(time.time()),
+                            "model": request["model"],
+                            "choices": [
+                                {
+                                    "index": 0,
+                                    "message": {"role": "assistant", "content": content},
+                                    "finish_reason": "stop",
+                                }
+                            ],
+                            "usage": usage,
+                        },
+                    )
+                server._record(
+                    prompt_tokens, completion_tokens, time.perf_counter() - start_time
+                )
+
+            def _stream(
+                self, request: dict, content: str, usage: dict, generation_time: float
+            ):
+                self.send_response(200)
+                self.send_header("content-type", "text/event-stream")
+                self.send_header("transfer-encoding", "chunked")
+                self.end_headers()
+                pieces = [
+                    content[i : i + STREAM_CHUNK_SIZE]
+                    for i in range(0, len(content), STREAM_CHUNK_SIZE)
+                ]
+                for index, piece in enumerate(pieces + [None]):
+                    chunk = {
+                        "id": "mock",
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": request["model"],
+                        "choices": [
+                            {
+                                "index": 0,
+                                "delta": {} if piece is None else {"content": piece},
+                                "finish_reason": "stop" if piece is None else None,
+                            }
+                        ],
+                    }
+                    if piece is None:
+                        chunk["usage"] = usage
+                    elif index > 0:
+                        time.sleep(generation_time / len(pieces))
+                    self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self._write_chunk(b"data: [DONE]\n\n")
+                self._write_chunk(b"")
+
+        return Handler
+
+
+def get_parser() -> argparse.ArgumentParser:
+    """Return the parser of the command line arguments."""
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.mock_server",
+        description="Serve a mock of the chat completions API.",
+    )
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="The time to first token, in seconds."
+    )
+    parser.add_argument(
+        "--throughput",
+        type=float,
+        default=5000.0,
+        help="The number of tokens generated per second.",
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="The probability of an error."
+    )
+    parser.add_argument(
+        "--error-status", type=int, default=429, help="The HTTP status of the errors."
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    arguments = get_parser().parse_args(argv)
+    server = MockChatServer(
+        latency=arguments.latency,
+        throughput=arguments.throughput,
+        error_rate=arguments.error_rate,
+        error_status=arguments.error_status,
+        seed=arguments.seed,
+        port=arguments.port,
+    )
+    print(f"Serveur de test : {server.start()}")
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
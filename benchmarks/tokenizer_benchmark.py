@@ -0,0 +1,232 @@
+"""
+Micro-benchmark of the LaTeX tokenizer.
+
+Compares latex_translator.tokenizer.tokenize_latex() with the
+character-by-character scanner which LaTeXSplittingTranslator used before,
+on the example documents and on synthetic documents.
+The synthetic documents only use plain commands, on which both
+implementations must produce the same segments.
+
+Run from the root of the repository:
+
+    python -m benchmarks.tokenizer_benchmark --sizes 0.1 1 10
+"""
+import argparse
+import os
+import time
+from typing import List, Tuple
+
+from latex_translator.tokenizer import (
+    PRESERVE_COMMANDS,
+    TRANSLATE_COMMANDS,
+    tokenize_latex,
+)
+
+EXAMPLES_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "exemples"
+)
+
+SYNTHETIC_PARAGRAPH = (
+    "\\section{Résultats numériques}\n"
+    "\\label{sec:resultats}\n\n"
+    "Nous présentons ici les \\emph{résultats} obtenus sur le cas test "
+    "\\textbf{de référence}, décrit dans \\cite{baudin2025}. "
+    "La figure~\\ref{fig:convergence} montre la convergence de la méthode. "
+    "Les paramètres sont choisis comme dans la section précédente, "
+    "et chaque expérience est répétée cent fois.\n\n"
+    "\\begin{itemize}\n"
+    "\\item Le premier estimateur est \\textit{sans biais}.\n"
+    "\\item Le second estimateur a une variance plus faible.\n"
+    "\\end{itemize}\n\n"
+)
+
+
+def legacy_extract_latex_segments(
+    text: str, preserve_commands, translate_commands
+) -> List[Tuple[str, str, bool]]:
+    """Extract segments from LaTeX text, one character at a time.
+
+    This is the implementation of LaTeXSplittingTranslator before the
+    tokenizer of latex_translator.tokenizer, kept as the reference.
+
+    Parameters
+    ----------
+    text : str
+        The LaTeX text to process.
+    preserve_commands : set of str
+        The commands which are kept with their argument, untranslated.
+    translate_commands : set of str
+        The commands whose argument is translated.
+
+    Returns
+    -------
+    List[Tuple[str, str, bool]]
+        A list of tuples containing the segment, its type, and whether to translate.
+    """
+    segments = []
+    i = 0
+
+    while i < len(text):
+        if text[i] == "\\":
+            # Trouver la fin de la commande
+            j = i + 1
+            while j < len(text) and text[j].isalpha():
+                j += 1
+
+            command = text[i + 1 : j]
+
+            if j < len(text) and text[j] == "{":
+                # Trouver l'accolade fermante correspondante
+                brace_count = 1
+                k = j + 1
+                while k < len(text) and brace_count > 0:
+                    if text[k] == "{":
+                        brace_count += 1
+                    elif text[k] == "}":
+                        brace_count -= 1
+                    k += 1
+
+                if brace_count == 0:
+                    # Commande complète trouvée
+                    full_command = text[i:k]
+                    content = text[j + 1 : k - 1]
+
+                    if command in preserve_commands:
+                        segments.append((full_command, "preserve", False))
+                    elif command in translate_commands:
+                        segments.append((f"\\{command}{{", "command_start", False))
+                        segments.append((content, "translate_content", True))
+                        segments.append(("}", "command_end", False))
+                    else:
+                        segments.append((full_command, "unknown_command", False))
+
+                    i = k
+                    continue
+
+            # Commande sans accolades ou malformée
+            segments.append((text[i:j], "command_no_braces", False))
+            i = j
+        else:
+            # Texte normal - chercher le prochain backslash ou la fin
+            j = i
+            while j < len(text) and text[j] != "\\":
+                j += 1
+
+            if j > i:
+                text_segment = text[i:j]
+                # Ne traduire que si ce n'est pas juste des espaces/retours à la ligne
+                if text_segment.strip():
+                    segments.append((text_segment, "normal_text", True))
+                else:
+                    segments.append((text_segment, "whitespace", False))
+
+            i = j
+
+    return segments
+
+
+def generate_document(size_in_bytes: int) -> str:
+    """Generate a synthetic LaTeX document.
+
+    Parameters
+    ----------
+    size_in_bytes : int
+        The approximate size of the document.
+
+    Returns
+    -------
+    document : str
+        The document, made of repeated paragraphs.
+    """
+    number_of_repetitions = max(
+        1, size_in_bytes // len(SYNTHETIC_PARAGRAPH.encode("utf-8"))
+    )
+    return SYNTHETIC_PARAGRAPH * number_of_repetitions
+
+
+def measure(function, number_of_repetitions: int) -> float:
+    """Return the best duration of a function over several repetitions."""
+    durations = []
+    for _ in range(number_of_repetitions):
+        start_time = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start_time)
+    return min(durations)
+
+
+def benchmark_document(name: str, text: str, number_of_repetitions: int) -> dict:
+    """Benchmark both tokenizers on one document.
+
+    Returns
+    -------
+    result : dict
+        The name and size of the document, the durations, the speedup and
+        the numbers of segments.
+    """
+    legacy_segments = legacy_extract_latex_segments(
+        text, PRESERVE_COMMANDS, TRANSLATE_COMMANDS
+    )
+    segments = tokenize_latex(text)
+    assert "".join(segment for segment, _, _ in segments) == text
+    legacy_duration = measure(
+        lambda: legacy_extract_latex_segments(
+            text, PRESERVE_COMMANDS, TRANSLATE_COMMANDS
+        ),
+        number_of_repetitions,
+    )
+    duration = measure(lambda: tokenize_latex(text), number_of_repetitions)
+    return {
+        "name": name,
+        "size_bytes": len(text.encode("utf-8")),
+        "legacy_duration": legacy_duration,
+        "duration": duration,
+        "speedup": legacy_duration / duration,
+        "legacy_segments": len(legacy_segments),
+        "segments": len(segments),
+        "identical": legacy_segments == segments,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--sizes",
+        type=float,
+        nargs="*",
+        default=[0.1, 1.0, 10.0],
+        help="Sizes of the synthetic documents, in MB.",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Number of repetitions of each run."
+    )
+    args = parser.parse_args()
+
+    documents = []
+    for file_name in sorted(os.listdir(EXAMPLES_DIRECTORY)):
+        if file_name.endswith(".tex"):
+            with open(os.path.join(EXAMPLES_DIRECTORY, file_name), encoding="utf-8") as file:
+                documents.append((file_name, file.read()))
+    for size in args.sizes:
+        documents.append(
+            (f"synthetic_{size:g}MB", generate_document(int(size * 1024 * 1024)))
+        )
+
+    print(
+        f"{'document':<28} {'size':>10} {'legacy (s)':>11} {'new (s)':>9} "
+        f"{'speedup':>8} {'segments':>15} {'identical':>9}"
+    )
+    for name, text in documents:
+        # Only repeat the short documents: the legacy scanner is slow
+        number_of_repetitions = args.repeat if len(text) < 2_000_000 else 1
+        result = benchmark_document(name, text, number_of_repetitions)
+        print(
+            f"{result['name']:<28} {result['size_bytes']:>10} "
+            f"{result['legacy_duration']:>11.4f} {result['duration']:>9.4f} "
+            f"{result['speedup']:>8.1f} "
+            f"{result['legacy_segments']:>7}/{result['segments']:<7} "
+            f"{str(result['identical']):>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
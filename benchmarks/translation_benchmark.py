@@ -0,0 +1,305 @@
+"""
+Benchmark of the translators against a local mock of the chat API.
+
+Runs LaTeXRawTranslator and the legacy LaTeXSplittingTranslator on the
+example documents and on synthetic documents, with the mock server of
+benchmarks.mock_server, so that no API credit is spent and the runs can
+be reproduced.
+For each run, the report gives the number of requests, the tokens, the
+wall time, the median and 95th percentile of the latencies of the
+requests, and the peak of the memory allocated by Python.
+The report is written as JSON, to compare two versions of the code.
+
+The cache is disabled, and the output of the translators is discarded.
+A first translation, which is not reported, imports the SDKs and opens
+the connections.
+The peak memory is measured with tracemalloc, which slows down the runs:
+use --no-memory to measure the wall time only.
+
+Run from the root of the repository:
+
+    python -m benchmarks.translation_benchmark --sizes 0.001 0.1 1 10 --output report.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import List, Optional
+
+from benchmarks.mock_server import MockChatServer
+from benchmarks.tokenizer_benchmark import EXAMPLES_DIRECTORY, generate_document
+from latex_translator.routing import get_quantile
+
+TRANSLATORS = ("raw", "splitting")
+
+
+def load_documents(sizes: List[float]) -> List[tuple]:
+    """Return the example documents and the synthetic documents.
+
+    Parameters
+    ----------
+    sizes : list of float
+        The sizes of the synthetic documents, in MB.
+
+    Returns
+    -------
+    documents : list of tuple(str, str)
+        The name and the content of each document.
+    """
+    documents = []
+    for file_name in sorted(os.listdir(EXAMPLES_DIRECTORY)):
+        if file_name.endswith(".tex"):
+            with open(os.path.join(EXAMPLES_DIRECTORY, file_name), encoding="utf-8") as file:
+                documents.append((file_name, file.read()))
+    for size in sizes:
+        documents.append(
+            (f"synthetic_{size:g}MB", generate_document(int(size * 1024 * 1024)))
+        )
+    return documents
+
+
+def create_translator(name: str, model: str, max_concurrency: int):
+    """Create a translator without cache.
+
+    Parameters
+    ----------
+    name : str
+        The translator, "raw" or "splitting".
+    model : str
+        The model.
+    max_concurrency : int
+        The maximum number of requests in flight.
+
+    Returns
+    -------
+    translator : LaTeXRawTranslator or LaTeXSplittingTranslator
+        The translator.
+    """
+    if name == "raw":
+        from latex_translator.translator import LaTeXRawTranslator
+
+        return LaTeXRawTranslator(
+            model=model, latex_mode=True, max_concurrency=max_concurrency
+        )
+    if name == "splitting":
+        from scripts.legacy_LaTeXSplittingTranslator import LaTeXSplittingTranslator
+
+        return LaTeXSplittingTranslator(model=model, max_concurrency=max_concurrency)
+    raise ValueError(f"Unknown translator {name}, expected one of {TRANSLATORS}")
+
+
+def benchmark_translation(
+    server: MockChatServer,
+    translator_name: str,
+    document_name: str,
+    text: str,
+    model: str,
+    max_concurrency: int,
+    measure_memory: bool = True,
+) -> dict:
+    """Translate one document and measure the run.
+
+    Parameters
+    ----------
+    server : MockChatServer
+        The running mock server, which the clients use.
+    translator_name : str
+        The translator, "raw" or "splitting".
+    document_name : str
+        The name of the document.
+    text : str
+        The LaTeX document.
+    model : str
+        The model.
+    max_concurrency : int
+        The maximum number of requests in flight.
+    measure_memory : bool, optional
+        Whether to measure the peak memory with tracemalloc.
+        Defaults to True.
+
+    Returns
+    -------
+    result : dict
+        The translator, the document and its size, the number of requests
+        and of failed requests, the number of retries, the prompt, completion and total tokens,
+        the wall time, the p50 and p95 of the latencies of the requests, in
+        seconds, the peak memory in bytes (None if not measured), the
+        finish reason, and whether the translation is identical to the
+        document.
+    """
+    translator = create_translator(translator_name, model, max_concurrency)
+    retries = translator.rate_limiter.get_statistics()["retries"]
+    server.reset()
+    if measure_memory:
+        tracemalloc.start()
+    start_time = time.perf_counter()
+    # The translators print each chunk
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        translated_text, total_tokens, finish_reason = translator.translate(text)
+    wall_time = time.perf_counter() - start_time
+    peak_memory = None
+    if measure_memory:
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    statistics = server.get_statistics()
+    latencies = statistics["latencies"]
+    return {
+        "translator": translator_name,
+        "document": document_name,
+        "size_bytes": len(text.encode("utf-8")),
+        "requests": statistics["requests"],
+        "failed_requests": statistics["errors"],
+        "retries": translator.rate_limiter.get_statistics()["retries"] - retries,
+        "prompt_tokens": statistics["prompt_tokens"],
+        "completion_tokens": statistics["completion_tokens"],
+        "total_tokens": total_tokens,
+        "wall_time": wall_time,
+        "latency_p50": get_quantile(latencies, 0.5) if latencies else None,
+        "latency_p95": get_quantile(latencies, 0.95) if latencies else None,
+        "peak_memory_bytes": peak_memory,
+        "finish_reason": finish_reason,
+        # The mock server answers with the text it receives
+        "identical": translated_text == text,
+    }
+
+
+def format_result(result: dict) -> str:
+    """Format a result on one line."""
+    line = (
+        f"{result['translator']:<10} {result['document']:<28} "
+        f"{result['size_bytes']:>10} {result['requests']:>8} "
+        f"{result['total_tokens']:>10} {result['wall_time']:>9.3f}"
+    )
+    for name in ("latency_p50", "latency_p95"):
+        line += f" {result[name]:>7.3f}" if result[name] is not None else f" {'-':>7}"
+    if result["peak_memory_bytes"] is not None:
+        line += f" {result['peak_memory_bytes'] / 1024 / 1024:>8.1f}"
+    else:
+        line += f" {'-':>8}"
+    return line + f" {result['finish_reason']}"
+
+
+def get_parser() -> argparse.ArgumentParser:
+    """Return the parser of the command line arguments."""
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.translation_benchmark",
+        description="Benchmark the translators against a local mock of the chat API.",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=float,
+        nargs="*",
+        default=[0.001, 0.01, 0.1, 1.0, 10.0],
+        help="Sizes of the synthetic documents, in MB.",
+    )
+    parser.add_argument(
+        "--translators",
+        nargs="*",
+        choices=TRANSLATORS,
+        default=list(TRANSLATORS),
+        help="The translators to benchmark.",
+    )
+    parser.add_argument("--model", default="llama3-70b-8192")
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=8,
+        help="The maximum number of requests in flight.",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="The time to first token, in seconds."
+    )
+    parser.add_argument(
+        "--throughput",
+        type=float,
+        default=5000.0,
+        help="The number of tokens generated per second by the mock server.",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="The probability of a 429 answer.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--no-memory",
+        dest="measure_memory",
+        action="store_false",
+        help="Do not measure the peak memory, which slows down the runs.",
+    )
+    parser.add_argument("--output", help="The JSON report. Defaults to the standard output.")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    arguments = get_parser().parse_args(argv)
+    server = MockChatServer(
+        latency=arguments.latency,
+        throughput=arguments.throughput,
+        error_rate=arguments.error_rate,
+        seed=arguments.seed,
+    )
+    with server:
+        # The clients of the process are created on first use, with this URL
+        os.environ["GROQ_BASE_URL"] = server.base_url
+        os.environ.setdefault("GROQ_API_KEY", "mock")
+        # Import the SDKs and open the connections before measuring
+        for translator_name in arguments.translators:
+            benchmark_translation(
+                server,
+                translator_name,
+                "warm-up",
+                "Bonjour.",
+                arguments.model,
+                arguments.max_concurrency,
+                measure_memory=False,
+            )
+        results = []
+        print(
+            f"{'translator':<10} {'document':<28} {'size':>10} {'requests':>8} "
+            f"{'tokens':>10} {'wall (s)':>9} {'p50 (s)':>7} {'p95 (s)':>7} "
+            f"{'peak (MB)':>8} finish",
+            file=sys.stderr,
+        )
+        for document_name, text in load_documents(arguments.sizes):
+            for translator_name in arguments.translators:
+                result = benchmark_translation(
+                    server,
+                    translator_name,
+                    document_name,
+                    text,
+                    arguments.model,
+                    arguments.max_concurrency,
+                    arguments.measure_memory,
+                )
+                results.append(result)
+                print(format_result(result), file=sys.stderr, flush=True)
+
+    report = {
+        "configuration": {
+            "model": arguments.model,
+            "max_concurrency": arguments.max_concurrency,
+            "latency": arguments.latency,
+            "throughput": arguments.throughput,
+            "error_rate": arguments.error_rate,
+            "seed": arguments.seed,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    if arguments.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(arguments.output, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
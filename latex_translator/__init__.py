@@ -0,0 +1,6 @@
+"""
+Building blocks of the LaTeX French-to-English translator.
+
+The modules of this package do not depend on Streamlit: they can be used
+from the Streamlit app, from scripts or from worker processes.
+"""
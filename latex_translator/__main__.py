@@ -0,0 +1,5 @@
+import sys
+
+from latex_translator.cli import main
+
+sys.exit(main())
@@ -0,0 +1,239 @@
+"""
+Persistent content-addressed cache of translations.
+
+A translation is identified by the hash of the source text, of the prompt,
+of the model and of the temperature.
+Translating a document again after a small change only pays for the
+pieces of text which changed: the other ones are read from an SQLite
+database on disk.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+
+
+def get_default_cache_directory() -> str:
+    """Return the directory where the translator stores its data.
+
+    The directory is given by the LATEX_TRANSLATOR_CACHE_DIR environment
+    variable if it is set, and is ~/.cache/latex_translator otherwise.
+
+    Returns
+    -------
+    directory : str
+        The path of the directory.
+    """
+    directory = os.environ.get("LATEX_TRANSLATOR_CACHE_DIR")
+    if not directory:
+        directory = os.path.join(os.path.expanduser("~"), ".cache", "latex_translator")
+    return directory
+
+
+class TranslationCache:
+    def __init__(self, path=None, max_size_bytes=100 * 1024 * 1024, enabled=True):
+        """Initialize the TranslationCache.
+
+        Parameters
+        ----------
+        path : str, optional
+            The path of the SQLite database.
+            Defaults to translation_cache.sqlite in the default cache directory.
+        max_size_bytes : int, optional
+            The maximum total size of the stored texts.
+            When it is exceeded, the least recently used entries are evicted.
+            Defaults to 100 MB.
+        enabled : bool, optional
+            If False, the cache is bypassed: nothing is read nor stored.
+            Defaults to True.
+        """
+        if path is None:
+            path = os.path.join(
+                get_default_cache_directory(), "translation_cache.sqlite"
+            )
+        if max_size_bytes <= 0:
+            raise ValueError(
+                f"The maximum size must be positive, but max_size_bytes={max_size_bytes}"
+            )
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                "key TEXT PRIMARY KEY, "
+                "translation TEXT NOT NULL, "
+                "finish_reason TEXT NOT NULL, "
+                "size INTEGER NOT NULL, "
+                "last_access REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS translations_last_access "
+                "ON translations (last_access)"
+            )
+            self._size_bytes = self._compute_size()
+
+    @staticmethod
+    def make_key(text: str, prompt: str, model: str, temperature: float) -> str:
+        """Compute the key of a translation.
+
+        Parameters
+        ----------
+        text : str
+            The source text.
+        prompt : str
+            The prompt instructions.
+        model : str
+            The name of the model.
+        temperature : float
+            The temperature of the model.
+
+        Returns
+        -------
+        key : str
+            The SHA-256 hex digest identifying the translation.
+        """
+        digest = hashlib.sha256()
+        for part in (text, prompt, model, repr(float(temperature))):
+            encoded = part.encode("utf-8")
+            # Prefix each part with its length, so that parts cannot collide
+            digest.update(len(encoded).to_bytes(8, "little"))
+            digest.update(encoded)
+        return digest.hexdigest()
+
+    def _compute_size(self) -> int:
+        row = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM translations"
+        ).fetchone()
+        return row[0]
+
+    def get(self, key: str) -> Optional[Tuple[str, str]]:
+        """Return the stored translation.
+
+        Parameters
+        ----------
+        key : str
+            The key of the translation, see make_key().
+
+        Returns
+        -------
+        entry : tuple(str, str) or None
+            The translation and the finish reason, or None if the key is not
+            in the cache or if the cache is disabled.
+        """
+        if not self.enabled:
+            return None
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT translation, finish_reason, last_access "
+                "FROM translations WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            now = time.time()
+            # Refreshing the access time costs a write: the eviction order
+            # does not need more than a one minute resolution.
+            if now - row[2] > 60.0:
+                self._connection.execute(
+                    "UPDATE translations SET last_access = ? WHERE key = ?",
+                    (now, key),
+                )
+        return row[0], row[1]
+
+    def put(self, key: str, translation: str, finish_reason: str) -> None:
+        """Store a translation.
+
+        Parameters
+        ----------
+        key : str
+            The key of the translation, see make_key().
+        translation : str
+            The translated text.
+        finish_reason : str
+            The finish reason of the AI job.
+        """
+        if not self.enabled:
+            return
+        size = len(translation.encode("utf-8")) + len(key)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO translations "
+                "(key, translation, finish_reason, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, translation, finish_reason, size, time.time()),
+            )
+            self._size_bytes += size
+            if self._size_bytes > self.max_size_bytes:
+                # The running total is approximate (replaced entries,
+                # other processes): recompute it before evicting.
+                self._size_bytes = self._compute_size()
+                self._evict()
+
+    def _evict(self) -> None:
+        """Remove the least recently used entries down to 90% of the maximum size."""
+        target_size = 0.9 * self.max_size_bytes
+        cursor = self._connection.execute(
+            "SELECT key, size FROM translations ORDER BY last_access"
+        )
+        evicted_keys = []
+        for key, size in cursor:
+            if self._size_bytes <= target_size:
+                break
+            evicted_keys.append((key,))
+            self._size_bytes -= size
+        cursor.close()
+        self._connection.executemany(
+            "DELETE FROM translations WHERE key = ?", evicted_keys
+        )
+        self.evictions += len(evicted_keys)
+
+    def clear(self) -> None:
+        """Remove all the entries and reset the counters."""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM translations")
+            self._size_bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT COUNT(*) FROM translations"
+            ).fetchone()
+        return row[0]
+
+    def get_statistics(self) -> dict:
+        """Return the counters of the cache.
+
+        Returns
+        -------
+        statistics : dict
+            The number of hits, misses and evictions, the number of entries
+            and the total size in bytes.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self),
+            "size_bytes": self._size_bytes,
+        }
+
+    def close(self) -> None:
+        """Close the database."""
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,206 @@
+"""
+Checkpoints of the translations in progress.
+
+The translations of the chunks of a document only live in memory until the
+whole document is translated: if the process restarts or the provider
+fails halfway through a thesis, the completed requests are lost.
+With a checkpoint, the translation of each chunk is appended to a JSON
+Lines file on disk as soon as it completes.
+
+The file of a translation is named after the hash of the document and of
+the settings which change its translation, so that translating the same
+document with the same settings again resumes it: the chunks found in the
+checkpoint are not sent again.
+The chunks are found by the hash of their text rather than by their
+index, so that they are found even if the document is split differently,
+e.g. when the translation memory reuses more paragraphs.
+The checkpoint is deleted when the translation is complete.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from latex_translator.cache import get_default_cache_directory
+
+# The extension of the checkpoint files
+CHECKPOINT_EXTENSION = ".jsonl"
+
+# The checkpoints of the translations which were not resumed are deleted
+# after a week
+CHECKPOINT_RETENTION_SECONDS = 7 * 24 * 3600.0
+
+
+def get_default_checkpoint_directory() -> str:
+    """Return the directory of the checkpoints, in the default cache directory."""
+    return os.path.join(get_default_cache_directory(), "checkpoints")
+
+
+def _hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_checkpoint_key(latex_content: str, settings: dict) -> str:
+    """Compute the key of the translation of a document.
+
+    Parameters
+    ----------
+    latex_content : str
+        The LaTeX content to translate.
+    settings : dict
+        The settings which change the translation, e.g. the model and the
+        prompt instructions. Its values must be serializable to JSON.
+
+    Returns
+    -------
+    key : str
+        The SHA-256 hex digest identifying the translation.
+    """
+    return _hash_text(
+        json.dumps(settings, sort_keys=True, ensure_ascii=False)
+        + "\n"
+        + latex_content
+    )
+
+
+def delete_old_checkpoints(
+    directory: Optional[str] = None, max_age: float = CHECKPOINT_RETENTION_SECONDS
+) -> int:
+    """Delete the checkpoints which were not written for a while.
+
+    Parameters
+    ----------
+    directory : str, optional
+        The directory of the checkpoints.
+        Defaults to the default checkpoint directory.
+    max_age : float, optional
+        The age in seconds beyond which a checkpoint is deleted.
+        Defaults to CHECKPOINT_RETENTION_SECONDS.
+
+    Returns
+    -------
+    number_deleted : int
+        The number of deleted checkpoints.
+    """
+    if directory is None:
+        directory = get_default_checkpoint_directory()
+    if not os.path.isdir(directory):
+        return 0
+    number_deleted = 0
+    limit = time.time() - max_age
+    for file_name in os.listdir(directory):
+        path = os.path.join(directory, file_name)
+        if not file_name.endswith(CHECKPOINT_EXTENSION):
+            continue
+        try:
+            if os.path.getmtime(path) < limit:
+                os.remove(path)
+                number_deleted += 1
+        except OSError:
+            # E.g. deleted by another process
+            pass
+    return number_deleted
+
+
+class Checkpoint:
+    def __init__(self, key: str, directory: Optional[str] = None):
+        """Initialize the Checkpoint, and read the chunks already translated.
+
+        Parameters
+        ----------
+        key : str
+            The key of the translation, see make_checkpoint_key().
+        directory : str, optional
+            The directory of the checkpoints.
+            Defaults to the default checkpoint directory.
+        """
+        if directory is None:
+            directory = get_default_checkpoint_directory()
+        os.makedirs(directory, exist_ok=True)
+        self.key = key
+        self.path = os.path.join(directory, key + CHECKPOINT_EXTENSION)
+        self._lock = threading.Lock()
+        # The record of each translated chunk, by hash of the chunk
+        self._records = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as checkpoint_file:
+                for line in checkpoint_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # The last line of a process killed while writing it
+                        continue
+                    self._records[record["chunk"]] = record
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._records)
+
+    def get(self, chunk: str) -> Optional[dict]:
+        """Return the translation of a chunk, if it is in the checkpoint.
+
+        Parameters
+        ----------
+        chunk : str
+            The LaTeX content of the chunk.
+
+        Returns
+        -------
+        record : dict or None
+            The translation, the tokens, the finish reason and the verdict
+            of the chunk, or None if it is not in the checkpoint.
+        """
+        with self._lock:
+            return self._records.get(_hash_text(chunk))
+
+    def record(
+        self,
+        chunk: str,
+        translation: str,
+        total_tokens: int,
+        finish_reason: str,
+        verdict: Optional[dict] = None,
+    ) -> None:
+        """Append the translation of a chunk to the checkpoint.
+
+        The line is flushed to the disk before returning, so that it
+        survives a crash of the process.
+
+        Parameters
+        ----------
+        chunk : str
+            The LaTeX content of the chunk.
+        translation : str
+            Its translation.
+        total_tokens : int
+            The number of tokens used to translate it.
+        finish_reason : str
+            The finish reason of the AI job.
+        verdict : dict, optional
+            The verdict of the validation of the chunk, if any.
+        """
+        record = {
+            "chunk": _hash_text(chunk),
+            "translation": translation,
+            "tokens": total_tokens,
+            "finish_reason": finish_reason,
+            "verdict": verdict,
+        }
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as checkpoint_file:
+                checkpoint_file.write(line)
+                checkpoint_file.flush()
+                os.fsync(checkpoint_file.fileno())
+            self._records[record["chunk"]] = record
+
+    def remove(self) -> None:
+        """Delete the checkpoint, e.g. when the translation is complete."""
+        with self._lock:
+            self._records = {}
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
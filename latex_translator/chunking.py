@@ -0,0 +1,309 @@
+"""
+Structure-aware splitting of a LaTeX document into chunks.
+
+A long document cannot be translated in one chat completion: the output is
+truncated or the request is rejected when it does not fit in the context
+of the model.
+This module splits the document at sectioning commands, paragraphs and
+environment boundaries, but never inside math, a tabular-like environment,
+a verbatim environment or a brace group.
+The pieces are then packed into chunks which fit a token budget.
+Concatenating the chunks gives back the document exactly.
+"""
+import re
+from typing import List, Tuple
+
+from latex_translator.models import get_context_window, get_max_output_tokens
+from latex_translator.tokens import estimate_tokens
+
+# Priorities of the split points
+PARAGRAPH_BREAK = 1
+ENVIRONMENT_BREAK = 1
+HEADING_BREAK = 2
+
+SECTION_COMMANDS = {
+    "part",
+    "chapter",
+    "section",
+    "subsection",
+    "subsubsection",
+    "paragraph",
+}
+
+# Environments inside which the document is never split
+ATOMIC_ENVIRONMENTS = {
+    "equation",
+    "equation*",
+    "align",
+    "align*",
+    "alignat",
+    "alignat*",
+    "gather",
+    "gather*",
+    "multline",
+    "multline*",
+    "flalign",
+    "flalign*",
+    "eqnarray",
+    "eqnarray*",
+    "displaymath",
+    "math",
+    "array",
+    "matrix",
+    "pmatrix",
+    "bmatrix",
+    "cases",
+    "tabular",
+    "tabular*",
+    "tabularx",
+    "longtable",
+    "table",
+    "table*",
+    "figure",
+    "figure*",
+    "tikzpicture",
+    "algorithm",
+    "algorithmic",
+}
+
+# Environments whose content is not LaTeX code
+VERBATIM_ENVIRONMENTS = {"verbatim", "verbatim*", "Verbatim", "lstlisting", "minted"}
+
+# Ratio between the number of tokens of the translation and of the source
+OUTPUT_TOKEN_RATIO = 1.2
+# Tokens kept free in the context window for the message formatting
+CONTEXT_SAFETY_MARGIN = 256
+
+_SCANNER = re.compile(
+    r"(?P<verb>\\verb\*?([^\sA-Za-z*]).*?\2)"
+    r"|\\begin\s*\{(?P<begin>[^{}]*)\}"
+    r"|\\end\s*\{(?P<end>[^{}]*)\}"
+    r"|\\(?P<heading>[A-Za-z]+)\*?"
+    r"|(?P<math>\$\$|\$|\\\[|\\\]|\\\(|\\\))"
+    r"|\\."
+    r"|%[^\n]*"
+    r"|(?P<open>\{)"
+    r"|(?P<close>\})"
+    r"|(?P<blank>\n(?:[ \t]*\n)+)",
+    re.DOTALL,
+)
+
+_MATH_CLOSERS = {"$": "$", "$$": "$$", "\\[": "\\]", "\\(": "\\)"}
+
+
+def _line_start(text: str, position: int) -> int:
+    """Move a split point to the start of its line if only blanks precede it."""
+    line_start = text.rfind("\n", 0, position) + 1
+    if text[line_start:position].strip():
+        return position
+    return line_start
+
+
+def _line_end(text: str, position: int) -> int:
+    """Move a split point after the end of line if only blanks follow it."""
+    line_end = text.find("\n", position)
+    if line_end < 0:
+        line_end = len(text)
+    if text[position:line_end].strip():
+        return position
+    return min(line_end + 1, len(text))
+
+
+def find_split_points(text: str) -> List[Tuple[int, int]]:
+    """Find the positions where a LaTeX document can be split.
+
+    Parameters
+    ----------
+    text : str
+        The LaTeX document.
+
+    Returns
+    -------
+    split_points : list of tuple(int, int)
+        The sorted positions and their priority: HEADING_BREAK before a
+        sectioning command, ENVIRONMENT_BREAK around an environment,
+        PARAGRAPH_BREAK after a blank line.
+    """
+    split_points = {}
+
+    def add_split_point(position, priority):
+        if 0 < position < len(text):
+            split_points[position] = max(priority, split_points.get(position, 0))
+
+    brace_depth = 0
+    atomic_depth = 0
+    math_closer = None
+    position = 0
+    while True:
+        match = _SCANNER.search(text, position)
+        if match is None:
+            break
+        position = match.end()
+        kind = match.lastgroup
+        if match.group("verb") is not None:
+            continue
+        if math_closer is not None:
+            # Inside inline or display math, only look for its end
+            if kind == "math" and match.group("math") == math_closer:
+                math_closer = None
+            continue
+        is_splittable = brace_depth == 0 and atomic_depth == 0
+        if kind == "begin":
+            environment = match.group("begin").strip()
+            if is_splittable and environment != "document":
+                add_split_point(_line_start(text, match.start()), ENVIRONMENT_BREAK)
+            if environment in VERBATIM_ENVIRONMENTS:
+                # Jump to the end of the environment without parsing it
+                end_tag = f"\\end{{{environment}}}"
+                end_position = text.find(end_tag, position)
+                if end_position < 0:
+                    break
+                position = end_position + len(end_tag)
+                if is_splittable:
+                    add_split_point(_line_end(text, position), ENVIRONMENT_BREAK)
+            elif environment in ATOMIC_ENVIRONMENTS:
+                atomic_depth += 1
+            elif environment == "document":
+                add_split_point(_line_end(text, position), ENVIRONMENT_BREAK)
+        elif kind == "end":
+            environment = match.group("end").strip()
+            if environment in ATOMIC_ENVIRONMENTS:
+                atomic_depth = max(atomic_depth - 1, 0)
+            if brace_depth == 0 and atomic_depth == 0:
+                if environment == "document":
+                    add_split_point(_line_start(text, match.start()), ENVIRONMENT_BREAK)
+                else:
+                    add_split_point(_line_end(text, position), ENVIRONMENT_BREAK)
+        elif kind == "heading":
+            if is_splittable and match.group("heading") in SECTION_COMMANDS:
+                add_split_point(_line_start(text, match.start()), HEADING_BREAK)
+        elif kind == "math":
+            delimiter = match.group("math")
+            if delimiter in _MATH_CLOSERS:
+                math_closer = _MATH_CLOSERS[delimiter]
+        elif kind == "open":
+            brace_depth += 1
+        elif kind == "close":
+            brace_depth = max(brace_depth - 1, 0)
+        elif kind == "blank":
+            if is_splittable:
+                add_split_point(position, PARAGRAPH_BREAK)
+    return sorted(split_points.items())
+
+
+def split_latex_blocks(text: str) -> List[Tuple[str, int]]:
+    """Split a LaTeX document into its smallest safe blocks.
+
+    Parameters
+    ----------
+    text : str
+        The LaTeX document.
+
+    Returns
+    -------
+    blocks : list of tuple(str, int)
+        The blocks and the priority of the split point which starts them
+        (0 for the first block).
+        Concatenating the blocks gives back the document.
+    """
+    blocks = []
+    start = 0
+    start_priority = 0
+    for position, priority in find_split_points(text):
+        blocks.append((text[start:position], start_priority))
+        start = position
+        start_priority = priority
+    blocks.append((text[start:], start_priority))
+    return blocks
+
+
+def get_chunk_token_budget(model: str, prompt_tokens: int = 0) -> int:
+    """Return the number of source tokens of a chunk for a model.
+
+    The prompt, the chunk and its translation must fit in the context
+    window, and the translation must fit in the maximum output.
+
+    Parameters
+    ----------
+    model : str
+        The name of the model.
+    prompt_tokens : int, optional
+        The number of tokens of the prompt instructions. Defaults to 0.
+
+    Returns
+    -------
+    budget : int
+        The maximum number of tokens of a chunk.
+    """
+    available_tokens = get_context_window(model) - prompt_tokens - CONTEXT_SAFETY_MARGIN
+    budget = min(
+        available_tokens / (1.0 + OUTPUT_TOKEN_RATIO),
+        get_max_output_tokens(model) / OUTPUT_TOKEN_RATIO,
+    )
+    return max(int(budget), 1)
+
+
+def split_latex_document(text: str, max_tokens: int) -> List[str]:
+    """Split a LaTeX document into chunks which fit a token budget.
+
+    The blocks of split_latex_blocks() are packed by pack_latex_blocks().
+
+    Parameters
+    ----------
+    text : str
+        The LaTeX document.
+    max_tokens : int
+        The maximum number of tokens of a chunk.
+
+    Returns
+    -------
+    chunks : list of str
+        The chunks. Concatenating them gives back the document.
+    """
+    return pack_latex_blocks(split_latex_blocks(text), max_tokens)
+
+
+def pack_latex_blocks(blocks: List[Tuple[str, int]], max_tokens: int) -> List[str]:
+    """Pack the blocks of a LaTeX document into chunks which fit a token budget.
+
+    The blocks are packed greedily.
+    A new chunk is also started at a sectioning command when the current
+    chunk is already half full, so that the chunks follow the structure of
+    the document.
+    A block which alone exceeds the budget cannot be split safely: it makes
+    a chunk on its own.
+
+    Parameters
+    ----------
+    blocks : list of tuple(str, int)
+        The blocks of the document and the priorities of their split
+        points, see split_latex_blocks().
+    max_tokens : int
+        The maximum number of tokens of a chunk.
+
+    Returns
+    -------
+    chunks : list of str
+        The chunks. Concatenating them gives back the blocks.
+    """
+    if max_tokens < 1:
+        raise ValueError(
+            f"The token budget must be at least 1, but max_tokens={max_tokens}"
+        )
+    chunks = []
+    current_blocks = []
+    current_tokens = 0
+    for block, priority in blocks:
+        block_tokens = estimate_tokens(block)
+        if current_blocks and (
+            current_tokens + block_tokens > max_tokens
+            or (priority >= HEADING_BREAK and 2 * current_tokens >= max_tokens)
+        ):
+            chunks.append("".join(current_blocks))
+            current_blocks = []
+            current_tokens = 0
+        current_blocks.append(block)
+        current_tokens += block_tokens
+    if current_blocks:
+        chunks.append("".join(current_blocks))
+    return chunks
@@ -0,0 +1,689 @@
+"""
+Command line translation of LaTeX files, without the Streamlit app.
+
+The files are given on the command line, as files or directories which are
+searched for .tex files, or in a manifest with one path per line.
+Several files are translated at the same time by a pool of workers, and a
+semaphore shared by all the translators bounds the total number of
+requests in flight, whatever the number of files.
+
+Example
+-------
+Translate the proceedings overnight, writing the translations in another
+tree:
+
+    python -m latex_translator proceedings/ --output-dir proceedings_en --jobs 4
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from latex_translator.cache import TranslationCache
+from latex_translator.checkpoint import (
+    delete_old_checkpoints,
+    get_default_checkpoint_directory,
+)
+from latex_translator.clients import PROVIDERS
+from latex_translator.comparison import (
+    compare_models,
+    get_default_history_path,
+    save_comparison,
+)
+from latex_translator.glossary import Glossary, load_glossary
+from latex_translator.memory import TranslationMemory
+from latex_translator.ratelimit import get_rate_limiter
+from latex_translator.routing import Router, get_endpoint, parse_endpoint
+from latex_translator.translator import LaTeXRawTranslator
+
+DEFAULT_SUFFIX = "_en"
+
+TRACE_FORMATS = ("otlp", "json")
+
+
+def read_manifest(manifest_path: str) -> List[str]:
+    """Read the paths of a manifest.
+
+    Parameters
+    ----------
+    manifest_path : str
+        The manifest: one path per line.
+        The blank lines and the lines starting with '#' are ignored.
+        The relative paths are relative to the directory of the manifest.
+
+    Returns
+    -------
+    paths : list of str
+        The paths of the manifest.
+    """
+    manifest_directory = os.path.dirname(os.path.abspath(manifest_path))
+    paths = []
+    with open(manifest_path, encoding="utf-8") as manifest_file:
+        for line in manifest_file:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                paths.append(os.path.join(manifest_directory, line))
+    return paths
+
+
+def find_input_files(inputs: List[str], suffix: str = DEFAULT_SUFFIX) -> List[Tuple[str, str]]:
+    """Find the .tex files to translate.
+
+    Parameters
+    ----------
+    inputs : list of str
+        The files and the directories.
+        The directories are searched recursively for .tex files.
+    suffix : str, optional
+        The suffix of the translated files.
+        The files of a directory which end with it are skipped, since they
+        are the output of a previous run.
+
+    Returns
+    -------
+    input_files : list of tuple(str, str)
+        The path of each file and the directory from which its output path
+        is computed: the searched directory, or the directory of the file.
+        A file found several times is only returned once.
+    """
+    input_files = []
+    known_paths = set()
+
+    def add_file(path, root):
+        path = os.path.abspath(path)
+        if path not in known_paths:
+            known_paths.add(path)
+            input_files.append((path, os.path.abspath(root)))
+
+    for input_path in inputs:
+        if os.path.isdir(input_path):
+            for directory, subdirectories, file_names in os.walk(input_path):
+                subdirectories.sort()
+                for file_name in sorted(file_names):
+                    stem, extension = os.path.splitext(file_name)
+                    if extension != ".tex" or (suffix and stem.endswith(suffix)):
+                        continue
+                    add_file(os.path.join(directory, file_name), input_path)
+        elif os.path.isfile(input_path):
+            add_file(input_path, os.path.dirname(os.path.abspath(input_path)))
+        else:
+            raise FileNotFoundError(f"No such file or directory: {input_path}")
+    return input_files
+
+
+def get_output_path(
+    input_path: str, root: str, output_directory: Optional[str] = None, suffix: str = ""
+) -> str:
+    """Return the path of the translation of a file.
+
+    Parameters
+    ----------
+    input_path : str
+        The path of the file to translate.
+    root : str
+        The directory from which the relative path of the file is computed.
+    output_directory : str, optional
+        The directory of the output tree.
+        If None, the translation is written next to the file.
+    suffix : str, optional
+        The suffix added to the name of the file, before the extension.
+
+    Returns
+    -------
+    output_path : str
+        The path of the translated file.
+    """
+    stem, extension = os.path.splitext(input_path)
+    output_path = stem + suffix + extension
+    if output_directory is None:
+        return output_path
+    return os.path.join(output_directory, os.path.relpath(output_path, root))
+
+
+def translate_file(
+    translator: LaTeXRawTranslator,
+    input_path: str,
+    output_path: str,
+    trace_path: Optional[str] = None,
+    trace_format: str = "otlp",
+) -> dict:
+    """Translate one file and write its translation.
+
+    Parameters
+    ----------
+    translator : LaTeXRawTranslator
+        The translator, which must not be used by another thread.
+    input_path : str
+        The path of the file to translate.
+    output_path : str
+        The path of the translated file.
+    trace_path : str, optional
+        The path of the trace of the translation, e.g. to find the slow
+        stages. If None, the trace is not written.
+    trace_format : str, optional
+        The format of the trace, "otlp" for OpenTelemetry or "json".
+        Defaults to "otlp".
+
+    Returns
+    -------
+    summary : dict
+        The input and output paths, the number of tokens, the duration in
+        seconds, the finish reason, the errors, the verdicts of the
+        invalid chunks, the statistics of each model, the use of the
+        translation memory and the number of chunks read from the
+        checkpoint.
+    """
+    start_time = time.time()
+    with open(input_path, encoding="utf-8") as input_file:
+        latex_content = input_file.read()
+    translated_content, total_tokens, finish_reason = translator.translate(latex_content)
+    output_directory = os.path.dirname(output_path)
+    if output_directory:
+        os.makedirs(output_directory, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as output_file:
+        output_file.write(translated_content)
+    if trace_path is not None:
+        trace_directory = os.path.dirname(trace_path)
+        if trace_directory:
+            os.makedirs(trace_directory, exist_ok=True)
+        if trace_format == "otlp":
+            trace = translator.tracer.to_otlp()
+        else:
+            trace = translator.tracer.to_json()
+        with open(trace_path, "w", encoding="utf-8") as trace_file:
+            json.dump(trace, trace_file, indent=2)
+    return {
+        "input": input_path,
+        "output": output_path,
+        "tokens": total_tokens,
+        "duration": time.time() - start_time,
+        "finish_reason": finish_reason,
+        "errors": list(translator.errors),
+        "invalid_chunks": [
+            verdict for verdict in translator.verdicts if not verdict["valid"]
+        ],
+        "tiers": translator.get_tier_statistics(),
+        "memory": dict(translator.memory_statistics),
+        "resumed_chunks": translator.resumed_chunks,
+    }
+
+
+def format_summary(summary: dict) -> str:
+    """Format the summary of a file on one line."""
+    line = (
+        f"{summary['input']} -> {summary['output']} : "
+        f"{summary['tokens']} tokens, {summary['duration']:.2f} (s), "
+        f"{summary['finish_reason']}"
+    )
+    if summary.get("resumed_chunks"):
+        line += f", {summary['resumed_chunks']} bloc(s) repris du point de contrôle"
+    for error in summary["errors"]:
+        line += f"\n    Erreur : {error}"
+    for verdict in summary.get("invalid_chunks", []):
+        line += f"\n    Bloc {verdict['index']} invalide : {'; '.join(verdict['issues'])}"
+    return line
+
+
+def format_forecast(forecast: dict) -> str:
+    """Format the forecast of a file on one line."""
+    line = (
+        f"{forecast['requests']} requête(s), "
+        f"{forecast['prompt_tokens']} tokens envoyés, "
+        f"{forecast['completion_tokens']} tokens générés, "
+        f"environ {forecast['duration']:.1f} (s)"
+    )
+    if forecast["cost"] is not None:
+        line += f", environ {forecast['cost']:.4f} $"
+    return line
+
+
+def merge_tier_statistics(summaries: List[dict]) -> List[dict]:
+    """Sum the statistics of each model over the summaries of the files."""
+    tiers = {}
+    for summary in summaries:
+        for tier in summary.get("tiers", []):
+            if tier["model"] not in tiers:
+                tiers[tier["model"]] = dict(tier)
+            else:
+                for key in ("requests", "tokens", "duration", "chunks"):
+                    tiers[tier["model"]][key] += tier[key]
+    return list(tiers.values())
+
+
+def format_tiers(tiers: List[dict]) -> str:
+    """Format the statistics of the models of the cascade, one line per model."""
+    text = "Cascade :"
+    for tier in tiers:
+        text += (
+            f"\n    {tier['model']} : {tier['chunks']} bloc(s), "
+            f"{tier['requests']} requête(s), {tier['tokens']} tokens, "
+            f"{tier['duration']:.2f} (s)"
+        )
+        if tier["requests"] > 0:
+            text += f", {tier['duration'] / tier['requests']:.2f} (s) par requête"
+    return text
+
+
+def format_comparison(results: List[dict]) -> str:
+    """Format the results of a comparison, one line per configuration."""
+    lines = []
+    for result in results:
+        line = (
+            f"    {result['model']} ({result['temperature']}) : "
+            f"{result['tokens']} tokens, {result['finish_reason']}"
+        )
+        if result["time_to_first_token"] is not None:
+            line += f", premier token {result['time_to_first_token']:.2f} (s)"
+        if result["duration"] is not None:
+            line += f", {result['duration']:.2f} (s)"
+        if result["tokens_per_second"] is not None:
+            line += f", {result['tokens_per_second']:.0f} tokens/s"
+        if result["checked_chunks"] > 0:
+            line += f", {result['valid_chunks']}/{result['checked_chunks']} blocs valides"
+        for error in result["errors"]:
+            line += f"\n        Erreur : {error}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def format_routing(statistics: dict) -> str:
+    """Format the statistics of the router, one line per endpoint."""
+    text = (
+        f"Routage : {statistics['failovers']} bascule(s), "
+        f"{statistics['hedged_requests']} requête(s) doublée(s), "
+        f"dont {statistics['hedge_wins']} gagnée(s) par le second modèle"
+    )
+    for endpoint in statistics["endpoints"]:
+        text += (
+            f"\n    {endpoint['name']} : {endpoint['requests']} requête(s), "
+            f"{endpoint['failures']} échec(s)"
+        )
+        if endpoint["p50"] is not None:
+            text += f", p50 {endpoint['p50']:.2f} (s), p95 {endpoint['p95']:.2f} (s)"
+    return text
+
+
+def get_parser() -> argparse.ArgumentParser:
+    """Return the parser of the command line arguments."""
+    parser = argparse.ArgumentParser(
+        prog="python -m latex_translator",
+        description="Translate LaTeX files from french to english.",
+    )
+    parser.add_argument(
+        "inputs", nargs="*", help="The .tex files or the directories to translate."
+    )
+    parser.add_argument(
+        "--manifest", help="A file which lists the files to translate, one per line."
+    )
+    parser.add_argument(
+        "--output-dir",
+        help="The directory of the translated files, which mirrors the input "
+        "tree. By default, each translation is written next to its file.",
+    )
+    parser.add_argument(
+        "--suffix",
+        help=f"The suffix of the translated files. Defaults to '{DEFAULT_SUFFIX}', "
+        "or to no suffix with --output-dir.",
+    )
+    parser.add_argument(
+        "--skip-existing",
+        action="store_true",
+        help="Do not translate the files whose translation already exists.",
+    )
+    parser.add_argument("--provider", choices=PROVIDERS, default="groq")
+    parser.add_argument("--model", default="llama3-70b-8192")
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument(
+        "--fallback",
+        action="append",
+        default=[],
+        metavar="ENDPOINT",
+        help="Another endpoint, used when the model is slow or fails, e.g. "
+        "'openai:gpt-4o-mini' or 'openai:llama3@http://127.0.0.1:8000/v1'. "
+        "Can be given several times.",
+    )
+    parser.add_argument(
+        "--cascade",
+        action="append",
+        default=[],
+        metavar="MODEL",
+        help="A larger model of the provider, to which the chunks whose "
+        "translation fails the checks are sent, e.g. --model llama3-8b-8192 "
+        "--cascade llama3-70b-8192. Can be given several times, from the "
+        "smallest model to the largest.",
+    )
+    parser.add_argument(
+        "--hedge",
+        action="store_true",
+        help="Send the slow requests to a second endpoint too, and keep the "
+        "first answer.",
+    )
+    parser.add_argument(
+        "--no-latex-mode",
+        dest="latex_mode",
+        action="store_false",
+        help="Do not ask the AI to preserve the LaTeX syntax.",
+    )
+    parser.add_argument(
+        "--no-masking",
+        dest="use_masking",
+        action="store_false",
+        help="Send the formulas, the citations and the references to the AI "
+        "instead of placeholders.",
+    )
+    parser.add_argument("--tone", default="", help="The description of the tone.")
+    parser.add_argument(
+        "--keywords", default="", help="The keywords, separated by commas."
+    )
+    parser.add_argument(
+        "--glossary",
+        action="append",
+        default=[],
+        metavar="FILE",
+        help="A TSV or CSV glossary: the French term, then its translation. "
+        "Only the terms found in a chunk are sent with it. "
+        "Can be given several times: the later files take precedence.",
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=4, help="The number of files translated at once."
+    )
+    parser.add_argument(
+        "--max-requests",
+        type=int,
+        default=8,
+        help="The maximum number of requests in flight, for all the files.",
+    )
+    parser.add_argument(
+        "--max-chunk-tokens",
+        type=int,
+        help="The maximum number of tokens of a chunk. "
+        "By default, it is derived from the context window of the model.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="use_cache",
+        action="store_false",
+        help="Do not use the translation cache.",
+    )
+    parser.add_argument(
+        "--no-memory",
+        dest="use_memory",
+        action="store_false",
+        help="Do not use the translation memory, which reuses the translation "
+        "of the paragraphs almost identical to past ones and sends the similar "
+        "ones as examples.",
+    )
+    parser.add_argument(
+        "--no-checkpoints",
+        dest="use_checkpoints",
+        action="store_false",
+        help="Do not write the translation of each chunk to a checkpoint as "
+        "soon as it completes. By default, translating a file again after an "
+        "interruption, with the same settings, resumes from its checkpoint.",
+    )
+    parser.add_argument(
+        "--forecast",
+        action="store_true",
+        help="Print the forecast of the tokens, the duration and the cost of "
+        "each file, without translating.",
+    )
+    parser.add_argument(
+        "--compare",
+        action="append",
+        default=[],
+        metavar="MODEL",
+        help="Compare this model with the others given with --compare on each "
+        "file, without writing the translations: the tokens, the durations and "
+        f"the validation are printed and appended to {get_default_history_path()}. "
+        "Can be given several times.",
+    )
+    parser.add_argument(
+        "--compare-temperature",
+        action="append",
+        type=float,
+        default=[],
+        metavar="TEMPERATURE",
+        help="A temperature of the compared models. Can be given several "
+        "times. Defaults to --temperature.",
+    )
+    parser.add_argument(
+        "--trace-dir",
+        help="Write the trace of the stages of each translation in this "
+        "directory, as <file>.trace.json.",
+    )
+    parser.add_argument(
+        "--trace-format",
+        choices=TRACE_FORMATS,
+        default="otlp",
+        help="The format of the traces: OTLP/JSON for OpenTelemetry, or JSON.",
+    )
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Translate the files of the command line.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments. Defaults to sys.argv[1:].
+
+    Returns
+    -------
+    exit_code : int
+        0 if all the files were translated completely, 1 otherwise.
+    """
+    parser = get_parser()
+    arguments = parser.parse_args(argv)
+    if arguments.jobs < 1 or arguments.max_requests < 1:
+        parser.error("--jobs and --max-requests must be at least 1")
+    suffix = arguments.suffix
+    if suffix is None:
+        suffix = "" if arguments.output_dir else DEFAULT_SUFFIX
+    inputs = list(arguments.inputs)
+    if arguments.manifest:
+        inputs += read_manifest(arguments.manifest)
+    if not inputs:
+        parser.error("no file to translate")
+    try:
+        input_files = find_input_files(inputs, suffix)
+    except FileNotFoundError as e:
+        parser.error(str(e))
+
+    tasks = []
+    for input_path, root in input_files:
+        output_path = get_output_path(input_path, root, arguments.output_dir, suffix)
+        if os.path.abspath(output_path) == input_path:
+            parser.error(f"The translation of {input_path} would overwrite it")
+        if arguments.skip_existing and os.path.exists(output_path):
+            print(f"{input_path} : déjà traduit, ignoré")
+            continue
+        trace_path = None
+        if arguments.trace_dir:
+            trace_path = (
+                os.path.splitext(
+                    get_output_path(input_path, root, arguments.trace_dir, suffix)
+                )[0]
+                + ".trace.json"
+            )
+        tasks.append((input_path, output_path, trace_path))
+
+    router = None
+    if arguments.fallback or arguments.hedge:
+        try:
+            fallback_endpoints = [parse_endpoint(text) for text in arguments.fallback]
+        except ValueError as e:
+            parser.error(str(e))
+        router = Router(
+            [get_endpoint(arguments.provider, arguments.model)] + fallback_endpoints,
+            hedge=arguments.hedge,
+        )
+
+    cache = TranslationCache() if arguments.use_cache else None
+    memory = TranslationMemory() if arguments.use_memory else None
+    try:
+        checkpoint_directory = None
+        if arguments.use_checkpoints:
+            checkpoint_directory = get_default_checkpoint_directory()
+            delete_old_checkpoints(checkpoint_directory)
+        request_semaphore = threading.BoundedSemaphore(arguments.max_requests)
+        keywords_list = [
+            keyword.strip()
+            for keyword in arguments.keywords.split(",")
+            if keyword.strip()
+        ]
+        glossary = None
+        if arguments.glossary:
+            glossary = Glossary()
+            for glossary_path in arguments.glossary:
+                try:
+                    glossary.update(load_glossary(glossary_path))
+                except OSError as e:
+                    parser.error(str(e))
+            print(f"Glossaire : {len(glossary)} termes")
+
+        def create_translator():
+            return LaTeXRawTranslator(
+                use_groq=arguments.provider == "groq",
+                model=arguments.model,
+                latex_mode=arguments.latex_mode,
+                temperature=arguments.temperature,
+                tone_description=arguments.tone,
+                keywords_list=keywords_list,
+                cache=cache,
+                max_concurrency=arguments.max_requests,
+                max_chunk_tokens=arguments.max_chunk_tokens,
+                request_semaphore=request_semaphore,
+                use_masking=arguments.use_masking,
+                router=router,
+                glossary=glossary,
+                cascade_models=arguments.cascade,
+                memory=memory,
+                checkpoint_directory=checkpoint_directory,
+            )
+
+        if arguments.forecast:
+            # Nothing is sent to the AI
+            forecasts = []
+            for input_path, _, _ in tasks:
+                with open(input_path, encoding="utf-8") as input_file:
+                    forecast = create_translator().forecast(input_file.read())
+                forecasts.append(forecast)
+                print(f"{input_path} : {format_forecast(forecast)}")
+                for warning in forecast["warnings"]:
+                    print(f"    Attention : {warning}")
+            costs = [forecast["cost"] for forecast in forecasts]
+            print(
+                f"{len(forecasts)} fichiers : "
+                f"{sum(forecast['requests'] for forecast in forecasts)} requêtes, "
+                f"{sum(forecast['total_tokens'] for forecast in forecasts)} tokens"
+                + (f", environ {sum(costs):.4f} $" if None not in costs else "")
+            )
+            return 0
+
+        if arguments.compare:
+            # The translations are not written
+            configurations = [
+                (model, temperature)
+                for model in arguments.compare
+                for temperature in (
+                    arguments.compare_temperature or [arguments.temperature]
+                )
+            ]
+            for input_path, _, _ in tasks:
+                with open(input_path, encoding="utf-8") as input_file:
+                    latex_content = input_file.read()
+                results = compare_models(
+                    latex_content, create_translator, configurations
+                )
+                save_comparison(latex_content, results)
+                print(f"{input_path} :\n{format_comparison(results)}", flush=True)
+            return 0
+
+        def translate_task(input_path, output_path, trace_path):
+            return translate_file(
+                create_translator(),
+                input_path,
+                output_path,
+                trace_path,
+                arguments.trace_format,
+            )
+
+        start_time = time.time()
+        summaries = []
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=arguments.jobs
+        ) as executor:
+            futures = {
+                executor.submit(translate_task, *task): task[0]
+                for task in tasks
+            }
+            for number_done, future in enumerate(
+                concurrent.futures.as_completed(futures), 1
+            ):
+                try:
+                    summary = future.result()
+                except Exception as e:
+                    # E.g. the file cannot be read or written
+                    summary = {
+                        "input": futures[future],
+                        "output": "-",
+                        "tokens": 0,
+                        "duration": 0.0,
+                        "finish_reason": "Erreur",
+                        "errors": [str(e)],
+                    }
+                summaries.append(summary)
+                print(
+                    f"[{number_done}/{len(tasks)}] {format_summary(summary)}",
+                    flush=True,
+                )
+
+        number_complete = sum(
+            summary["finish_reason"] == "stop" for summary in summaries
+        )
+        print(
+            f"{number_complete}/{len(summaries)} fichiers traduits, "
+            f"{sum(summary['tokens'] for summary in summaries)} tokens, "
+            f"{time.time() - start_time:.2f} (s)"
+        )
+        limiter_statistics = get_rate_limiter(arguments.provider).get_statistics()
+        if limiter_statistics["throttled"] > 0 or limiter_statistics["retries"] > 0:
+            print(
+                f"Limitation : {limiter_statistics['throttled']} réponse(s) 429, "
+                f"{limiter_statistics['retries']} nouvelle(s) tentative(s), "
+                f"{limiter_statistics['wait_time']:.2f} (s) d'attente"
+            )
+        if arguments.cascade:
+            print(format_tiers(merge_tier_statistics(summaries)))
+        if router is not None:
+            print(format_routing(router.get_statistics()))
+        if memory is not None:
+            memory_totals = {"reused_blocks": 0, "examples": 0, "stored_segments": 0}
+            for summary in summaries:
+                for key, value in summary.get("memory", {}).items():
+                    memory_totals[key] += value
+            print(
+                f"Mémoire : {memory_totals['reused_blocks']} paragraphe(s) repris, "
+                f"{memory_totals['examples']} exemple(s) envoyé(s), "
+                f"{memory_totals['stored_segments']} paragraphe(s) ajouté(s), "
+                f"{len(memory)} au total"
+            )
+        for summary in summaries:
+            if summary["finish_reason"] != "stop":
+                print(f"Incomplet : {summary['input']} ({summary['finish_reason']})")
+        return 0 if number_complete == len(summaries) else 1
+    finally:
+        # Also on the early returns and on the errors of the arguments
+        if cache is not None:
+            cache.close()
+        if memory is not None:
+            memory.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""
+Process-wide clients of the LLM providers.
+
+Creating a client for each translation pays for the TCP and TLS setup each
+time and leaks a connection pool.
+The clients of this module are created once per process and shared by all
+the translators, e.g. by all the sessions of a Streamlit server, so that
+the connections are kept alive from one request to the next.
+
+The pool is configured with environment variables:
+
+- LATEX_TRANSLATOR_MAX_CONNECTIONS : maximum number of connections (20),
+- LATEX_TRANSLATOR_MAX_KEEPALIVE : maximum number of idle connections (10),
+- LATEX_TRANSLATOR_KEEPALIVE_EXPIRY : idle time before closing a connection,
+  in seconds (60),
+- LATEX_TRANSLATOR_CONNECT_TIMEOUT : timeout of the connection, in seconds (10),
+- LATEX_TRANSLATOR_TIMEOUT : timeout of a request, in seconds (120).
+
+HTTP/2 is used when the h2 package is installed (pip install httpx[http2]).
+
+A provider can also be reached at another base URL, e.g. a local
+OpenAI-compatible server: each base URL has its own shared client.
+
+The SDKs and httpx are imported when the first client is created, so that
+the worker processes which do not send requests do not load them.
+"""
+import atexit
+import importlib.util
+import os
+import threading
+
+from latex_translator.engine import run_coroutine
+
+PROVIDERS = ("groq", "openai")
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _get_float_setting(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+def get_http_settings() -> dict:
+    """Return the settings of the HTTP connection pools.
+
+    Returns
+    -------
+    settings : dict
+        The keyword arguments of httpx.Client: limits, timeout and http2.
+    """
+    import httpx
+
+    limits = httpx.Limits(
+        max_connections=int(_get_float_setting("LATEX_TRANSLATOR_MAX_CONNECTIONS", 20)),
+        max_keepalive_connections=int(
+            _get_float_setting("LATEX_TRANSLATOR_MAX_KEEPALIVE", 10)
+        ),
+        keepalive_expiry=_get_float_setting("LATEX_TRANSLATOR_KEEPALIVE_EXPIRY", 60.0),
+    )
+    timeout = httpx.Timeout(
+        _get_float_setting("LATEX_TRANSLATOR_TIMEOUT", 120.0),
+        connect=_get_float_setting("LATEX_TRANSLATOR_CONNECT_TIMEOUT", 10.0),
+    )
+    return {
+        "limits": limits,
+        "timeout": timeout,
+        "http2": importlib.util.find_spec("h2") is not None,
+    }
+
+
+def _create_client(provider: str, is_async: bool, base_url=None):
+    """Create the client of a provider with its connection pool."""
+    import httpx
+
+    settings = get_http_settings()
+    http_client_class = httpx.AsyncClient if is_async else httpx.Client
+    if provider == "groq":
+        from groq import AsyncGroq, Groq
+
+        client_class = AsyncGroq if is_async else Groq
+        return client_class(
+            # This is the default and can be omitted
+            api_key=os.environ.get("GROQ_API_KEY"),
+            # If None, GROQ_BASE_URL or the Groq API
+            base_url=base_url,
+            timeout=settings["timeout"],
+            # The retries are done by latex_translator.ratelimit
+            max_retries=0,
+            http_client=http_client_class(
+                proxy=os.environ.get("HTTP_PROXY"),
+                verify=False,  # or path to your CA bundle
+                **settings,
+            ),
+        )
+    if provider == "openai":
+        from openai import AsyncOpenAI, OpenAI
+
+        client_class = AsyncOpenAI if is_async else OpenAI
+        return client_class(
+            base_url=base_url,
+            timeout=settings["timeout"],
+            max_retries=0,
+            http_client=http_client_class(**settings),
+        )
+    raise ValueError(f"Unknown provider {provider}, expected one of {PROVIDERS}")
+
+
+def _get_or_create_client(provider: str, is_async: bool, base_url=None):
+    key = (provider, is_async, base_url)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _create_client(provider, is_async, base_url)
+            _clients[key] = client
+    return client
+
+
+def get_client(provider: str = "groq", base_url=None):
+    """Return the shared client of a provider.
+
+    The client is thread-safe.
+
+    Parameters
+    ----------
+    provider : str, optional
+        The provider, "groq" or "openai". Defaults to "groq".
+    base_url : str, optional
+        The URL of the API, e.g. of a local OpenAI-compatible server.
+        If None, use the default URL of the provider.
+
+    Returns
+    -------
+    client : groq.Groq or openai.OpenAI
+        The client.
+    """
+    return _get_or_create_client(provider, False, base_url)
+
+
+def get_async_client(provider: str = "groq"):
+    """Return the shared async client of a provider.
+
+    The client must only be used in the shared event loop, see
+    latex_translator.engine.run_coroutine().
+
+    Parameters
+    ----------
+    provider : str, optional
+        The provider, "groq" or "openai". Defaults to "groq".
+
+    Returns
+    -------
+    client : groq.AsyncGroq or openai.AsyncOpenAI
+        The client.
+    """
+    return _get_or_create_client(provider, True)
+
+
+@atexit.register
+def close_clients() -> None:
+    """Close the shared clients and their connections.
+
+    The clients are created again if they are used afterwards.
+    """
+    with _clients_lock:
+        clients = list(_clients.items())
+        _clients.clear()
+    for (_, is_async, _), client in clients:
+        try:
+            if is_async:
+                run_coroutine(client.close())
+            else:
+                client.close()
+        except Exception as e:
+            print(f"Erreur lors de la fermeture du client : {str(e)}")
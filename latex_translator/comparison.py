@@ -0,0 +1,223 @@
+"""
+Comparison of several models on the same document.
+
+The descriptions of the models only give an impression of their quality
+and of their speed.
+This module sends the same document to several models, each one at one or
+several temperatures, concurrently, and measures each configuration: the
+tokens, the time to first token, the total duration, the throughput, and
+the structural validation of the chunks of its translation.
+The results are appended to a JSON Lines history, so that the fastest
+model which is good enough can be chosen from the data of past
+comparisons.
+
+Each configuration is measured as it is: the cache, the translation
+memory, the checkpoints, the cascade, the router and the retries of the
+invalid chunks are disabled.
+The chunks are streamed to measure the time to first token, so that they
+are translated one after the other: comparing the models on an excerpt
+of a long document is faster.
+"""
+import concurrent.futures
+import hashlib
+import json
+import os
+import time
+import uuid
+from typing import List, Optional, Tuple
+
+from latex_translator.cache import get_default_cache_directory
+from latex_translator.reporting import TranslationReporter
+from latex_translator.tokens import estimate_tokens
+
+
+def get_default_history_path() -> str:
+    """Return the path of the history of the comparisons, in the default cache directory."""
+    return os.path.join(get_default_cache_directory(), "comparisons.jsonl")
+
+
+def compare_models(
+    latex_content: str,
+    create_translator,
+    configurations: List[Tuple[str, float]],
+    max_workers: Optional[int] = None,
+    reporter: Optional[TranslationReporter] = None,
+) -> List[dict]:
+    """Translate a document with several configurations concurrently.
+
+    Parameters
+    ----------
+    latex_content : str
+        The LaTeX content to translate.
+    create_translator : callable
+        A function which returns a new translator, e.g. with the prompt of
+        the session. It is called from the calling thread, once per
+        configuration, and its model and temperature are replaced.
+    configurations : list of tuple(str, float)
+        The model and the temperature of each configuration.
+    max_workers : int, optional
+        The number of configurations translated at once.
+        Defaults to the number of configurations.
+    reporter : TranslationReporter, optional
+        The receiver of the progress, one step per configuration, and of
+        the errors. If None, the errors are printed.
+
+    Returns
+    -------
+    results : list of dict
+        For each configuration, in the order of the configurations: the
+        model, the temperature, the translation, the number of tokens, the
+        finish reason, the time to first token and the duration in
+        seconds, the estimated tokens of the translation per second, the
+        number of valid and of checked chunks, the issues of the invalid
+        chunks and the errors.
+    """
+    if reporter is None:
+        reporter = TranslationReporter()
+    if max_workers is None:
+        max_workers = max(len(configurations), 1)
+    translators = []
+    # The translators are created in the calling thread, e.g. from the
+    # state of a Streamlit session
+    for model, temperature in configurations:
+        translator = create_translator()
+        translator.model = model
+        translator.temperature = temperature
+        translator.set_reporter(TranslationReporter())
+        translator.cache = None
+        translator.memory = None
+        translator.checkpoint_directory = None
+        translator.router = None
+        translator.cascade_models = []
+        translator.max_validation_retries = 0
+        translators.append(translator)
+
+    def translate(translator):
+        start_time = time.time()
+        translation, total_tokens, finish_reason, time_to_first_token = (
+            translator.translate_streaming(latex_content)
+        )
+        duration = time.time() - start_time
+        return {
+            "model": translator.model,
+            "temperature": translator.temperature,
+            "translation": translation,
+            "tokens": total_tokens,
+            "finish_reason": finish_reason,
+            "time_to_first_token": time_to_first_token,
+            "duration": duration,
+            "tokens_per_second": (
+                estimate_tokens(translation) / duration if duration > 0 else None
+            ),
+            "valid_chunks": sum(verdict["valid"] for verdict in translator.verdicts),
+            "checked_chunks": len(translator.verdicts),
+            "issues": [
+                f"Bloc {verdict['index']} : {issue}"
+                for verdict in translator.verdicts
+                for issue in verdict["issues"]
+            ],
+            "errors": list(translator.errors),
+        }
+
+    results = [None] * len(translators)
+    reporter.on_start(len(translators))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(translate, translator): index
+            for index, translator in enumerate(translators)
+        }
+        for number_done, future in enumerate(
+            concurrent.futures.as_completed(futures), 1
+        ):
+            index = futures[future]
+            model, temperature = configurations[index]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                reporter.on_error(f"{model} ({temperature}) : {e}")
+                results[index] = {
+                    "model": model,
+                    "temperature": temperature,
+                    "translation": "",
+                    "tokens": 0,
+                    "finish_reason": "Erreur",
+                    "time_to_first_token": None,
+                    "duration": None,
+                    "tokens_per_second": None,
+                    "valid_chunks": 0,
+                    "checked_chunks": 0,
+                    "issues": [],
+                    "errors": [str(e)],
+                }
+            else:
+                for error in results[index]["errors"]:
+                    reporter.on_error(f"{model} ({temperature}) : {error}")
+            reporter.on_progress(number_done, len(translators))
+    reporter.on_finish()
+    return results
+
+
+def save_comparison(
+    latex_content: str, results: List[dict], path: Optional[str] = None
+) -> str:
+    """Append the results of a comparison to the history.
+
+    Parameters
+    ----------
+    latex_content : str
+        The compared document.
+    results : list of dict
+        The results of compare_models().
+    path : str, optional
+        The path of the history, a JSON Lines file with one line per
+        configuration. Defaults to get_default_history_path().
+
+    Returns
+    -------
+    comparison_id : str
+        The identifier of the comparison in the history.
+    """
+    if path is None:
+        path = get_default_history_path()
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    comparison_id = uuid.uuid4().hex
+    document = {
+        "comparison_id": comparison_id,
+        "time": time.time(),
+        "document_hash": hashlib.sha256(latex_content.encode("utf-8")).hexdigest(),
+        "document_tokens": estimate_tokens(latex_content),
+    }
+    with open(path, "a", encoding="utf-8") as history_file:
+        for result in results:
+            history_file.write(
+                json.dumps(dict(document, **result), ensure_ascii=False) + "\n"
+            )
+    return comparison_id
+
+
+def load_comparisons(path: Optional[str] = None) -> List[dict]:
+    """Read the history of the comparisons.
+
+    Parameters
+    ----------
+    path : str, optional
+        The path of the history. Defaults to get_default_history_path().
+
+    Returns
+    -------
+    results : list of dict
+        The result of each configuration of each comparison, with the
+        identifier and the time of its comparison, and the hash and the
+        tokens of its document. Empty if there is no history.
+    """
+    if path is None:
+        path = get_default_history_path()
+    if not os.path.exists(path):
+        return []
+    results = []
+    with open(path, encoding="utf-8") as history_file:
+        for line in history_file:
+            if line.strip():
+                results.append(json.loads(line))
+    return results
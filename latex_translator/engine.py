@@ -0,0 +1,238 @@
+"""
+Concurrent dispatch of translation requests.
+
+The translators send one chat completion for each piece of text.
+Sending them one after the other makes the total duration the sum of all
+the latencies.
+The engine of this module sends them concurrently with asyncio, with a bound
+on the number of requests in flight, and returns the results in the
+original order.
+
+The coroutines run in an event loop shared by the whole process, in a
+background thread.
+This lets the async HTTP clients, which are bound to the loop which uses
+them, keep their connections alive from one translation to the next.
+"""
+import asyncio
+import atexit
+import concurrent.futures
+import inspect
+import queue
+import threading
+from typing import Any, Callable, List, Optional, Sequence
+
+_event_loop = None
+_event_loop_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Return the event loop shared by the process.
+
+    The loop runs forever in a daemon thread, started on the first call.
+
+    Returns
+    -------
+    event_loop : asyncio.AbstractEventLoop
+        The shared event loop.
+    """
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None or _event_loop.is_closed():
+            event_loop = asyncio.new_event_loop()
+            thread = threading.Thread(
+                target=event_loop.run_forever,
+                name="latex-translator-event-loop",
+                daemon=True,
+            )
+            thread.start()
+            _event_loop = event_loop
+    return _event_loop
+
+
+@atexit.register
+def stop_event_loop() -> None:
+    """Stop the shared event loop, if it was started."""
+    with _event_loop_lock:
+        if _event_loop is not None and not _event_loop.is_closed():
+            _event_loop.call_soon_threadsafe(_event_loop.stop)
+
+
+def _submit(coroutine) -> concurrent.futures.Future:
+    """Schedule a coroutine in the shared event loop."""
+    event_loop = get_event_loop()
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    if running_loop is event_loop:
+        coroutine.close()
+        raise RuntimeError(
+            "Cannot block the shared event loop: await the coroutine instead."
+        )
+    return asyncio.run_coroutine_threadsafe(coroutine, event_loop)
+
+
+def run_coroutine(coroutine):
+    """Run a coroutine to completion in the shared event loop and return its result.
+
+    Parameters
+    ----------
+    coroutine : coroutine
+        The coroutine to run.
+
+    Returns
+    -------
+    result : object
+        The value returned by the coroutine.
+    """
+    return _submit(coroutine).result()
+
+
+def merge_finish_reasons(finish_reasons: Sequence[str]) -> str:
+    """Summarize the finish reasons of several requests.
+
+    Parameters
+    ----------
+    finish_reasons : sequence of str
+        The finish reasons of the requests.
+
+    Returns
+    -------
+    finish_reason : str
+        "Erreur" if a request failed, otherwise the first finish reason
+        which is not "stop" (e.g. "length"), otherwise "stop".
+        An empty sequence gives "stop".
+    """
+    if "Erreur" in finish_reasons:
+        return "Erreur"
+    for finish_reason in finish_reasons:
+        if finish_reason != "stop":
+            return finish_reason
+    return "stop"
+
+
+class ConcurrentTranslationEngine:
+    def __init__(
+        self,
+        translate_function: Callable[[str], Any],
+        max_concurrency: int = 8,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+    ):
+        """Initialize the ConcurrentTranslationEngine.
+
+        Parameters
+        ----------
+        translate_function : callable
+            The function which translates one text.
+            It can be a coroutine function (e.g. using an async client)
+            or a plain function (e.g. using a sync client), which is then
+            run in a thread pool.
+            Its return value is stored as is in the results.
+        max_concurrency : int, optional
+            The maximum number of requests in flight. Defaults to 8.
+        progress_callback : callable, optional
+            A function called as progress_callback(number_done, number_total)
+            each time a request completes, in completion order.
+        """
+        if max_concurrency < 1:
+            raise ValueError(
+                f"The concurrency must be at least 1, but max_concurrency={max_concurrency}"
+            )
+        self.translate_function = translate_function
+        self.max_concurrency = max_concurrency
+        self.progress_callback = progress_callback
+
+    async def translate_all_async(self, texts: Sequence[str]) -> List[Any]:
+        """Translate all the texts concurrently.
+
+        The progress callback is called in the event loop.
+
+        Parameters
+        ----------
+        texts : sequence of str
+            The texts to translate.
+
+        Returns
+        -------
+        results : list
+            The results of the translate function, in the order of the texts.
+        """
+        return await self._translate_all_async(texts, self.progress_callback)
+
+    async def _translate_all_async(self, texts, progress_callback) -> List[Any]:
+        number_total = len(texts)
+        results = [None] * number_total
+        if number_total == 0:
+            return results
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        is_coroutine_function = inspect.iscoroutinefunction(self.translate_function)
+        loop = asyncio.get_running_loop()
+        executor = None
+        if not is_coroutine_function:
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(self.max_concurrency, number_total)
+            )
+
+        async def translate_one(index, text):
+            async with semaphore:
+                if is_coroutine_function:
+                    result = await self.translate_function(text)
+                else:
+                    result = await loop.run_in_executor(
+                        executor, self.translate_function, text
+                    )
+            return index, result
+
+        tasks = [
+            asyncio.ensure_future(translate_one(index, text))
+            for index, text in enumerate(texts)
+        ]
+        try:
+            for number_done, future in enumerate(asyncio.as_completed(tasks), 1):
+                index, result = await future
+                results[index] = result
+                if progress_callback is not None:
+                    progress_callback(number_done, number_total)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if executor is not None:
+                executor.shutdown(wait=False)
+        return results
+
+    def translate_all(self, texts: Sequence[str]) -> List[Any]:
+        """Translate all the texts concurrently and wait for the results.
+
+        This is the blocking counterpart of translate_all_async().
+        The requests run in the shared event loop, while the progress
+        callback is called in the calling thread (e.g. the thread of a
+        Streamlit script, which owns the widgets).
+
+        Parameters
+        ----------
+        texts : sequence of str
+            The texts to translate.
+
+        Returns
+        -------
+        results : list
+            The results of the translate function, in the order of the texts.
+        """
+        if self.progress_callback is None:
+            return run_coroutine(self._translate_all_async(texts, None))
+        progress_events = queue.SimpleQueue()
+        future = _submit(
+            self._translate_all_async(
+                texts,
+                lambda number_done, number_total: progress_events.put(
+                    (number_done, number_total)
+                ),
+            )
+        )
+        while not (future.done() and progress_events.empty()):
+            try:
+                number_done, number_total = progress_events.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            self.progress_callback(number_done, number_total)
+        return future.result()
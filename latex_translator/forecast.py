@@ -0,0 +1,160 @@
+"""
+Forecast of the tokens, the duration and the cost of a translation.
+
+The forecast is computed offline, before sending any request, from the
+estimated number of tokens of each request.
+It lets the user check that the document fits the selected model, and
+compare the models, before starting the translation.
+"""
+import heapq
+from typing import List, Sequence, Tuple
+
+from latex_translator.chunking import OUTPUT_TOKEN_RATIO
+from latex_translator.models import (
+    REASONING_MODELS,
+    get_context_window,
+    get_first_token_latency,
+    get_max_output_tokens,
+    get_output_speed,
+    get_prices,
+)
+
+# Tokens of the message formatting: the roles and "Here is the text: "
+MESSAGE_OVERHEAD_TOKENS = 12
+
+
+def estimate_completion_tokens(content_tokens: int) -> int:
+    """Estimate the number of tokens of the translation of a text.
+
+    Parameters
+    ----------
+    content_tokens : int
+        The number of tokens of the text.
+
+    Returns
+    -------
+    completion_tokens : int
+        The estimated number of tokens of its translation.
+    """
+    return int(content_tokens * OUTPUT_TOKEN_RATIO + 0.5)
+
+
+def estimate_request_duration(model: str, completion_tokens: int) -> float:
+    """Estimate the duration of one request.
+
+    Parameters
+    ----------
+    model : str
+        The name of the model.
+    completion_tokens : int
+        The number of tokens of the completion.
+
+    Returns
+    -------
+    duration : float
+        The duration in seconds.
+    """
+    return get_first_token_latency(model) + completion_tokens / get_output_speed(model)
+
+
+def estimate_total_duration(durations: Sequence[float], max_concurrency: int) -> float:
+    """Estimate the duration of requests sent concurrently.
+
+    The requests are started in order, each one as soon as one of the
+    max_concurrency slots is free.
+
+    Parameters
+    ----------
+    durations : sequence of float
+        The duration of each request, in seconds.
+    max_concurrency : int
+        The maximum number of requests in flight.
+
+    Returns
+    -------
+    total_duration : float
+        The time until the last request completes, in seconds.
+    """
+    end_times = [0.0] * min(max_concurrency, max(len(durations), 1))
+    for duration in durations:
+        start_time = heapq.heappop(end_times)
+        heapq.heappush(end_times, start_time + duration)
+    return max(end_times)
+
+
+def forecast_requests(
+    request_tokens: List[Tuple[int, int]], model: str, max_concurrency: int = 1
+) -> dict:
+    """Forecast the tokens, the duration and the cost of requests.
+
+    Parameters
+    ----------
+    request_tokens : list of tuple(int, int)
+        The number of tokens of the prompt and of the completion of each
+        request.
+    model : str
+        The name of the model.
+    max_concurrency : int, optional
+        The maximum number of requests in flight. Defaults to 1.
+
+    Returns
+    -------
+    forecast : dict
+        The number of requests, the prompt, completion and total tokens,
+        the largest request in tokens, the duration in seconds, the cost in
+        US dollars (None if the prices of the model are unknown), and the
+        list of warnings, in french.
+    """
+    prompt_tokens = sum(prompt for prompt, _ in request_tokens)
+    completion_tokens = sum(completion for _, completion in request_tokens)
+    largest_request_tokens = max(
+        (prompt + completion for prompt, completion in request_tokens), default=0
+    )
+    duration = estimate_total_duration(
+        [
+            estimate_request_duration(model, completion)
+            for _, completion in request_tokens
+        ],
+        max_concurrency,
+    )
+    prices = get_prices(model)
+    cost = None
+    if prices is not None:
+        cost = (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1.0e6
+
+    warnings = []
+    context_window = get_context_window(model)
+    max_output_tokens = get_max_output_tokens(model)
+    number_too_large = sum(
+        prompt + completion > context_window for prompt, completion in request_tokens
+    )
+    if number_too_large > 0:
+        warnings.append(
+            f"{number_too_large} requête(s) dépasse(nt) la fenêtre de contexte "
+            f"de {context_window} tokens du modèle {model} : choisissez un modèle "
+            "avec une plus grande fenêtre ou découpez le bloc trop long."
+        )
+    number_truncated = sum(
+        completion > max_output_tokens for _, completion in request_tokens
+    )
+    if number_truncated > 0:
+        warnings.append(
+            f"{number_truncated} traduction(s) dépasse(nt) la sortie maximale "
+            f"de {max_output_tokens} tokens du modèle {model} : "
+            "elle(s) risque(nt) d'être tronquée(s)."
+        )
+    if model in REASONING_MODELS:
+        warnings.append(
+            f"Le modèle {model} écrit son raisonnement avant la traduction : "
+            "les tokens générés et la durée seront plus élevés."
+        )
+    return {
+        "requests": len(request_tokens),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "largest_request_tokens": largest_request_tokens,
+        "duration": duration,
+        "cost": cost,
+        "warnings": warnings,
+    }
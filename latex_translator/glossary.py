@@ -0,0 +1,317 @@
+"""
+Glossaries of the terms with an imposed translation.
+
+A glossary maps French terms to their English translation, e.g. the terms
+of an institution.
+Sending the whole glossary with each request would make the prompt grow
+with the glossary: instead, the terms are searched in each chunk, and the
+request only gives the translations of the terms which appear in it.
+
+The terms are searched at once with an Aho-Corasick automaton, so that
+the search time depends on the length of the chunk, not on the number of
+terms.
+The search ignores the case and the accents, and only matches whole
+words: "Réseau de neurones" matches "reseau de  neurones", but "art"
+does not match "partie".
+
+The glossaries are loaded from TSV or CSV files, with the French term in
+the first column and its translation in the second.
+"""
+import csv
+import io
+import os
+import re
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+from latex_translator.tokens import estimate_tokens
+
+# The maximum number of tokens of the terms added to a request
+MAX_GLOSSARY_TOKENS = 1000
+
+# The first cells of a header row, after normalization
+HEADER_NAMES = {"fr", "french", "francais", "source", "terme", "term"}
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# The typographic apostrophes and hyphens are matched as the ASCII ones
+_PUNCTUATION_TABLE = str.maketrans({"’": "'", "‘": "'", "‑": "-"})
+
+
+def normalize_text(text: str) -> str:
+    """Normalize a text for the search of the terms.
+
+    The text is case folded, its accents are removed, its typographic
+    apostrophes are replaced by ASCII ones, and its blanks are collapsed.
+
+    Parameters
+    ----------
+    text : str
+        The text.
+
+    Returns
+    -------
+    normalized_text : str
+        The normalized text.
+    """
+    text = unicodedata.normalize("NFKD", text.translate(_PUNCTUATION_TABLE))
+    text = "".join(
+        character for character in text if not unicodedata.combining(character)
+    )
+    return _WHITESPACE_PATTERN.sub(" ", text.casefold())
+
+
+class Glossary:
+    def __init__(self, terms: Optional[Dict[str, str]] = None):
+        """Initialize the Glossary.
+
+        Parameters
+        ----------
+        terms : dict, optional
+            The translation of each French term.
+        """
+        # The source term and its translation, by normalized term
+        self._terms = {}
+        # The automaton is built on the first search
+        self._automaton = None
+        if terms:
+            self.update(terms)
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def items(self) -> List[Tuple[str, str]]:
+        """Return the French terms and their translations."""
+        return list(self._terms.values())
+
+    def add_term(self, source_term: str, target_term: str) -> None:
+        """Add a term, or replace the translation of a known one.
+
+        Parameters
+        ----------
+        source_term : str
+            The French term.
+        target_term : str
+            Its translation.
+        """
+        normalized_term = normalize_text(source_term).strip()
+        if not normalized_term or not target_term.strip():
+            return
+        self._terms[normalized_term] = (source_term.strip(), target_term.strip())
+        self._automaton = None
+
+    def update(self, terms) -> None:
+        """Add the terms of a dictionary or of another glossary.
+
+        Parameters
+        ----------
+        terms : dict or Glossary
+            The terms. They replace the translations of the known terms.
+        """
+        for source_term, target_term in terms.items():
+            self.add_term(source_term, target_term)
+
+    def _build_automaton(self):
+        """Build the Aho-Corasick automaton of the normalized terms.
+
+        Returns
+        -------
+        transitions : list of dict
+            The next state of each state, by character.
+        failures : list of int
+            The state of the longest proper suffix of each state.
+        outputs : list of list of str
+            The terms which end at each state.
+        """
+        transitions = [{}]
+        outputs = [[]]
+        for normalized_term in self._terms:
+            state = 0
+            for character in normalized_term:
+                next_state = transitions[state].get(character)
+                if next_state is None:
+                    next_state = len(transitions)
+                    transitions[state][character] = next_state
+                    transitions.append({})
+                    outputs.append([])
+                state = next_state
+            outputs[state].append(normalized_term)
+
+        # Breadth first, so that the failure of the parent is known
+        failures = [0] * len(transitions)
+        queue = list(transitions[0].values())
+        for state in queue:
+            for character, next_state in transitions[state].items():
+                queue.append(next_state)
+                failure = failures[state]
+                while failure and character not in transitions[failure]:
+                    failure = failures[failure]
+                failure = transitions[failure].get(character, 0)
+                failures[next_state] = failure
+                outputs[next_state] = outputs[next_state] + outputs[failure]
+        return transitions, failures, outputs
+
+    def find_terms(self, text: str) -> List[Tuple[str, str]]:
+        """Find the terms of the glossary which appear in a text.
+
+        Parameters
+        ----------
+        text : str
+            The text, e.g. a chunk of the document.
+
+        Returns
+        -------
+        terms : list of tuple(str, str)
+            The French terms which appear as whole words in the text, and
+            their translations, in the order of their first occurrence.
+        """
+        if not self._terms:
+            return []
+        if self._automaton is None:
+            self._automaton = self._build_automaton()
+        transitions, failures, outputs = self._automaton
+        normalized_text = normalize_text(text)
+        found_terms = {}
+        state = 0
+        for end, character in enumerate(normalized_text, 1):
+            while state and character not in transitions[state]:
+                state = failures[state]
+            state = transitions[state].get(character, 0)
+            for normalized_term in outputs[state]:
+                if normalized_term in found_terms:
+                    continue
+                start = end - len(normalized_term)
+                # Only the whole words match
+                if start > 0 and normalized_text[start - 1].isalnum():
+                    continue
+                if end < len(normalized_text) and normalized_text[end].isalnum():
+                    continue
+                found_terms[normalized_term] = start
+        return [
+            self._terms[normalized_term]
+            for normalized_term in sorted(found_terms, key=found_terms.get)
+        ]
+
+
+def find_missing_terms(
+    terms: List[Tuple[str, str]], translation: str
+) -> List[Tuple[str, str]]:
+    """Find the terms whose imposed translation is not used by a translation.
+
+    The translations are searched with the normalization of the terms, from
+    the start of a word, so that "network" also matches "networks".
+
+    Parameters
+    ----------
+    terms : list of tuple(str, str)
+        The French terms of a chunk and their translations, as returned by
+        Glossary.find_terms().
+    translation : str
+        The translation of the chunk.
+
+    Returns
+    -------
+    missing_terms : list of tuple(str, str)
+        The terms whose translation does not appear in the translation.
+    """
+    normalized_translation = normalize_text(translation)
+    return [
+        (source_term, target_term)
+        for source_term, target_term in terms
+        if not re.search(
+            r"(?<!\w)" + re.escape(normalize_text(target_term).strip()),
+            normalized_translation,
+        )
+    ]
+
+
+def get_glossary_instructions(
+    terms: List[Tuple[str, str]], max_tokens: int = MAX_GLOSSARY_TOKENS
+) -> str:
+    """Return the prompt instructions which give the translations of terms.
+
+    Parameters
+    ----------
+    terms : list of tuple(str, str)
+        The French terms and their translations.
+    max_tokens : int, optional
+        The maximum number of tokens of the instructions.
+        The terms beyond it are left out. Defaults to MAX_GLOSSARY_TOKENS.
+
+    Returns
+    -------
+    instructions : str
+        The instructions, or "" if there is no term.
+    """
+    if not terms:
+        return ""
+    header = (
+        "- Pay special attention to the following terms and use their "
+        "provided translations:\n"
+    )
+    instructions = header
+    tokens = estimate_tokens(header)
+    for source_term, target_term in terms:
+        line = f"- '{source_term}' should be translated as '{target_term}'\n"
+        tokens += estimate_tokens(line)
+        if tokens > max_tokens:
+            break
+        instructions += line
+    return instructions
+
+
+def parse_glossary(text: str, delimiter: Optional[str] = None) -> Glossary:
+    """Parse a glossary in the TSV or CSV format.
+
+    Each row gives a French term and its translation, in its first two
+    columns. The other columns are ignored, e.g. a comment.
+    The blank rows, the rows starting with '#' and a header row are
+    skipped.
+
+    Parameters
+    ----------
+    text : str
+        The content of the file.
+    delimiter : str, optional
+        The delimiter of the columns.
+        If None, it is detected among the tab, the comma and the semicolon.
+
+    Returns
+    -------
+    glossary : Glossary
+        The glossary.
+    """
+    if delimiter is None:
+        try:
+            delimiter = csv.Sniffer().sniff(text[:4096], delimiters="\t,;").delimiter
+        except csv.Error:
+            delimiter = "\t"
+    glossary = Glossary()
+    for index, row in enumerate(csv.reader(io.StringIO(text), delimiter=delimiter)):
+        if len(row) < 2 or not row[0].strip() or row[0].lstrip().startswith("#"):
+            continue
+        if index == 0 and normalize_text(row[0]).strip() in HEADER_NAMES:
+            continue
+        glossary.add_term(row[0], row[1])
+    return glossary
+
+
+def load_glossary(path: str) -> Glossary:
+    """Load a glossary from a TSV or CSV file.
+
+    Parameters
+    ----------
+    path : str
+        The path of the file, encoded in UTF-8.
+        The columns of a .tsv file are separated by tabs. The delimiter of
+        the other files is detected.
+
+    Returns
+    -------
+    glossary : Glossary
+        The glossary.
+    """
+    with open(path, encoding="utf-8-sig", newline="") as glossary_file:
+        text = glossary_file.read()
+    delimiter = "\t" if os.path.splitext(path)[1].lower() == ".tsv" else None
+    return parse_glossary(text, delimiter)
@@ -0,0 +1,179 @@
+"""
+Incremental translation of a revised document.
+
+The authors revise a french draft and translate it again after each
+revision.
+Instead of translating the whole document each time, this module compares
+the new source with the previous one, block by block, and keeps the
+previous translation of the blocks which did not change.
+
+The blocks are the ones of latex_translator.chunking.split_latex_blocks():
+paragraphs, environments and sections.
+The previous source and its translation are split in the same way and
+paired block by block.
+When the translation does not have the same blocks as its source (e.g. the
+AI merged two paragraphs), the pairing is tried with the sections only.
+If the sections do not match either, the previous translation cannot be
+reused.
+Each pair of blocks is checked, since the same number of blocks does not
+prove the same structure: e.g. the AI may have merged two paragraphs and
+split another one. A pair must keep the structure of its source block,
+see latex_translator.validation, and have a plausible length.
+"""
+import difflib
+from typing import List, Optional, Tuple
+
+from latex_translator.chunking import HEADING_BREAK, PARAGRAPH_BREAK, split_latex_blocks
+from latex_translator.packing import split_blanks
+from latex_translator.validation import (
+    MAX_LENGTH_RATIO,
+    MIN_LENGTH_RATIO,
+    validate_translation,
+)
+
+# The granularities of the pairing, from the finest to the coarsest
+_ALIGNMENT_PRIORITIES = (PARAGRAPH_BREAK, HEADING_BREAK)
+
+# The shorter blocks, e.g. the headings, are not checked for their length
+# ratio when pairing the blocks
+MIN_LENGTH_FOR_ALIGNMENT_RATIO = 50
+
+
+def group_blocks(text: str, min_priority: int) -> List[str]:
+    """Split a LaTeX document into blocks which start at a given kind of split point.
+
+    Parameters
+    ----------
+    text : str
+        The LaTeX document.
+    min_priority : int
+        The minimum priority of the split points, e.g. HEADING_BREAK to
+        split at the sectioning commands only.
+
+    Returns
+    -------
+    blocks : list of str
+        The blocks. Concatenating them gives back the document.
+    """
+    blocks = []
+    for block, priority in split_latex_blocks(text):
+        if blocks and priority < min_priority:
+            blocks[-1] += block
+        else:
+            blocks.append(block)
+    return blocks
+
+
+def is_block_pair(source_block: str, translated_block: str) -> bool:
+    """Check that a block of a translation can be the translation of a block of its source.
+
+    Parameters
+    ----------
+    source_block : str
+        The block of the source.
+    translated_block : str
+        The block of the translation.
+
+    Returns
+    -------
+    is_pair : bool
+        Whether the translated block keeps the structure of the source
+        block, and has a plausible length.
+    """
+    if validate_translation(source_block, translated_block):
+        return False
+    source_length = len(source_block.strip())
+    if source_length < MIN_LENGTH_FOR_ALIGNMENT_RATIO:
+        return True
+    length_ratio = len(translated_block.strip()) / source_length
+    return MIN_LENGTH_RATIO <= length_ratio <= MAX_LENGTH_RATIO
+
+
+def align_translation(
+    source: str, translation: str
+) -> Optional[Tuple[int, List[str], List[str]]]:
+    """Pair the blocks of a document with the blocks of its translation.
+
+    Parameters
+    ----------
+    source : str
+        The LaTeX document.
+    translation : str
+        Its translation.
+
+    Returns
+    -------
+    alignment : tuple(int, list of str, list of str) or None
+        The minimum priority of the split points of the blocks, see
+        group_blocks(), the blocks of the source and the blocks of the
+        translation.
+        The two lists have the same length, so that the i-th block of the
+        translation is the translation of the i-th block of the source.
+        None if the two documents do not have the same structure, or if a
+        pair of blocks fails is_block_pair().
+    """
+    for min_priority in _ALIGNMENT_PRIORITIES:
+        source_blocks = group_blocks(source, min_priority)
+        translation_blocks = group_blocks(translation, min_priority)
+        if len(source_blocks) == len(translation_blocks):
+            if not all(map(is_block_pair, source_blocks, translation_blocks)):
+                return None
+            return min_priority, source_blocks, translation_blocks
+    return None
+
+
+def plan_incremental_translation(
+    previous_source: str, previous_translation: str, new_source: str
+) -> Optional[List[Tuple[str, Optional[str]]]]:
+    """Find the pieces of a revised document which must be translated.
+
+    Parameters
+    ----------
+    previous_source : str
+        The previous version of the LaTeX document.
+    previous_translation : str
+        The translation of the previous version.
+    new_source : str
+        The new version of the LaTeX document.
+
+    Returns
+    -------
+    plan : list of tuple(str, str or None) or None
+        The pieces of the new document, in order, each one with its
+        translation if it is unchanged, or None if it must be translated.
+        The consecutive changed blocks are merged into one piece.
+        Concatenating the pieces gives back the new document.
+        None if the previous translation cannot be paired with its source.
+    """
+    alignment = align_translation(previous_source, previous_translation)
+    if alignment is None:
+        return None
+    min_priority, previous_blocks, translated_blocks = alignment
+    new_blocks = group_blocks(new_source, min_priority)
+
+    # The blanks around a block are not significant
+    matcher = difflib.SequenceMatcher(
+        None,
+        [block.strip() for block in previous_blocks],
+        [block.strip() for block in new_blocks],
+        autojunk=False,
+    )
+    plan = []
+    for tag, previous_start, _, new_start, new_end in matcher.get_opcodes():
+        if tag == "equal":
+            for offset, new_block in enumerate(new_blocks[new_start:new_end]):
+                leading_blanks, content, trailing_blanks = split_blanks(new_block)
+                if not content:
+                    plan.append((new_block, new_block))
+                    continue
+                translated_content = translated_blocks[previous_start + offset].strip()
+                plan.append(
+                    (new_block, leading_blanks + translated_content + trailing_blanks)
+                )
+        elif new_end > new_start:
+            changed_text = "".join(new_blocks[new_start:new_end])
+            if plan and plan[-1][1] is None:
+                plan[-1] = (plan[-1][0] + changed_text, None)
+            else:
+                plan.append((changed_text, None))
+    return plan
@@ -0,0 +1,430 @@
+"""
+Background translation jobs.
+
+A translation can take minutes.
+In the Streamlit app, running it in the handler of the button ties it to
+the run of the script: an interaction with a widget stops it, and the
+session cannot do anything else in the meantime.
+Instead, the translations are submitted to a pool of worker threads, which
+is shared by the sessions of the server.
+Each job has an identifier, and its status, its progress and its result
+are stored in an SQLite database, so that the user interface only has to
+poll them, and can find them again after a reconnection.
+
+The jobs which were queued or running when the process stopped cannot be
+resumed: they are marked as interrupted when the next queue is created.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from latex_translator.cache import get_default_cache_directory
+from latex_translator.reporting import TranslationReporter
+
+# The statuses of a job
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+INTERRUPTED = "interrupted"
+
+# The statuses of the jobs which are not over
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+# The finished jobs are deleted after one week
+JOB_RETENTION_SECONDS = 7 * 24 * 3600.0
+
+_JOB_COLUMNS = (
+    "id",
+    "owner",
+    "description",
+    "status",
+    "created_time",
+    "start_time",
+    "end_time",
+    "number_done",
+    "number_total",
+    "total_tokens",
+    "finish_reason",
+    "translation",
+    "errors",
+    "verdicts",
+)
+
+# The columns stored as JSON
+_JSON_COLUMNS = ("errors", "verdicts")
+
+
+class JobStore:
+    def __init__(self, path=None):
+        """Initialize the JobStore.
+
+        The store keeps the status, the progress and the result of the
+        jobs in an SQLite database. It is thread-safe.
+
+        Parameters
+        ----------
+        path : str, optional
+            The path of the SQLite database.
+            Defaults to translation_jobs.sqlite in the default cache directory.
+        """
+        if path is None:
+            path = os.path.join(get_default_cache_directory(), "translation_jobs.sqlite")
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, "
+                "owner TEXT NOT NULL, "
+                "description TEXT NOT NULL, "
+                "status TEXT NOT NULL, "
+                "created_time REAL NOT NULL, "
+                "start_time REAL, "
+                "end_time REAL, "
+                "number_done INTEGER NOT NULL DEFAULT 0, "
+                "number_total INTEGER NOT NULL DEFAULT 0, "
+                "total_tokens INTEGER NOT NULL DEFAULT 0, "
+                "finish_reason TEXT, "
+                "translation TEXT, "
+                "errors TEXT NOT NULL DEFAULT '[]', "
+                "verdicts TEXT NOT NULL DEFAULT '[]')"
+            )
+            columns = {
+                row[1] for row in self._connection.execute("PRAGMA table_info(jobs)")
+            }
+            if "verdicts" not in columns:
+                # A database of a version without the validation
+                self._connection.execute(
+                    "ALTER TABLE jobs ADD COLUMN verdicts TEXT NOT NULL DEFAULT '[]'"
+                )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, created_time)"
+            )
+
+    def create(self, owner: str, description: str) -> str:
+        """Create a queued job.
+
+        Parameters
+        ----------
+        owner : str
+            The identifier of the user who submitted the job.
+        description : str
+            The description of the job, shown to the user.
+
+        Returns
+        -------
+        job_id : str
+            The identifier of the job.
+        """
+        job_id = uuid.uuid4().hex
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO jobs (id, owner, description, status, created_time) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (job_id, owner, description, QUEUED, time.time()),
+            )
+        return job_id
+
+    def update(self, job_id: str, **fields) -> None:
+        """Update the fields of a job, e.g. its status.
+
+        Parameters
+        ----------
+        job_id : str
+            The identifier of the job.
+        **fields
+            The new values of the columns.
+        """
+        for name in fields:
+            if name not in _JOB_COLUMNS or name == "id":
+                raise ValueError(f"Unknown job field {name}")
+        for name in _JSON_COLUMNS:
+            if name in fields:
+                fields[name] = json.dumps(fields[name])
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._connection:
+            self._connection.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ?",
+                (*fields.values(), job_id),
+            )
+
+    def add_error(self, job_id: str, error: str) -> None:
+        """Add an error to the errors of a job."""
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT errors FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is not None:
+                errors = json.loads(row[0]) + [error]
+                self._connection.execute(
+                    "UPDATE jobs SET errors = ? WHERE id = ?",
+                    (json.dumps(errors), job_id),
+                )
+
+    @staticmethod
+    def _to_job(row) -> dict:
+        job = dict(zip(_JOB_COLUMNS, row))
+        for name in _JSON_COLUMNS:
+            job[name] = json.loads(job[name])
+        return job
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Return a job.
+
+        Returns
+        -------
+        job : dict or None
+            The columns of the job: its identifier, owner, description and
+            status, its creation, start and end times, its progress, its
+            tokens, its finish reason, its translation, its errors and the
+            verdicts of the validation of its chunks.
+            None if the job does not exist.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                f"SELECT {', '.join(_JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return None if row is None else self._to_job(row)
+
+    def list(self, owner: Optional[str] = None) -> List[dict]:
+        """Return the jobs, the most recent first.
+
+        Parameters
+        ----------
+        owner : str, optional
+            If given, only return the jobs of this user.
+        """
+        query = f"SELECT {', '.join(_JOB_COLUMNS)} FROM jobs"
+        parameters = ()
+        if owner is not None:
+            query += " WHERE owner = ?"
+            parameters = (owner,)
+        with self._lock:
+            rows = self._connection.execute(
+                query + " ORDER BY created_time DESC", parameters
+            ).fetchall()
+        return [self._to_job(row) for row in rows]
+
+    def delete(self, job_id: str) -> None:
+        """Delete a job."""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def mark_interrupted(self) -> int:
+        """Mark the queued and running jobs as interrupted.
+
+        Returns
+        -------
+        number_interrupted : int
+            The number of jobs marked as interrupted.
+        """
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "UPDATE jobs SET status = ?, end_time = ? "
+                f"WHERE status IN ({', '.join('?' for _ in ACTIVE_STATUSES)})",
+                (INTERRUPTED, time.time(), *ACTIVE_STATUSES),
+            )
+        return cursor.rowcount
+
+    def delete_older_than(self, max_age: float) -> None:
+        """Delete the finished jobs older than a duration, in seconds."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM jobs WHERE created_time < ? "
+                f"AND status NOT IN ({', '.join('?' for _ in ACTIVE_STATUSES)})",
+                (time.time() - max_age, *ACTIVE_STATUSES),
+            )
+
+    def close(self) -> None:
+        """Close the database."""
+        with self._lock:
+            self._connection.close()
+
+
+class JobReporter(TranslationReporter):
+    def __init__(self, store: JobStore, job_id: str):
+        """Initialize the JobReporter.
+
+        This reporter stores the progress and the errors of a translation
+        in the store of its job.
+
+        Parameters
+        ----------
+        store : JobStore
+            The store of the jobs.
+        job_id : str
+            The identifier of the job.
+        """
+        super().__init__()
+        self.store = store
+        self.job_id = job_id
+
+    def on_start(self, number_total):
+        self.store.update(self.job_id, number_done=0, number_total=number_total)
+
+    def on_progress(self, number_done, number_total):
+        self.store.update(
+            self.job_id, number_done=number_done, number_total=number_total
+        )
+
+    def on_error(self, error):
+        self.store.add_error(self.job_id, error)
+
+
+class JobQueue:
+    def __init__(self, store: Optional[JobStore] = None, max_workers=4):
+        """Initialize the JobQueue.
+
+        The jobs of the previous queues which are not over are marked as
+        interrupted, and the jobs older than JOB_RETENTION_SECONDS are
+        deleted.
+
+        Parameters
+        ----------
+        store : JobStore, optional
+            The store of the jobs. If None, use the default database.
+        max_workers : int, optional
+            The number of jobs which run at once. Defaults to 4.
+        """
+        if max_workers < 1:
+            raise ValueError(
+                f"The number of workers must be at least 1, but max_workers={max_workers}"
+            )
+        if store is None:
+            store = JobStore()
+        self.store = store
+        self.store.mark_interrupted()
+        self.store.delete_older_than(JOB_RETENTION_SECONDS)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="translation-job"
+        )
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        translator,
+        latex_content: str,
+        owner: str = "",
+        description: str = "",
+        previous_source: Optional[str] = None,
+        previous_translation: Optional[str] = None,
+    ) -> str:
+        """Submit a translation.
+
+        Parameters
+        ----------
+        translator : LaTeXRawTranslator
+            The translator, configured by the caller.
+            It must not be used by the caller until the job is over: its
+            reporter is replaced by a JobReporter.
+        latex_content : str
+            The LaTeX content to translate.
+        owner : str, optional
+            The identifier of the user who submitted the job.
+        description : str, optional
+            The description of the job, shown to the user.
+        previous_source : str, optional
+            The previous version of the document.
+            If given with its translation, the document is translated
+            incrementally.
+        previous_translation : str, optional
+            The translation of previous_source.
+
+        Returns
+        -------
+        job_id : str
+            The identifier of the job.
+        """
+        job_id = self.store.create(owner, description)
+        translator.set_reporter(JobReporter(self.store, job_id))
+        with self._lock:
+            self._futures[job_id] = self._executor.submit(
+                self._run,
+                job_id,
+                translator,
+                latex_content,
+                previous_source,
+                previous_translation,
+            )
+        return job_id
+
+    def _run(
+        self, job_id, translator, latex_content, previous_source, previous_translation
+    ):
+        self.store.update(job_id, status=RUNNING, start_time=time.time())
+        try:
+            if previous_source is not None and previous_translation is not None:
+                result = translator.translate_incremental(
+                    latex_content, previous_source, previous_translation
+                )
+            else:
+                result = translator.translate(latex_content)
+        except Exception as e:
+            self.store.add_error(job_id, str(e))
+            self.store.update(job_id, status=FAILED, end_time=time.time())
+            return
+        finally:
+            with self._lock:
+                self._futures.pop(job_id, None)
+        translation, total_tokens, finish_reason = result
+        self.store.update(
+            job_id,
+            status=DONE,
+            end_time=time.time(),
+            translation=translation,
+            total_tokens=total_tokens,
+            finish_reason=finish_reason,
+            verdicts=translator.verdicts,
+        )
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job which is not running yet.
+
+        Returns
+        -------
+        is_cancelled : bool
+            Whether the job was cancelled.
+        """
+        with self._lock:
+            future = self._futures.get(job_id)
+            if future is None or not future.cancel():
+                return False
+            del self._futures[job_id]
+        self.store.update(job_id, status=CANCELLED, end_time=time.time())
+        return True
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        """Return a job, see JobStore.get()."""
+        return self.store.get(job_id)
+
+    def list_jobs(self, owner: Optional[str] = None) -> List[dict]:
+        """Return the jobs of a user, the most recent first."""
+        return self.store.list(owner)
+
+    def delete_job(self, job_id: str) -> None:
+        """Cancel a job if it is not running yet, and delete it."""
+        self.cancel(job_id)
+        self.store.delete(job_id)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop the workers.
+
+        Parameters
+        ----------
+        wait : bool, optional
+            Whether to wait for the running jobs. Defaults to True.
+            The queued jobs are cancelled.
+        """
+        self._executor.shutdown(wait=wait, cancel_futures=True)
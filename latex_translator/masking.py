@@ -0,0 +1,146 @@
+"""
+Masking of the untranslatable parts of a LaTeX text.
+
+The math, the citations, the cross-references, the labels, the paths of
+the figures and the comments must not be translated.
+Sending them to the AI costs input and output tokens, and the AI sometimes
+alters them, e.g. in a long formula.
+This module replaces them by short placeholders such as `[[1]]` before the
+translation, and puts them back after the translation.
+
+If the AI drops or duplicates a placeholder, the masked parts cannot be
+restored safely: the caller then translates the text without masking.
+"""
+import re
+from typing import List, Tuple
+
+_MATH_ENVIRONMENTS = (
+    r"equation\*?|align\*?|alignat\*?|gather\*?|multline\*?|flalign\*?"
+    r"|eqnarray\*?|displaymath|math"
+)
+
+# The optional arguments of the references, e.g. \cite[p. 3]{key}
+_OPTIONAL_ARGUMENTS = r"(?:\s*\[[^\[\]]*\])*"
+
+_MASKED_PATTERN = re.compile(
+    r"\\begin\{(?P<environment>" + _MATH_ENVIRONMENTS + r")\}.*?\\end\{(?P=environment)\}"
+    r"|\$\$.*?\$\$"
+    r"|\\\[.*?\\\]"
+    r"|\\\(.*?\\\)"
+    r"|\$(?:\\.|[^$\\])+\$"
+    r"|\\(?:cite[pt]?|citeauthor|citeyear|ref|eqref|pageref|autoref|cref|Cref|label)\*?"
+    + _OPTIONAL_ARGUMENTS
+    + r"\s*\{[^{}]*\}"
+    r"|\\includegraphics\*?" + _OPTIONAL_ARGUMENTS + r"\s*\{[^{}]*\}"
+    # The comments are masked with their end of line, so that the text of
+    # the next line cannot end up in the comment. The escaped percent signs
+    # are skipped as control symbols below, before reaching them.
+    r"|%[^\n]*\n?"
+    # The text which looks like a placeholder is masked too, so that it is
+    # not confused with one
+    r"|\[\[\s*\d+\s*\]\]"
+    # The control symbols are skipped, e.g. \$ or \%
+    r"|(?P<symbol>\\.)",
+    re.DOTALL,
+)
+
+_PLACEHOLDER_PATTERN = re.compile(r"\[\[\s*(\d+)\s*\]\]")
+
+MASKING_INSTRUCTIONS = (
+    "- The text contains placeholders such as [[1]], which stand for formulas "
+    "or references. Keep each placeholder exactly as it is, at its place in "
+    "the sentence. \n"
+)
+
+
+def make_placeholder(number: int) -> str:
+    """Return the placeholder of a masked part.
+
+    Parameters
+    ----------
+    number : int
+        The number of the masked part, starting from 1.
+
+    Returns
+    -------
+    placeholder : str
+        The placeholder.
+    """
+    return f"[[{number}]]"
+
+
+def mask_latex(text: str) -> Tuple[str, List[str]]:
+    """Replace the untranslatable parts of a LaTeX text by placeholders.
+
+    The masked parts are: the inline and display math, the math
+    environments, the citations, the cross-references and the labels, the
+    paths of the figures, and the comments.
+    The masked parts separated by blanks only are masked together.
+
+    Parameters
+    ----------
+    text : str
+        The LaTeX text.
+
+    Returns
+    -------
+    masked_text : str
+        The text with the placeholders.
+    masked_parts : list of str
+        The masked parts: the i-th one is replaced by make_placeholder(i + 1).
+    """
+    spans = []
+    for match in _MASKED_PATTERN.finditer(text):
+        if match.group("symbol") is not None:
+            continue
+        start, end = match.span()
+        if spans and not text[spans[-1][1] : start].strip():
+            spans[-1] = (spans[-1][0], end)
+        else:
+            spans.append((start, end))
+    pieces = []
+    masked_parts = []
+    position = 0
+    for start, end in spans:
+        masked_parts.append(text[start:end])
+        pieces.append(text[position:start])
+        pieces.append(make_placeholder(len(masked_parts)))
+        position = end
+    pieces.append(text[position:])
+    return "".join(pieces), masked_parts
+
+
+def unmask_latex(text: str, masked_parts: List[str]) -> Tuple[str, bool]:
+    """Put back the masked parts in place of their placeholders.
+
+    Parameters
+    ----------
+    text : str
+        The text with the placeholders, e.g. its translation.
+    masked_parts : list of str
+        The masked parts returned by mask_latex().
+
+    Returns
+    -------
+    unmasked_text : str
+        The text with the masked parts.
+    is_complete : bool
+        True if each placeholder appears exactly once and no other
+        placeholder appears, so that the masked parts are all restored.
+    """
+    counts = [0] * len(masked_parts)
+    is_complete = True
+
+    def restore(match):
+        nonlocal is_complete
+        number = int(match.group(1))
+        if not 1 <= number <= len(masked_parts):
+            # A placeholder made up by the AI
+            is_complete = False
+            return match.group(0)
+        counts[number - 1] += 1
+        return masked_parts[number - 1]
+
+    unmasked_text = _PLACEHOLDER_PATTERN.sub(restore, text)
+    is_complete = is_complete and all(count == 1 for count in counts)
+    return unmasked_text, is_complete
@@ -0,0 +1,438 @@
+"""
+Persistent fuzzy translation memory.
+
+The papers of a group share a lot of phrasing: the description of the
+methods, the acknowledgements, the boilerplate of the introduction.
+The cache only finds the chunks which did not change at all, whereas a
+paragraph written again with a different word misses it.
+This module stores the translated paragraphs in an SQLite database, and
+finds the stored paragraphs which are similar to a new one:
+- a paragraph almost identical to a stored one, with the same numbers,
+  labels, references and citations, reuses its translation as is;
+- the stored paragraphs less similar to the paragraphs of a chunk are sent
+  with it as examples, so that the AI translates the shared phrasing in the
+  same way.
+
+The similarity of two paragraphs is the Jaccard similarity of their sets
+of shingles, the runs of SHINGLE_SIZE consecutive words of their
+normalized text.
+The candidates are found with MinHash and locality-sensitive hashing:
+the signature of a paragraph is split into bands, and each band is hashed
+into a bucket of an indexed table.
+The paragraphs which share a bucket with a new one are the candidates, so
+that a lookup reads a few rows of the index, whatever the number of stored
+paragraphs.
+"""
+import hashlib
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import List, Optional, Tuple
+
+from latex_translator.cache import get_default_cache_directory
+from latex_translator.chunking import split_latex_blocks
+from latex_translator.glossary import normalize_text
+from latex_translator.incremental import align_translation
+from latex_translator.packing import split_blanks
+from latex_translator.tokens import estimate_tokens
+from latex_translator.validation import get_environments, get_keys
+
+# The number of consecutive words of a shingle
+SHINGLE_SIZE = 3
+
+# The MinHash signature is split into NUMBER_OF_BANDS bands of BAND_SIZE
+# values: two paragraphs whose similarity is s share a bucket with a
+# probability of 1 - (1 - s ** BAND_SIZE) ** NUMBER_OF_BANDS, which is 0.5
+# around s = 0.45 and 0.99 above s = 0.75.
+NUMBER_OF_BANDS = 16
+BAND_SIZE = 4
+
+# The paragraphs with fewer words are not stored nor searched, e.g. the
+# headings, which the cache already finds
+MIN_SEGMENT_WORDS = 8
+
+# The minimum similarity of a stored paragraph whose translation is reused
+# as is, and of a stored paragraph sent as an example
+REUSE_SIMILARITY = 0.95
+EXAMPLE_SIMILARITY = 0.6
+
+# The maximum number of examples sent with a chunk, and their maximum
+# number of tokens
+MAX_MEMORY_EXAMPLES = 3
+MAX_MEMORY_EXAMPLE_TOKENS = 1000
+
+# The maximum number of candidates of a lookup whose similarity is computed
+MAX_CANDIDATES = 20
+
+_WORD_PATTERN = re.compile(r"\\?\w+")
+_NUMBER_PATTERN = re.compile(r"\d+(?:[.,]\d+)*")
+
+# The hash functions of the signature are (a * x + b) mod a Mersenne prime,
+# with coefficients drawn once, so that the signatures are stable
+_MERSENNE_PRIME = (1 << 61) - 1
+_random = random.Random(20240601)
+_PERMUTATIONS = [
+    (_random.randrange(1, _MERSENNE_PRIME), _random.randrange(0, _MERSENNE_PRIME))
+    for _ in range(NUMBER_OF_BANDS * BAND_SIZE)
+]
+
+
+def _hash(text: str) -> int:
+    """Return a stable signed 64 bits hash of a text, e.g. for SQLite."""
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def get_words(text: str) -> List[str]:
+    """Return the normalized words and commands of a text."""
+    return _WORD_PATTERN.findall(normalize_text(text))
+
+
+def get_shingles(text: str) -> set:
+    """Return the shingles of a text, its runs of SHINGLE_SIZE words.
+
+    A text shorter than a shingle has one shingle, made of all its words.
+    """
+    words = get_words(text)
+    if len(words) <= SHINGLE_SIZE:
+        return {" ".join(words)}
+    return {
+        " ".join(words[start : start + SHINGLE_SIZE])
+        for start in range(len(words) - SHINGLE_SIZE + 1)
+    }
+
+
+def get_similarity(first_shingles: set, second_shingles: set) -> float:
+    """Return the Jaccard similarity of two sets of shingles."""
+    if not first_shingles and not second_shingles:
+        return 1.0
+    return len(first_shingles & second_shingles) / len(
+        first_shingles | second_shingles
+    )
+
+
+def get_buckets(shingles: set) -> List[int]:
+    """Return the buckets of the bands of the MinHash signature of shingles."""
+    hashes = [_hash(shingle) & 0xFFFFFFFFFFFFFFFF for shingle in shingles]
+    signature = [
+        min((a * value + b) % _MERSENNE_PRIME for value in hashes)
+        for a, b in _PERMUTATIONS
+    ]
+    return [
+        # The index of the band is part of the bucket, so that two bands
+        # with the same values do not share it
+        _hash(
+            f"{band}:"
+            + ",".join(map(str, signature[band * BAND_SIZE : (band + 1) * BAND_SIZE]))
+        )
+        for band in range(NUMBER_OF_BANDS)
+    ]
+
+
+def has_same_invariants(first_text: str, second_text: str) -> bool:
+    """Check that two texts have the same numbers, keys and environments.
+
+    The translation of a paragraph can only be reused for a similar one if
+    they do not differ by what the translation keeps as is, e.g. a year or
+    a reference.
+    """
+    return (
+        Counter(_NUMBER_PATTERN.findall(first_text))
+        == Counter(_NUMBER_PATTERN.findall(second_text))
+        and get_keys(first_text) == get_keys(second_text)
+        and get_environments(first_text) == get_environments(second_text)
+    )
+
+
+class TranslationMemory:
+    def __init__(self, path=None):
+        """Initialize the TranslationMemory.
+
+        Parameters
+        ----------
+        path : str, optional
+            The path of the SQLite database.
+            Defaults to translation_memory.sqlite in the default cache
+            directory.
+        """
+        if path is None:
+            path = os.path.join(
+                get_default_cache_directory(), "translation_memory.sqlite"
+            )
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.lookups = 0
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            # The identifier of a segment is the hash of its normalized
+            # source, so that a source translated again replaces it
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS segments ("
+                "id INTEGER PRIMARY KEY, "
+                "source TEXT NOT NULL, "
+                "translation TEXT NOT NULL, "
+                "last_update REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "bucket INTEGER NOT NULL, "
+                "segment_id INTEGER NOT NULL, "
+                "PRIMARY KEY (bucket, segment_id)) WITHOUT ROWID"
+            )
+
+    def add_segments(self, pairs: List[Tuple[str, str]]) -> int:
+        """Store translated segments.
+
+        Parameters
+        ----------
+        pairs : list of tuple(str, str)
+            The source of each segment, e.g. a paragraph, and its
+            translation.
+            The segments with fewer than MIN_SEGMENT_WORDS words are
+            skipped.
+
+        Returns
+        -------
+        number_stored : int
+            The number of stored segments.
+        """
+        rows = []
+        for source, translation in pairs:
+            source = source.strip()
+            translation = translation.strip()
+            if not translation or len(get_words(source)) < MIN_SEGMENT_WORDS:
+                continue
+            rows.append(
+                (
+                    _hash(" ".join(get_words(source))),
+                    source,
+                    translation,
+                    get_buckets(get_shingles(source)),
+                )
+            )
+        if not rows:
+            return 0
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO segments "
+                "(id, source, translation, last_update) VALUES (?, ?, ?, ?)",
+                [
+                    (segment_id, source, translation, now)
+                    for segment_id, source, translation, _ in rows
+                ],
+            )
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO buckets (bucket, segment_id) VALUES (?, ?)",
+                [
+                    (bucket, segment_id)
+                    for segment_id, _, _, buckets in rows
+                    for bucket in buckets
+                ],
+            )
+        return len(rows)
+
+    def add_translation(self, source: str, translation: str) -> int:
+        """Store the paragraphs of a translated text.
+
+        The blocks of the text are paired with the blocks of its
+        translation, see latex_translator.incremental.align_translation().
+        Nothing is stored if they cannot be paired.
+
+        Parameters
+        ----------
+        source : str
+            The LaTeX text, e.g. a chunk.
+        translation : str
+            Its translation.
+
+        Returns
+        -------
+        number_stored : int
+            The number of stored segments.
+        """
+        alignment = align_translation(source, translation)
+        if alignment is None:
+            return 0
+        _, source_blocks, translated_blocks = alignment
+        return self.add_segments(list(zip(source_blocks, translated_blocks)))
+
+    def search(
+        self, text: str, min_similarity: float = EXAMPLE_SIMILARITY, limit: int = 1
+    ) -> List[Tuple[float, str, str]]:
+        """Find the stored segments which are similar to a text.
+
+        Parameters
+        ----------
+        text : str
+            The text, e.g. a paragraph.
+        min_similarity : float, optional
+            The minimum similarity of the returned segments.
+            Defaults to EXAMPLE_SIMILARITY.
+        limit : int, optional
+            The maximum number of returned segments. Defaults to 1.
+
+        Returns
+        -------
+        segments : list of tuple(float, str, str)
+            The similarity, the source and the translation of each segment,
+            from the most similar.
+            Empty if the text has fewer than MIN_SEGMENT_WORDS words.
+        """
+        if len(get_words(text)) < MIN_SEGMENT_WORDS:
+            return []
+        shingles = get_shingles(text)
+        buckets = get_buckets(shingles)
+        with self._lock:
+            self.lookups += 1
+            rows = self._connection.execute(
+                "SELECT segments.source, segments.translation FROM segments JOIN ("
+                "SELECT segment_id, COUNT(*) AS shared_bands FROM buckets "
+                f"WHERE bucket IN ({','.join('?' * len(buckets))}) "
+                "GROUP BY segment_id ORDER BY shared_bands DESC LIMIT ?"
+                ") AS candidates ON segments.id = candidates.segment_id",
+                buckets + [MAX_CANDIDATES],
+            ).fetchall()
+        segments = []
+        for source, translation in rows:
+            similarity = get_similarity(shingles, get_shingles(source))
+            if similarity >= min_similarity:
+                segments.append((similarity, source, translation))
+        segments.sort(key=lambda segment: segment[0], reverse=True)
+        if segments:
+            with self._lock:
+                self.hits += 1
+        return segments[:limit]
+
+    def find_reusable_translation(self, text: str) -> Optional[str]:
+        """Return the translation of a stored segment almost identical to a text.
+
+        Parameters
+        ----------
+        text : str
+            The text, e.g. a paragraph.
+
+        Returns
+        -------
+        translation : str or None
+            The translation of the most similar segment whose similarity is
+            at least REUSE_SIMILARITY and which has the same numbers, keys
+            and environments as the text, or None.
+        """
+        for _, source, translation in self.search(text, REUSE_SIMILARITY, 3):
+            if has_same_invariants(text, source):
+                return translation
+        return None
+
+    def __len__(self) -> int:
+        with self._lock:
+            row = self._connection.execute("SELECT COUNT(*) FROM segments").fetchone()
+        return row[0]
+
+    def clear(self) -> None:
+        """Remove all the segments and reset the counters."""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM segments")
+            self._connection.execute("DELETE FROM buckets")
+            self.lookups = 0
+            self.hits = 0
+
+    def get_statistics(self) -> dict:
+        """Return the counters of the memory.
+
+        Returns
+        -------
+        statistics : dict
+            The number of lookups, of lookups which found a segment, and of
+            stored segments.
+        """
+        return {"lookups": self.lookups, "hits": self.hits, "segments": len(self)}
+
+    def close(self) -> None:
+        """Close the database."""
+        with self._lock:
+            self._connection.close()
+
+
+def plan_memory_translation(
+    memory: TranslationMemory, latex_content: str
+) -> List[Tuple[str, Optional[str]]]:
+    """Find the blocks of a document whose translation is in the memory.
+
+    Parameters
+    ----------
+    memory : TranslationMemory
+        The translation memory.
+    latex_content : str
+        The LaTeX content.
+
+    Returns
+    -------
+    plan : list of tuple(str, str or None)
+        The pieces of the document, in order, each one with its reused
+        translation, or None if it must be translated, as returned by
+        latex_translator.incremental.plan_incremental_translation().
+        The consecutive blocks to translate are merged into one piece.
+    """
+    plan = []
+    for block, _ in split_latex_blocks(latex_content):
+        leading_blanks, content, trailing_blanks = split_blanks(block)
+        translation = None
+        if content:
+            translation = memory.find_reusable_translation(content)
+        elif not (plan and plan[-1][1] is None):
+            # The blanks are only translated with the block before them
+            translation = block
+        if translation is None:
+            if plan and plan[-1][1] is None:
+                plan[-1] = (plan[-1][0] + block, None)
+            else:
+                plan.append((block, None))
+        elif not content:
+            plan.append((block, block))
+        else:
+            plan.append((block, leading_blanks + translation + trailing_blanks))
+    return plan
+
+
+def get_memory_instructions(
+    examples: List[Tuple[str, str]], max_tokens: int = MAX_MEMORY_EXAMPLE_TOKENS
+) -> str:
+    """Return the prompt instructions which give examples of translations.
+
+    Parameters
+    ----------
+    examples : list of tuple(str, str)
+        The sources and the translations of similar segments, from the
+        most similar.
+    max_tokens : int, optional
+        The maximum number of tokens of the instructions.
+        The examples beyond it are left out.
+        Defaults to MAX_MEMORY_EXAMPLE_TOKENS.
+
+    Returns
+    -------
+    instructions : str
+        The instructions, or "" if there is no example.
+    """
+    header = (
+        "- Here are previous translations of similar passages. Translate the "
+        "shared phrasing in the same way:\n"
+    )
+    instructions = ""
+    tokens = estimate_tokens(header)
+    for source, translation in examples:
+        example = f"\nFrench:\n{source}\nEnglish:\n{translation}\n"
+        tokens += estimate_tokens(example)
+        if tokens > max_tokens:
+            break
+        instructions += example
+    return header + instructions + "\n" if instructions else ""
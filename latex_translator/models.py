@@ -0,0 +1,151 @@
+"""
+Characteristics of the language models used by the translators.
+"""
+
+# Number of tokens of the context window (prompt and completion)
+MODEL_CONTEXT_WINDOWS = {
+    "llama3-70b-8192": 8192,
+    "deepseek-r1-distill-llama-70b": 131072,
+    "qwen/qwen3-32b": 131072,
+    "llama-3.3-70b-versatile": 131072,
+    "llama3-8b-8192": 8192,
+    "gemma2-9b-it": 8192,
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+}
+
+# Maximum number of tokens of the completion
+MODEL_MAX_OUTPUT_TOKENS = {
+    "llama3-70b-8192": 8192,
+    "deepseek-r1-distill-llama-70b": 16384,
+    "qwen/qwen3-32b": 40960,
+    "llama-3.3-70b-versatile": 32768,
+    "llama3-8b-8192": 8192,
+    "gemma2-9b-it": 8192,
+    "gpt-3.5-turbo": 4096,
+    "gpt-4": 8192,
+}
+
+DEFAULT_CONTEXT_WINDOW = 8192
+DEFAULT_MAX_OUTPUT_TOKENS = 4096
+
+
+def get_context_window(model: str) -> int:
+    """Return the number of tokens of the context window of a model.
+
+    Parameters
+    ----------
+    model : str
+        The name of the model.
+
+    Returns
+    -------
+    context_window : int
+        The number of tokens, or a conservative default for unknown models.
+    """
+    return MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+
+
+def get_max_output_tokens(model: str) -> int:
+    """Return the maximum number of tokens of the completion of a model.
+
+    Parameters
+    ----------
+    model : str
+        The name of the model.
+
+    Returns
+    -------
+    max_output_tokens : int
+        The number of tokens, or a conservative default for unknown models.
+    """
+    return MODEL_MAX_OUTPUT_TOKENS.get(model, DEFAULT_MAX_OUTPUT_TOKENS)
+
+
+# Typical speed of the completion, in tokens per second.
+# The values are indicative: they depend on the load of the provider.
+MODEL_OUTPUT_SPEEDS = {
+    "llama3-70b-8192": 330.0,
+    "deepseek-r1-distill-llama-70b": 275.0,
+    "qwen/qwen3-32b": 400.0,
+    "llama-3.3-70b-versatile": 275.0,
+    "llama3-8b-8192": 1250.0,
+    "gemma2-9b-it": 500.0,
+    "gpt-3.5-turbo": 100.0,
+    "gpt-4": 30.0,
+}
+
+# Typical time before the first token of the completion, in seconds
+MODEL_FIRST_TOKEN_LATENCIES = {
+    "gpt-3.5-turbo": 0.5,
+    "gpt-4": 1.0,
+}
+
+# Price of one million tokens of the prompt and of the completion, in US dollars.
+# The values are indicative: check the pricing page of the provider.
+MODEL_PRICES = {
+    "llama3-70b-8192": (0.59, 0.79),
+    "deepseek-r1-distill-llama-70b": (0.75, 0.99),
+    "qwen/qwen3-32b": (0.29, 0.59),
+    "llama-3.3-70b-versatile": (0.59, 0.79),
+    "llama3-8b-8192": (0.05, 0.08),
+    "gemma2-9b-it": (0.20, 0.20),
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "gpt-4": (30.0, 60.0),
+}
+
+# Models which write their reasoning before the answer, e.g. in <think> tags
+REASONING_MODELS = {"deepseek-r1-distill-llama-70b", "qwen/qwen3-32b"}
+
+DEFAULT_OUTPUT_SPEED = 100.0
+DEFAULT_FIRST_TOKEN_LATENCY = 0.3
+
+
+def get_output_speed(model: str) -> float:
+    """Return the typical speed of the completion of a model.
+
+    Parameters
+    ----------
+    model : str
+        The name of the model.
+
+    Returns
+    -------
+    output_speed : float
+        The number of tokens per second, or a conservative default for
+        unknown models.
+    """
+    return MODEL_OUTPUT_SPEEDS.get(model, DEFAULT_OUTPUT_SPEED)
+
+
+def get_first_token_latency(model: str) -> float:
+    """Return the typical time before the first token of a model.
+
+    Parameters
+    ----------
+    model : str
+        The name of the model.
+
+    Returns
+    -------
+    latency : float
+        The time in seconds.
+    """
+    return MODEL_FIRST_TOKEN_LATENCIES.get(model, DEFAULT_FIRST_TOKEN_LATENCY)
+
+
+def get_prices(model: str):
+    """Return the price of the tokens of a model.
+
+    Parameters
+    ----------
+    model : str
+        The name of the model.
+
+    Returns
+    -------
+    prices : tuple(float, float) or None
+        The price of one million tokens of the prompt and of the
+        completion, in US dollars, or None if the model is unknown.
+    """
+    return MODEL_PRICES.get(model)
@@ -0,0 +1,148 @@
+"""
+Packing of many small segments into one translation request.
+
+The splitting translator produces many short segments: the argument of
+each `\\emph{}` or `\\section{}`, and each short run of text.
+Sending each one in its own request repeats the prompt instructions every
+time.
+This module packs the segments into batches, formats a batch with
+numbered delimiters and maps the answer back to the segments.
+If the delimiters of the answer are broken, the caller falls back to one
+request per segment.
+"""
+import re
+from typing import List, Optional, Sequence, Tuple
+
+from latex_translator.tokens import estimate_tokens
+
+BATCH_INSTRUCTIONS = (
+    "- The text is made of numbered segments, each one enclosed in "
+    "<seg id=N> and </seg> tags. \n"
+    "- Translate each segment on its own. \n"
+    "- Return every segment enclosed in the same tags, with the same id, "
+    "in the same order, and nothing else. \n"
+)
+
+_SEGMENT_PATTERN = re.compile(r"<seg id=(\d+)>(.*?)</seg>", re.DOTALL)
+
+_BLANKS_PATTERN = re.compile(r"\s+")
+
+
+def split_blanks(text: str) -> Tuple[str, str, str]:
+    """Split the blanks around a text.
+
+    Parameters
+    ----------
+    text : str
+        The text.
+
+    Returns
+    -------
+    leading_blanks : str
+        The blanks at the start of the text.
+    content : str
+        The text without the blanks around it.
+    trailing_blanks : str
+        The blanks at the end of the text.
+    """
+    content = text.strip()
+    if not content:
+        return text, "", ""
+    leading_blanks = text[: len(text) - len(text.lstrip())]
+    trailing_blanks = text[len(text.rstrip()) :]
+    return leading_blanks, content, trailing_blanks
+
+
+def normalize_blanks(text: str) -> str:
+    """Return a text with its runs of blanks replaced by single spaces.
+
+    Two segments which only differ by their blanks, e.g. a caption
+    wrapped differently, have the same normalized text, so that they can be
+    translated once.
+    """
+    return _BLANKS_PATTERN.sub(" ", text).strip()
+
+
+def pack_segments(
+    texts: Sequence[str], max_tokens: int = 1500, max_segments: int = 40
+) -> List[List[int]]:
+    """Group consecutive texts into batches.
+
+    Parameters
+    ----------
+    texts : sequence of str
+        The texts to translate.
+    max_tokens : int, optional
+        The maximum number of tokens of a batch. Defaults to 1500.
+        A text which alone exceeds it makes a batch on its own.
+    max_segments : int, optional
+        The maximum number of texts in a batch. Defaults to 40.
+
+    Returns
+    -------
+    batches : list of list of int
+        The indices of the texts of each batch, in order.
+    """
+    batches = []
+    current_batch = []
+    current_tokens = 0
+    for index, text in enumerate(texts):
+        # The delimiters cost a few tokens
+        text_tokens = estimate_tokens(text) + 10
+        if current_batch and (
+            current_tokens + text_tokens > max_tokens
+            or len(current_batch) >= max_segments
+        ):
+            batches.append(current_batch)
+            current_batch = []
+            current_tokens = 0
+        current_batch.append(index)
+        current_tokens += text_tokens
+    if current_batch:
+        batches.append(current_batch)
+    return batches
+
+
+def format_batch(texts: Sequence[str]) -> str:
+    """Enclose the texts of a batch in numbered delimiters.
+
+    Parameters
+    ----------
+    texts : sequence of str
+        The texts of the batch.
+
+    Returns
+    -------
+    batch_text : str
+        The text sent to the AI.
+    """
+    return "\n".join(
+        f"<seg id={number}>{text}</seg>" for number, text in enumerate(texts, 1)
+    )
+
+
+def parse_batch(response: str, number_of_segments: int) -> Optional[List[str]]:
+    """Map the answer of the AI back to the segments of the batch.
+
+    Parameters
+    ----------
+    response : str
+        The text returned by the AI.
+    number_of_segments : int
+        The number of segments of the batch.
+
+    Returns
+    -------
+    translations : list of str or None
+        The translation of each segment, in order, or None if the
+        delimiters are broken: a segment is missing, duplicated or unknown.
+    """
+    translations = [None] * number_of_segments
+    for match in _SEGMENT_PATTERN.finditer(response):
+        number = int(match.group(1))
+        if not 1 <= number <= number_of_segments or translations[number - 1] is not None:
+            return None
+        translations[number - 1] = match.group(2).strip()
+    if any(translation is None for translation in translations):
+        return None
+    return translations
@@ -0,0 +1,356 @@
+"""
+Translation of a LaTeX project made of several files.
+
+A thesis or a book is a tree of files: the main file includes the
+chapters with \\input{chapters/introduction} or \\include{...}, which may
+include other files in turn.
+This module reads the project from a zip archive or from a set of files,
+follows the include graph from the main files, translates the included
+files concurrently, and writes the translated project with the same
+layout.
+The other files of the project, e.g. the figures and the bibliography,
+are copied as they are.
+
+When the previous translation of the project is given, the files which
+did not change are not translated again, and the changed files are
+translated incrementally, so that only their changed blocks are sent to
+the AI.
+"""
+import concurrent.futures
+import io
+import posixpath
+import re
+import threading
+import zipfile
+from typing import Dict, List, Optional, Tuple
+
+from latex_translator.reporting import TranslationReporter
+
+# The extension of the LaTeX files
+LATEX_EXTENSION = ".tex"
+
+# The encodings tried in turn to read a LaTeX file
+LATEX_ENCODINGS = ("utf-8", "latin-1")
+
+# The commands which include another file, e.g. \input{chapters/intro}
+_INCLUDE_PATTERN = re.compile(r"\\(?:input|include|subfile)\s*\{\s*([^{}]+?)\s*\}")
+
+# The comments, which may contain commented out includes
+_COMMENT_PATTERN = re.compile(r"(?<!\\)%[^\n]*")
+
+_DOCUMENT_CLASS_PATTERN = re.compile(r"^[^%\n]*\\documentclass", re.MULTILINE)
+
+
+def normalize_project_path(path: str) -> str:
+    """Return the path of a file relative to the root of the project.
+
+    The separators are slashes, and the "." and ".." parts are resolved.
+    """
+    path = posixpath.normpath(path.replace("\\", "/")).lstrip("/")
+    return "" if path == "." else path
+
+
+def read_zip_project(zip_content: bytes) -> Dict[str, bytes]:
+    """Read the files of a project from a zip archive.
+
+    Parameters
+    ----------
+    zip_content : bytes
+        The content of the archive.
+
+    Returns
+    -------
+    files : dict
+        The content of each file, by path in the archive.
+        The directories and the metadata of macOS are skipped.
+    """
+    files = {}
+    with zipfile.ZipFile(io.BytesIO(zip_content)) as archive:
+        for information in archive.infolist():
+            path = normalize_project_path(information.filename)
+            if information.is_dir() or not path or path.startswith("__MACOSX/"):
+                continue
+            files[path] = archive.read(information)
+    return files
+
+
+def write_zip_project(files: Dict[str, bytes]) -> bytes:
+    """Write the files of a project in a zip archive.
+
+    Parameters
+    ----------
+    files : dict
+        The content of each file, by path in the project.
+
+    Returns
+    -------
+    zip_content : bytes
+        The content of the archive.
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for path in sorted(files):
+            archive.writestr(path, files[path])
+    return buffer.getvalue()
+
+
+def decode_latex(content: bytes) -> Tuple[str, str]:
+    """Decode a LaTeX file.
+
+    Returns
+    -------
+    text : str
+        The text of the file.
+    encoding : str
+        The encoding of the file, the first of LATEX_ENCODINGS which
+        decodes it.
+    """
+    for encoding in LATEX_ENCODINGS[:-1]:
+        try:
+            return content.decode(encoding), encoding
+        except UnicodeDecodeError:
+            pass
+    # latin-1 decodes any content
+    return content.decode(LATEX_ENCODINGS[-1]), LATEX_ENCODINGS[-1]
+
+
+def find_includes(latex_content: str) -> List[str]:
+    """Return the names of the files included by a LaTeX file.
+
+    Parameters
+    ----------
+    latex_content : str
+        The LaTeX content.
+
+    Returns
+    -------
+    names : list of str
+        The arguments of the \\input, \\include and \\subfile commands which
+        are not commented out, in their order in the file.
+    """
+    return _INCLUDE_PATTERN.findall(_COMMENT_PATTERN.sub("", latex_content))
+
+
+def resolve_include(name: str, directories: List[str], paths) -> Optional[str]:
+    """Find the file included with a name.
+
+    As LaTeX does, the name is searched relative to the directory of the
+    main file, and the extension .tex is added if the name has none.
+    The directory of the including file is also searched, since some
+    projects rely on it, e.g. with the import package.
+
+    Parameters
+    ----------
+    name : str
+        The argument of the include command.
+    directories : list of str
+        The directories in which the name is searched, in turn.
+    paths : collection of str
+        The paths of the files of the project.
+
+    Returns
+    -------
+    path : str or None
+        The path of the included file, or None if it is not in the project.
+    """
+    for directory in directories:
+        path = normalize_project_path(posixpath.join(directory, name))
+        candidates = [path]
+        if not posixpath.splitext(path)[1]:
+            candidates.insert(0, path + LATEX_EXTENSION)
+        for candidate in candidates:
+            if candidate in paths:
+                return candidate
+    return None
+
+
+def find_main_files(sources: Dict[str, str]) -> List[str]:
+    """Return the paths of the main files, which have a \\documentclass."""
+    return sorted(
+        path for path, text in sources.items() if _DOCUMENT_CLASS_PATTERN.search(text)
+    )
+
+
+def get_project_files(sources: Dict[str, str]) -> Tuple[List[str], List[str]]:
+    """Resolve the include graph of a project.
+
+    Parameters
+    ----------
+    sources : dict
+        The text of each LaTeX file, by path in the project.
+
+    Returns
+    -------
+    paths : list of str
+        The main files and the files they include, directly or not, in the
+        order in which they are found.
+        If the project has no main file, all the LaTeX files.
+    missing_includes : list of str
+        The includes which are not in the project, as "path: name".
+    """
+    main_paths = find_main_files(sources)
+    if not main_paths:
+        return sorted(sources), []
+    paths = []
+    missing_includes = []
+    known_paths = set()
+    for main_path in main_paths:
+        main_directory = posixpath.dirname(main_path)
+        stack = [main_path]
+        while stack:
+            path = stack.pop()
+            if path in known_paths:
+                continue
+            known_paths.add(path)
+            paths.append(path)
+            included_paths = []
+            for name in find_includes(sources[path]):
+                included_path = resolve_include(
+                    name, [main_directory, posixpath.dirname(path)], sources
+                )
+                if included_path is None:
+                    missing_includes.append(f"{path}: {name}")
+                else:
+                    included_paths.append(included_path)
+            # Depth first, in the order of the includes
+            stack.extend(reversed(included_paths))
+    return paths, missing_includes
+
+
+def translate_project(
+    files: Dict[str, bytes],
+    create_translator,
+    previous_translations: Optional[Dict[str, Tuple[str, str]]] = None,
+    max_workers: int = 4,
+    reporter: Optional[TranslationReporter] = None,
+) -> Tuple[Dict[str, bytes], Dict[str, Tuple[str, str]], dict]:
+    """Translate the LaTeX files of a project.
+
+    Each file is translated by its own translator, in a pool of threads.
+    The translators run in the threads of the pool: their reporter is
+    replaced by a TranslationReporter, and the progress of the project is
+    sent to the reporter of the project, from the calling thread.
+    A semaphore shared by the translators bounds the total number of
+    requests in flight to the concurrency of one translator.
+
+    Parameters
+    ----------
+    files : dict
+        The content of each file, by path in the project.
+    create_translator : callable
+        A function which returns a new translator, e.g. with the cache and
+        the glossary shared by all the files.
+        It is called from the calling thread, once per file to translate.
+    previous_translations : dict, optional
+        The source and the translation of each file in the previous
+        translation of the project, by path, as returned by this function.
+        The files whose source did not change are not translated again,
+        and the changed files are translated incrementally.
+    max_workers : int, optional
+        The number of files translated at once. Defaults to 4.
+    reporter : TranslationReporter, optional
+        The receiver of the progress, one step per file, and of the errors.
+        If None, the errors are printed.
+
+    Returns
+    -------
+    translated_files : dict
+        The content of each file of the translated project.
+        The files which are not translated are copied.
+    translations : dict
+        The source and the translation of each file translated completely,
+        to give as previous_translations to the next translation.
+    statistics : dict
+        The number of files, of translated, incrementally translated and
+        reused files, the number of tokens, the finish reason of each
+        file, the errors of each file and the missing includes.
+    """
+    if previous_translations is None:
+        previous_translations = {}
+    if reporter is None:
+        reporter = TranslationReporter()
+    sources = {}
+    encodings = {}
+    for path, content in files.items():
+        if path.lower().endswith(LATEX_EXTENSION):
+            sources[path], encodings[path] = decode_latex(content)
+    paths, missing_includes = get_project_files(sources)
+    statistics = {
+        "files": len(paths),
+        "translated": 0,
+        "incremental": 0,
+        "reused": 0,
+        "tokens": 0,
+        "finish_reasons": {},
+        "errors": {},
+        "missing_includes": missing_includes,
+    }
+    translated_files = dict(files)
+    translations = {}
+
+    def translate_file(translator, path):
+        if path in previous_translations:
+            previous_source, previous_translation = previous_translations[path]
+            result = translator.translate_incremental(
+                sources[path], previous_source, previous_translation
+            )
+        else:
+            result = translator.translate(sources[path])
+        return result, list(translator.errors)
+
+    tasks = []
+    for path in paths:
+        previous = previous_translations.get(path)
+        if previous is not None and previous[0] == sources[path]:
+            translations[path] = previous
+            translated_files[path] = previous[1].encode(encodings[path])
+            statistics["reused"] += 1
+            statistics["finish_reasons"][path] = "stop"
+        else:
+            tasks.append(path)
+
+    reporter.on_start(len(paths))
+    number_done = statistics["reused"]
+    reporter.on_progress(number_done, len(paths))
+    if tasks:
+        # The translators are created in the calling thread, e.g. from the
+        # state of a Streamlit session
+        translators = [create_translator() for _ in tasks]
+        request_semaphore = threading.BoundedSemaphore(translators[0].max_concurrency)
+        for translator in translators:
+            translator.set_reporter(TranslationReporter())
+            translator.request_semaphore = request_semaphore
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(translate_file, translator, path): path
+                for translator, path in zip(translators, tasks)
+            }
+            for future in concurrent.futures.as_completed(futures):
+                path = futures[future]
+                try:
+                    (translation, total_tokens, finish_reason), errors = future.result()
+                except Exception as e:
+                    reporter.on_error(f"{path} : {e}")
+                    statistics["errors"][path] = [str(e)]
+                    statistics["finish_reasons"][path] = "Erreur"
+                else:
+                    # Only the complete translations are worth reusing
+                    if finish_reason == "stop" and not errors:
+                        translations[path] = (sources[path], translation)
+                    translated_files[path] = translation.encode(
+                        encodings[path], errors="replace"
+                    )
+                    statistics["tokens"] += total_tokens
+                    statistics["finish_reasons"][path] = finish_reason
+                    if path in previous_translations:
+                        statistics["incremental"] += 1
+                    else:
+                        statistics["translated"] += 1
+                    if errors:
+                        statistics["errors"][path] = errors
+                        for error in errors:
+                            reporter.on_error(f"{path} : {error}")
+                number_done += 1
+                reporter.on_progress(number_done, len(paths))
+    reporter.on_finish()
+    return translated_files, translations, statistics
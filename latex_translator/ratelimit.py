@@ -0,0 +1,526 @@
+"""
+Client-side rate limiting and retries of the requests to the providers.
+
+Under load, the providers answer 429 (too many requests) when the quota of
+requests or tokens per minute is exceeded.
+Without retries, the chunk is left untranslated.
+This module provides:
+
+- a rate limiter with two token buckets, for the requests per minute and
+  for the tokens per minute, which also follows the rate-limit headers of
+  the answers and pauses all the requests after a 429,
+- exponential backoff with full jitter, which honors the `retry-after`
+  header,
+- a retry budget, shared by all the requests of a translation, so that a
+  provider which is down does not make a job retry forever.
+
+The limiters are shared by the whole process, one per provider, since the
+quota is shared by all the translations.
+The quotas are configured with environment variables, e.g.
+LATEX_TRANSLATOR_GROQ_RPM and LATEX_TRANSLATOR_GROQ_TPM for Groq.
+Without quota, the limiter learns the quota of tokens from the headers,
+and pauses after the 429 answers.
+"""
+import asyncio
+import os
+import random
+import re
+import threading
+import time
+from typing import Callable, Optional
+
+# The HTTP status codes worth retrying
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+DEFAULT_MAX_ATTEMPTS = 6
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 60.0
+
+_DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(text: str) -> Optional[float]:
+    """Parse the duration of a rate-limit header.
+
+    Parameters
+    ----------
+    text : str
+        The duration: a number of seconds (e.g. "7.66"), or a duration
+        with units (e.g. "2m59.56s" or "120ms").
+
+    Returns
+    -------
+    duration : float or None
+        The duration in seconds, or None if the text cannot be parsed.
+    """
+    text = text.strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    matches = _DURATION_PATTERN.findall(text)
+    if not matches or "".join(number + unit for number, unit in matches) != text:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in matches)
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute: float):
+        """Initialize the TokenBucket.
+
+        The bucket holds at most one minute of capacity and refills
+        continuously.
+        A reservation may take more than what is available: the bucket then
+        goes into debt, and the next reservations wait longer, in order.
+        This class is not thread-safe: RateLimiter locks it.
+
+        Parameters
+        ----------
+        rate_per_minute : float
+            The capacity which is refilled each minute.
+        """
+        if rate_per_minute <= 0.0:
+            raise ValueError(
+                f"The rate must be positive, but rate_per_minute={rate_per_minute}"
+            )
+        self.capacity = rate_per_minute
+        self.rate = rate_per_minute / 60.0
+        self.level = rate_per_minute
+        self.last_time = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.last_time) * self.rate)
+        self.last_time = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take an amount from the bucket and return the time to wait before using it."""
+        self._refill(now)
+        self.level -= amount
+        return max(0.0, -self.level / self.rate)
+
+    def restrict(self, remaining: float, now: float) -> None:
+        """Lower the level of the bucket to what the provider reports."""
+        self._refill(now)
+        self.level = min(self.level, remaining)
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        """Initialize the RateLimiter.
+
+        The limiter is thread-safe and can be shared by sync and async
+        callers: reserve() only computes the time to wait, and the caller
+        sleeps in the way which suits it.
+
+        Parameters
+        ----------
+        requests_per_minute : float, optional
+            The quota of requests per minute.
+            If None, the number of requests is not limited.
+        tokens_per_minute : float, optional
+            The quota of tokens per minute.
+            If None, the number of tokens is not limited.
+        """
+        self.request_bucket = None
+        if requests_per_minute is not None:
+            self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = None
+        if tokens_per_minute is not None:
+            self.token_bucket = TokenBucket(tokens_per_minute)
+        # The time before which no request is sent, after a 429
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.retries = 0
+        self.wait_time = 0.0
+
+    def reserve(self, tokens: int = 0) -> float:
+        """Reserve the quota of one request.
+
+        Parameters
+        ----------
+        tokens : int, optional
+            The estimated number of tokens of the request: the prompt and
+            the completion.
+
+        Returns
+        -------
+        delay : float
+            The time to wait before sending the request, in seconds.
+        """
+        with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self.paused_until - now)
+            if self.request_bucket is not None:
+                delay = max(delay, self.request_bucket.reserve(1, now))
+            if self.token_bucket is not None and tokens > 0:
+                delay = max(delay, self.token_bucket.reserve(tokens, now))
+            self.requests += 1
+            self.wait_time += delay
+            return delay
+
+    def wait(self, tokens: int = 0) -> None:
+        """Reserve the quota of one request and sleep until it can be sent."""
+        delay = self.reserve(tokens)
+        if delay > 0.0:
+            time.sleep(delay)
+
+    async def wait_async(self, tokens: int = 0) -> None:
+        """Reserve the quota of one request and sleep until it can be sent."""
+        delay = self.reserve(tokens)
+        if delay > 0.0:
+            await asyncio.sleep(delay)
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Correct the token bucket with the actual usage of a request.
+
+        Parameters
+        ----------
+        estimated_tokens : int
+            The number of tokens given to reserve().
+        actual_tokens : int
+            The number of tokens reported by the provider.
+        """
+        if self.token_bucket is None:
+            return
+        with self._lock:
+            self.token_bucket.level -= actual_tokens - estimated_tokens
+
+    def update_from_headers(self, headers) -> None:
+        """Follow the rate-limit headers of an answer.
+
+        The buckets are lowered to the remaining quota reported by the
+        provider, e.g. when other processes share the same API key.
+        If no quota of tokens was given, the limit of tokens per minute
+        reported by the provider is used.
+
+        Parameters
+        ----------
+        headers : mapping
+            The headers of the HTTP answer.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.token_bucket is None:
+                # The limit of requests of Groq is per day: only the limit
+                # of tokens per minute is followed
+                limit = headers.get("x-ratelimit-limit-tokens")
+                try:
+                    if limit is not None and float(limit) > 0.0:
+                        self.token_bucket = TokenBucket(float(limit))
+                except ValueError:
+                    pass
+            for bucket, name in (
+                (self.request_bucket, "requests"),
+                (self.token_bucket, "tokens"),
+            ):
+                remaining = headers.get(f"x-ratelimit-remaining-{name}")
+                if bucket is None or remaining is None:
+                    continue
+                try:
+                    bucket.restrict(float(remaining), now)
+                except ValueError:
+                    continue
+
+    def report_throttle(self, retry_after: Optional[float]) -> None:
+        """Pause all the requests after a 429 answer.
+
+        Parameters
+        ----------
+        retry_after : float or None
+            The time to wait given by the provider, in seconds, if any.
+        """
+        with self._lock:
+            self.throttled += 1
+            if retry_after is not None:
+                self.paused_until = max(
+                    self.paused_until, time.monotonic() + retry_after
+                )
+
+    def report_retry(self) -> None:
+        """Count a retry."""
+        with self._lock:
+            self.retries += 1
+
+    def get_statistics(self) -> dict:
+        """Return the counters of the limiter.
+
+        Returns
+        -------
+        statistics : dict
+            The number of requests, of 429 answers (throttled), of retries,
+            and the total time waited before sending the requests, in
+            seconds.
+        """
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "retries": self.retries,
+                "wait_time": self.wait_time,
+            }
+
+
+class RetryBudget:
+    def __init__(self, max_retries: int = 20):
+        """Initialize the RetryBudget.
+
+        The budget is shared by all the requests of a translation.
+
+        Parameters
+        ----------
+        max_retries : int, optional
+            The maximum number of retries. Defaults to 20.
+        """
+        self.remaining = max_retries
+        self._lock = threading.Lock()
+
+    def consume(self) -> bool:
+        """Take one retry from the budget.
+
+        Returns
+        -------
+        is_allowed : bool
+            True if the retry is allowed, False if the budget is exhausted.
+        """
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+
+def get_status_code(error: Exception) -> Optional[int]:
+    """Return the HTTP status code of an error of the SDKs, if any."""
+    return getattr(error, "status_code", None)
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """Return the time to wait given by the provider with an error.
+
+    The headers retry-after-ms, retry-after, then the reset time of the
+    exhausted quota (x-ratelimit-reset-requests or -tokens) are used.
+
+    Parameters
+    ----------
+    error : Exception
+        The error raised by the SDK.
+
+    Returns
+    -------
+    retry_after : float or None
+        The time in seconds, or None if the provider gives none.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is None:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after is not None:
+        duration = parse_duration(retry_after)
+        if duration is not None:
+            return duration
+    for name in ("requests", "tokens"):
+        if headers.get(f"x-ratelimit-remaining-{name}") == "0":
+            reset = headers.get(f"x-ratelimit-reset-{name}")
+            if reset is not None:
+                return parse_duration(reset)
+    return None
+
+
+def is_retryable(error: Exception) -> bool:
+    """Tell whether a request which raised an error is worth retrying.
+
+    Parameters
+    ----------
+    error : Exception
+        The error raised by the SDK.
+
+    Returns
+    -------
+    is_retryable : bool
+        True for the rate limits, the server errors, the timeouts and the
+        connection errors.
+    """
+    status_code = get_status_code(error)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+    name = type(error).__name__
+    return "Timeout" in name or "Connection" in name
+
+
+def get_retry_delay(
+    attempt: int,
+    retry_after: Optional[float] = None,
+    base_delay: float = DEFAULT_BASE_DELAY,
+    max_delay: float = DEFAULT_MAX_DELAY,
+) -> float:
+    """Return the time to wait before a retry.
+
+    The delay is drawn uniformly up to an exponentially growing bound (full
+    jitter), so that the clients which failed together do not retry
+    together.
+    The time given by the provider is a minimum.
+
+    Parameters
+    ----------
+    attempt : int
+        The number of the failed attempt, starting from 1.
+    retry_after : float, optional
+        The time to wait given by the provider, in seconds.
+    base_delay : float, optional
+        The bound of the first retry, in seconds.
+    max_delay : float, optional
+        The maximum bound, in seconds.
+
+    Returns
+    -------
+    delay : float
+        The time in seconds.
+    """
+    delay = random.uniform(0.0, min(max_delay, base_delay * 2.0 ** (attempt - 1)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def _prepare_retry(error, attempt, max_attempts, rate_limiter, retry_budget):
+    """Return the time to wait before retrying, or raise the error."""
+    retry_after = get_retry_after(error)
+    if rate_limiter is not None and get_status_code(error) == 429:
+        rate_limiter.report_throttle(retry_after)
+    if not is_retryable(error) or attempt >= max_attempts:
+        raise error
+    if retry_budget is not None and not retry_budget.consume():
+        raise error
+    if rate_limiter is not None:
+        rate_limiter.report_retry()
+    return get_retry_delay(attempt, retry_after)
+
+
+def call_with_retry(
+    function: Callable,
+    rate_limiter: Optional[RateLimiter] = None,
+    retry_budget: Optional[RetryBudget] = None,
+    tokens: int = 0,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+):
+    """Call a function which sends a request, within the rate limit, with retries.
+
+    Parameters
+    ----------
+    function : callable
+        The function, called without argument.
+    rate_limiter : RateLimiter, optional
+        The rate limiter of the provider.
+    retry_budget : RetryBudget, optional
+        The retry budget of the translation.
+    tokens : int, optional
+        The estimated number of tokens of the request.
+    max_attempts : int, optional
+        The maximum number of attempts of the request.
+
+    Returns
+    -------
+    result : object
+        The value returned by the function.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        if rate_limiter is not None:
+            rate_limiter.wait(tokens)
+        try:
+            return function()
+        except Exception as e:
+            delay = _prepare_retry(e, attempt, max_attempts, rate_limiter, retry_budget)
+            print(f"Nouvelle tentative dans {delay:.1f} (s) : {str(e)}")
+            time.sleep(delay)
+
+
+async def call_with_retry_async(
+    function: Callable,
+    rate_limiter: Optional[RateLimiter] = None,
+    retry_budget: Optional[RetryBudget] = None,
+    tokens: int = 0,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+):
+    """Await a coroutine function which sends a request, with retries.
+
+    This is the async counterpart of call_with_retry().
+
+    Parameters
+    ----------
+    function : callable
+        The coroutine function, called without argument.
+    rate_limiter : RateLimiter, optional
+        The rate limiter of the provider.
+    retry_budget : RetryBudget, optional
+        The retry budget of the translation.
+    tokens : int, optional
+        The estimated number of tokens of the request.
+    max_attempts : int, optional
+        The maximum number of attempts of the request.
+
+    Returns
+    -------
+    result : object
+        The value returned by the coroutine.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        if rate_limiter is not None:
+            await rate_limiter.wait_async(tokens)
+        try:
+            return await function()
+        except Exception as e:
+            delay = _prepare_retry(e, attempt, max_attempts, rate_limiter, retry_budget)
+            print(f"Nouvelle tentative dans {delay:.1f} (s) : {str(e)}")
+            await asyncio.sleep(delay)
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def _get_quota(name: str) -> Optional[float]:
+    value = os.environ.get(name)
+    return float(value) if value else None
+
+
+def get_rate_limiter(provider: str = "groq") -> RateLimiter:
+    """Return the rate limiter of a provider, shared by the process.
+
+    The quotas are read from the environment variables
+    LATEX_TRANSLATOR_<PROVIDER>_RPM and LATEX_TRANSLATOR_<PROVIDER>_TPM,
+    e.g. LATEX_TRANSLATOR_GROQ_TPM=6000.
+
+    Parameters
+    ----------
+    provider : str, optional
+        The provider, "groq" or "openai". Defaults to "groq".
+
+    Returns
+    -------
+    rate_limiter : RateLimiter
+        The rate limiter.
+    """
+    with _rate_limiters_lock:
+        rate_limiter = _rate_limiters.get(provider)
+        if rate_limiter is None:
+            prefix = f"LATEX_TRANSLATOR_{provider.upper()}"
+            rate_limiter = RateLimiter(
+                requests_per_minute=_get_quota(f"{prefix}_RPM"),
+                tokens_per_minute=_get_quota(f"{prefix}_TPM"),
+            )
+            _rate_limiters[provider] = rate_limiter
+        return rate_limiter
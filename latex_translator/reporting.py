@@ -0,0 +1,60 @@
+"""
+Reporting of the progress and of the errors of a translation.
+
+The translators do not know how the progress is shown: they call the
+methods of a reporter, which the user interface implements.
+The Streamlit app draws a progress bar, while the command line prints the
+errors.
+"""
+
+
+class TranslationReporter:
+    def __init__(self):
+        """Initialize the TranslationReporter.
+
+        This reporter prints the errors and ignores the other events.
+        The user interfaces derive from it and override the methods they
+        need.
+        The methods are called in the thread which calls the translator,
+        even when the requests run in other threads, so that they can
+        update the widgets of the interface.
+        """
+        pass
+
+    def on_start(self, number_total: int) -> None:
+        """Report the start of a translation.
+
+        Parameters
+        ----------
+        number_total : int
+            The number of pieces of the document to translate.
+        """
+        pass
+
+    def on_progress(self, number_done: int, number_total: int) -> None:
+        """Report that a piece of the document is translated.
+
+        Parameters
+        ----------
+        number_done : int
+            The number of pieces translated so far.
+        number_total : int
+            The number of pieces of the document to translate.
+        """
+        pass
+
+    def on_error(self, error: str) -> None:
+        """Report the error of a request.
+
+        The piece of the document is then left untranslated.
+
+        Parameters
+        ----------
+        error : str
+            The description of the error.
+        """
+        print(f"Erreur lors de la traduction : {error}")
+
+    def on_finish(self) -> None:
+        """Report the end of a translation."""
+        pass
@@ -0,0 +1,501 @@
+"""
+Routing of the requests between several endpoints of the providers.
+
+An endpoint is a model of a provider, possibly reached at another base URL,
+e.g. "groq:llama3-70b-8192" or "openai:gpt-4o-mini@http://127.0.0.1:8765".
+Each endpoint keeps the rolling latencies and errors of its last requests.
+The router sends each request to the healthiest endpoint and fails over
+to the next one when a request fails.
+When an endpoint fails repeatedly, or answers 429, it is put aside for a
+while, and only used when all the other endpoints failed.
+
+Optionally, the router hedges the slow requests: when the first endpoint
+does not answer within the 95th percentile of its latencies, the same
+request is sent to the second endpoint, and the first answer is kept.
+Hedging costs the tokens of the duplicated requests, but cuts the tail of
+the latencies when one provider is slow.
+
+The endpoints are shared by the whole process, so that their statistics
+are kept from one translation to the next.
+"""
+import collections
+import concurrent.futures
+import threading
+import time
+from typing import Callable, List, Optional
+
+from latex_translator.clients import PROVIDERS, get_client
+from latex_translator.ratelimit import (
+    RateLimiter,
+    get_rate_limiter,
+    get_retry_after,
+    get_status_code,
+)
+
+DEFAULT_WINDOW = 50
+DEFAULT_MAX_FAILURES = 3
+DEFAULT_COOLDOWN = 30.0
+DEFAULT_HEDGE_QUANTILE = 0.95
+DEFAULT_MIN_HEDGE_SAMPLES = 5
+DEFAULT_LATENCY_TOLERANCE = 2.0
+# The weight of the error rate in the score of an endpoint
+ERROR_PENALTY = 4.0
+
+
+def get_quantile(values: List[float], quantile: float) -> float:
+    """Return a quantile of values, by linear interpolation.
+
+    Parameters
+    ----------
+    values : list of float
+        The values, not empty.
+    quantile : float, in [0, 1]
+        The level of the quantile, e.g. 0.95.
+
+    Returns
+    -------
+    value : float
+        The quantile.
+    """
+    values = sorted(values)
+    position = quantile * (len(values) - 1)
+    index = int(position)
+    if index + 1 >= len(values):
+        return values[-1]
+    return values[index] + (position - index) * (values[index + 1] - values[index])
+
+
+class Endpoint:
+    def __init__(
+        self,
+        provider="groq",
+        model="llama3-8b-8192",
+        base_url=None,
+        window=DEFAULT_WINDOW,
+        max_failures=DEFAULT_MAX_FAILURES,
+        cooldown=DEFAULT_COOLDOWN,
+    ):
+        """Initialize the Endpoint.
+
+        The statistics are thread-safe.
+
+        Parameters
+        ----------
+        provider : str, optional
+            The provider, "groq" or "openai". Defaults to "groq".
+        model : str, optional
+            The model. Defaults to "llama3-8b-8192".
+        base_url : str, optional
+            The URL of the API, e.g. of a local OpenAI-compatible server.
+            If None, use the default URL of the provider.
+        window : int, optional
+            The number of the last requests of the rolling statistics.
+            Defaults to 50.
+        max_failures : int, optional
+            The number of consecutive failures after which the endpoint is
+            put aside. Defaults to 3.
+        cooldown : float, optional
+            The time during which an endpoint is put aside, in seconds.
+            Defaults to 30.
+        """
+        if provider not in PROVIDERS:
+            raise ValueError(f"Unknown provider {provider}, expected one of {PROVIDERS}")
+        self.provider = provider
+        self.model = model
+        self.base_url = base_url
+        self.name = f"{provider}:{model}"
+        if base_url is not None:
+            self.name += f"@{base_url}"
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        # The quota of the provider is shared with the other translators,
+        # but not the one of a custom server
+        if base_url is None:
+            self.rate_limiter = get_rate_limiter(provider)
+        else:
+            self.rate_limiter = RateLimiter()
+        self.latencies = collections.deque(maxlen=window)
+        self.outcomes = collections.deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.unavailable_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """The client of the endpoint, shared by the process."""
+        return get_client(self.provider, self.base_url)
+
+    def record_success(self, latency: float) -> None:
+        """Record a successful request.
+
+        Parameters
+        ----------
+        latency : float
+            The duration of the request, in seconds.
+        """
+        with self._lock:
+            self.requests += 1
+            self.latencies.append(latency)
+            self.outcomes.append(True)
+            self.consecutive_failures = 0
+
+    def record_failure(self, error: Exception) -> None:
+        """Record a failed request.
+
+        After a 429 answer, the endpoint is put aside until the time given
+        by the provider.
+        After max_failures consecutive failures, it is put aside for the
+        cooldown time.
+
+        Parameters
+        ----------
+        error : Exception
+            The error raised by the request.
+        """
+        retry_after = get_retry_after(error)
+        if get_status_code(error) == 429:
+            self.rate_limiter.report_throttle(retry_after)
+        with self._lock:
+            self.requests += 1
+            self.failures += 1
+            self.outcomes.append(False)
+            self.consecutive_failures += 1
+            now = time.monotonic()
+            if get_status_code(error) == 429 and retry_after is not None:
+                self.unavailable_until = max(self.unavailable_until, now + retry_after)
+            if self.consecutive_failures >= self.max_failures:
+                self.unavailable_until = max(self.unavailable_until, now + self.cooldown)
+
+    def is_available(self) -> bool:
+        """Tell whether the endpoint is not put aside."""
+        return time.monotonic() >= self.unavailable_until
+
+    def get_error_rate(self) -> float:
+        """Return the rate of the failed requests, in the rolling window."""
+        with self._lock:
+            if not self.outcomes:
+                return 0.0
+            return self.outcomes.count(False) / len(self.outcomes)
+
+    def get_latency(self, quantile: float = 0.5) -> Optional[float]:
+        """Return a quantile of the latencies, in the rolling window.
+
+        Parameters
+        ----------
+        quantile : float, optional
+            The level of the quantile. Defaults to 0.5, the median.
+
+        Returns
+        -------
+        latency : float or None
+            The latency in seconds, or None if no request succeeded yet.
+        """
+        with self._lock:
+            if not self.latencies:
+                return None
+            return get_quantile(list(self.latencies), quantile)
+
+    def get_statistics(self) -> dict:
+        """Return the statistics of the endpoint.
+
+        Returns
+        -------
+        statistics : dict
+            The name, the number of requests and of failures, the error rate
+            and the median and 95th percentile of the latencies (None
+            without successful request), and whether the endpoint is
+            available.
+        """
+        return {
+            "name": self.name,
+            "requests": self.requests,
+            "failures": self.failures,
+            "error_rate": self.get_error_rate(),
+            "p50": self.get_latency(0.5),
+            "p95": self.get_latency(0.95),
+            "available": self.is_available(),
+        }
+
+
+_endpoints = {}
+_endpoints_lock = threading.Lock()
+
+
+def get_endpoint(
+    provider: str = "groq", model: str = "llama3-8b-8192", base_url=None
+) -> Endpoint:
+    """Return an endpoint, shared by the process.
+
+    Parameters
+    ----------
+    provider : str, optional
+        The provider, "groq" or "openai". Defaults to "groq".
+    model : str, optional
+        The model. Defaults to "llama3-8b-8192".
+    base_url : str, optional
+        The URL of the API. If None, use the default URL of the provider.
+
+    Returns
+    -------
+    endpoint : Endpoint
+        The endpoint.
+    """
+    key = (provider, model, base_url)
+    with _endpoints_lock:
+        endpoint = _endpoints.get(key)
+        if endpoint is None:
+            endpoint = Endpoint(provider, model, base_url)
+            _endpoints[key] = endpoint
+        return endpoint
+
+
+def parse_endpoint(text: str) -> Endpoint:
+    """Return the endpoint described by a text.
+
+    Parameters
+    ----------
+    text : str
+        The description "provider:model", optionally followed by
+        "@base_url", e.g. "openai:gpt-4o-mini@http://127.0.0.1:8765".
+        Without provider, the provider is Groq.
+
+    Returns
+    -------
+    endpoint : Endpoint
+        The shared endpoint.
+    """
+    base_url = None
+    if "@" in text:
+        text, base_url = text.split("@", 1)
+    provider, separator, model = text.partition(":")
+    if not separator:
+        provider, model = "groq", text
+    if provider not in PROVIDERS or not model:
+        raise ValueError(
+            f"Invalid endpoint {text}, expected provider:model[@base_url] "
+            f"with a provider in {PROVIDERS}"
+        )
+    return get_endpoint(provider, model, base_url)
+
+
+_hedging_executor = None
+_hedging_executor_lock = threading.Lock()
+
+
+def _get_hedging_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """Return the threads which send the hedged requests, shared by the process."""
+    global _hedging_executor
+    with _hedging_executor_lock:
+        if _hedging_executor is None:
+            _hedging_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=32, thread_name_prefix="latex-translator-hedging"
+            )
+        return _hedging_executor
+
+
+class Router:
+    def __init__(
+        self,
+        endpoints: List[Endpoint],
+        hedge=False,
+        hedge_quantile=DEFAULT_HEDGE_QUANTILE,
+        min_hedge_samples=DEFAULT_MIN_HEDGE_SAMPLES,
+        latency_tolerance=DEFAULT_LATENCY_TOLERANCE,
+    ):
+        """Initialize the Router.
+
+        The endpoints are given by order of preference: an endpoint is
+        preferred to the next ones as long as its score is within
+        latency_tolerance times the best score.
+        The score is the median latency, increased by the error rate.
+
+        Parameters
+        ----------
+        endpoints : list of Endpoint
+            The endpoints, by order of preference.
+        hedge : bool, optional
+            Whether to send a slow request to a second endpoint.
+            Defaults to False.
+        hedge_quantile : float, optional
+            The quantile of the latencies of the first endpoint after which
+            the request is hedged. Defaults to 0.95.
+        min_hedge_samples : int, optional
+            The number of latencies of the first endpoint needed before
+            hedging. Defaults to 5.
+        latency_tolerance : float, optional
+            The ratio of the score of a preferred endpoint to the best
+            score, under which the preferred endpoint is kept.
+            Defaults to 2.
+        """
+        if not endpoints:
+            raise ValueError("The router needs at least one endpoint")
+        self.endpoints = list(endpoints)
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.min_hedge_samples = min_hedge_samples
+        self.latency_tolerance = latency_tolerance
+        self.failovers = 0
+        self.hedged_requests = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+
+    def _get_score(self, endpoint: Endpoint, default_latency: float) -> float:
+        latency = endpoint.get_latency()
+        if latency is None:
+            latency = default_latency
+        return latency * (1.0 + ERROR_PENALTY * endpoint.get_error_rate())
+
+    def rank_endpoints(self) -> List[Endpoint]:
+        """Return the endpoints, from the one to try first to the last one.
+
+        Returns
+        -------
+        endpoints : list of Endpoint
+            The available endpoints, the selected one first, then the
+            endpoints put aside, the first one to come back first.
+        """
+        available = [endpoint for endpoint in self.endpoints if endpoint.is_available()]
+        unavailable = sorted(
+            (endpoint for endpoint in self.endpoints if not endpoint.is_available()),
+            key=lambda endpoint: endpoint.unavailable_until,
+        )
+        if not available:
+            return unavailable
+        # The endpoints without latency yet are scored as the average one
+        known_latencies = [
+            endpoint.get_latency()
+            for endpoint in available
+            if endpoint.get_latency() is not None
+        ]
+        default_latency = 1.0
+        if known_latencies:
+            default_latency = sum(known_latencies) / len(known_latencies)
+        scores = [self._get_score(endpoint, default_latency) for endpoint in available]
+        best_score = min(scores)
+        selected = next(
+            index
+            for index, score in enumerate(scores)
+            if score <= self.latency_tolerance * best_score
+        )
+        others = sorted(
+            (index for index in range(len(available)) if index != selected),
+            key=lambda index: scores[index],
+        )
+        return [available[selected]] + [available[index] for index in others] + unavailable
+
+    def _get_hedge_delay(self, endpoint: Endpoint) -> Optional[float]:
+        """Return the time after which a request to an endpoint is hedged, if any."""
+        if len(endpoint.latencies) < self.min_hedge_samples:
+            return None
+        return endpoint.get_latency(self.hedge_quantile)
+
+    @staticmethod
+    def _call_endpoint(endpoint: Endpoint, function: Callable):
+        """Call the function on an endpoint and record the outcome."""
+        start_time = time.monotonic()
+        try:
+            result = function(endpoint)
+        except Exception as e:
+            endpoint.record_failure(e)
+            raise
+        endpoint.record_success(time.monotonic() - start_time)
+        return result
+
+    def _call_hedged(
+        self, endpoint: Endpoint, hedge_endpoint: Endpoint, delay: float, function: Callable
+    ):
+        """Call the function on an endpoint, and on a second one if it is slow.
+
+        If the first endpoint fails before the delay, the request fails
+        over to the second one.
+        """
+        executor = _get_hedging_executor()
+        future = executor.submit(self._call_endpoint, endpoint, function)
+        try:
+            return future.result(timeout=delay)
+        except concurrent.futures.TimeoutError:
+            pass
+        except Exception as e:
+            with self._lock:
+                self.failovers += 1
+            print(f"Bascule vers {hedge_endpoint.name} : {str(e)}")
+            return self._call_endpoint(hedge_endpoint, function)
+        with self._lock:
+            self.hedged_requests += 1
+        hedge_future = executor.submit(self._call_endpoint, hedge_endpoint, function)
+        pending = {future, hedge_future}
+        error = None
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for done_future in done:
+                if done_future.exception() is None:
+                    # The slower request goes on, and its latency is recorded
+                    if done_future is hedge_future:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return done_future.result()
+                error = done_future.exception()
+        raise error
+
+    def call(self, function: Callable, hedge: Optional[bool] = None):
+        """Call a function which sends a request, on the healthiest endpoint.
+
+        If the request fails, it is sent to the next endpoint, until one
+        succeeds.
+
+        Parameters
+        ----------
+        function : callable
+            The function, called with the endpoint.
+        hedge : bool, optional
+            Whether to hedge the request. If None, use the hedge attribute.
+            The streamed requests must not be hedged.
+
+        Returns
+        -------
+        result : object
+            The value returned by the function.
+        """
+        if hedge is None:
+            hedge = self.hedge
+        endpoints = self.rank_endpoints()
+        error = None
+        while endpoints:
+            endpoint = endpoints.pop(0)
+            if error is not None:
+                with self._lock:
+                    self.failovers += 1
+                print(f"Bascule vers {endpoint.name} : {str(error)}")
+            delay = None
+            if hedge and endpoints:
+                delay = self._get_hedge_delay(endpoint)
+            try:
+                if delay is None:
+                    return self._call_endpoint(endpoint, function)
+                # The second endpoint is called by _call_hedged(), on
+                # failure or on slowness, and is not tried again
+                return self._call_hedged(endpoint, endpoints.pop(0), delay, function)
+            except Exception as e:
+                error = e
+        raise error
+
+    def get_statistics(self) -> dict:
+        """Return the statistics of the router.
+
+        Returns
+        -------
+        statistics : dict
+            The number of failovers, of hedged requests, of hedged requests
+            won by the second endpoint, and the statistics of each endpoint.
+        """
+        with self._lock:
+            return {
+                "failovers": self.failovers,
+                "hedged_requests": self.hedged_requests,
+                "hedge_wins": self.hedge_wins,
+                "endpoints": [endpoint.get_statistics() for endpoint in self.endpoints],
+            }
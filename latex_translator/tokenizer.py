@@ -0,0 +1,313 @@
+"""
+Linear-time tokenizer of LaTeX documents into translation segments.
+
+The document is first cut into lexical tokens by a single compiled regular
+expression, then the braces are matched with a stack, and finally the
+segments are built from the tokens.
+Each character is examined a bounded number of times, so that the cost is
+linear in the size of the document: the closing delimiter of the math and
+of the verbatim is searched separately from its opening one, and the
+position found is reused by the next openers, so that an opener without
+closing delimiter does not scan the rest of the document again.
+
+The segments are the ones of the character-by-character scanner which
+LaTeXSplittingTranslator used before, with the following differences.
+
+- Comments (`% ...`) are "comment" segments, which are not translated.
+- `\\verb|...|` and the verbatim environments are "verbatim" segments.
+- Display math (`$$...$$`, `\\[...\\]` and the math environments such as
+  `equation`) are "math" segments, which are not translated.
+- Inline math (`$...$`, `\\(...\\)`) and control symbols such as `\\%`,
+  `\\{` or `\\\\` are kept inside the surrounding text, so that a sentence
+  is translated as a whole.
+- Escaped braces are not counted when matching the braces of a command.
+- Starred commands such as `\\section*{...}` are handled like the plain ones.
+"""
+import re
+from typing import Iterable, List, Tuple
+
+# Commandes LaTeX à préserver (ne pas traduire)
+PRESERVE_COMMANDS = frozenset(
+    {
+        "label",
+        "ref",
+        "cite",
+        "citep",
+        "citet",
+        "pageref",
+        "eqref",
+        "includegraphics",
+        "input",
+        "include",
+        "bibliography",
+        "bibliographystyle",
+        "newcommand",
+        "renewcommand",
+        "documentclass",
+        "usepackage",
+        "begin",
+        "end",
+        "item",
+        "itemize",
+        "enumerate",
+        "description",
+        "caption",
+        "footnote",
+        "mathbb",
+        "mathbf",
+        "mathrm",
+        "mathcal",
+        "frac",
+        "sqrt",
+        "sum",
+        "int",
+        "lim",
+        "infty",
+        "left",
+        "right",
+        "author",
+        "marginpar",
+    }
+)
+
+# Commandes LaTeX dont le contenu doit être traduit
+TRANSLATE_COMMANDS = frozenset(
+    {
+        "emph",
+        "textbf",
+        "textit",
+        "underline",
+        "textsc",
+        "textsf",
+        "texttt",
+        "title",
+        "section",
+        "subsection",
+        "subsubsection",
+        "chapter",
+        "part",
+        "paragraph",
+        "subparagraph",
+        "caption",
+        "footnote",
+    }
+)
+
+_MATH_ENVIRONMENTS = (
+    r"equation\*?|align\*?|alignat\*?|gather\*?|multline\*?|flalign\*?"
+    r"|eqnarray\*?|displaymath|math"
+)
+_VERBATIM_ENVIRONMENTS = r"verbatim\*?|Verbatim|lstlisting|minted"
+
+# A command followed by an argument without nested braces is a single token:
+# this is the most frequent case, and the number of tokens drives the cost.
+_SIMPLE_TOKENS = (
+    r"(?P<command>\\[A-Za-z]+\*?(?:\{(?P<argument>[^{}\\%$]*)\})?)"
+    r"|(?P<symbol>\\.)"
+    r"|(?P<comment>%[^\n]*)"
+    r"|(?P<open>\{)"
+    r"|(?P<close>\})"
+)
+
+# The lookahead lets the regular expression engine skip the plain text quickly.
+# The math and the verbatim are matched by their opening delimiter only.
+_LEXER = re.compile(
+    r"(?=[\\$%{}])(?:"
+    r"(?P<verbatim_environment>\\begin\{(?P<verbatim_name>"
+    + _VERBATIM_ENVIRONMENTS
+    + r")\})"
+    r"|(?P<math_environment>\\begin\{(?P<math_name>"
+    + _MATH_ENVIRONMENTS
+    + r")\})"
+    r"|(?P<display_math>\$\$|\\\[)"
+    r"|(?P<inline_math>\$|\\\()"
+    r"|(?P<verb>\\verb\*?(?P<verb_delimiter>[^\sA-Za-z*]))"
+    r"|" + _SIMPLE_TOKENS + r")",
+    re.DOTALL,
+)
+
+# The tokens of an opening delimiter without closing delimiter, e.g. the
+# symbol \( or the command \begin{equation}
+_SIMPLE_LEXER = re.compile(_SIMPLE_TOKENS, re.DOTALL)
+
+# The closing dollar of the inline math, which is not escaped
+_DOLLAR_PATTERN = re.compile(r"(?<!\\)(?:\\\\)*\$")
+
+# Tokens which are part of the surrounding text
+_TEXT_TOKENS = {"inline_math", "symbol", "open", "close"}
+
+# Tokens which make a segment on their own
+_STANDALONE_TOKENS = {
+    "verbatim_environment": "verbatim",
+    "verb": "verbatim",
+    "math_environment": "math",
+    "display_math": "math",
+    "comment": "comment",
+}
+
+
+def _get_closing_delimiter(match: re.Match) -> str:
+    """Return the closing delimiter of the opening delimiter of a math or verbatim token."""
+    kind = match.lastgroup
+    if kind == "verbatim_environment":
+        return "\\end{" + match.group("verbatim_name") + "}"
+    if kind == "math_environment":
+        return "\\end{" + match.group("math_name") + "}"
+    if kind == "verb":
+        return match.group("verb_delimiter")
+    return {"$$": "$$", "\\[": "\\]", "$": "$", "\\(": "\\)"}[match.group(kind)]
+
+
+def _lex_latex(text: str) -> List[Tuple[str, int, int, int]]:
+    """Cut a LaTeX text into lexical tokens.
+
+    Returns
+    -------
+    tokens : list of tuple(str, int, int, int)
+        The kind, the start and the end of each token, and the start of the
+        argument of the commands with a simple argument, or -1.
+    """
+    tokens = []
+    # The first closing delimiter found after a position, by kind and
+    # delimiter: it is still the first one for the openers before it
+    closers = {}
+
+    def find_closer(kind, delimiter, start):
+        key = kind, delimiter
+        if key in closers:
+            search_start, closer_start = closers[key]
+            if search_start <= start and (closer_start < 0 or closer_start >= start):
+                return closer_start
+        if kind == "inline_math" and delimiter == "$":
+            dollar = _DOLLAR_PATTERN.search(text, start)
+            closer_start = dollar.end() - 1 if dollar is not None else -1
+        else:
+            closer_start = text.find(delimiter, start)
+        closers[key] = start, closer_start
+        return closer_start
+
+    position = 0
+    while True:
+        match = _LEXER.search(text, position)
+        if match is None:
+            break
+        kind = match.lastgroup
+        match_start = match.start()
+        end = match.end()
+        if kind not in _SIMPLE_LEXER.groupindex:
+            delimiter = _get_closing_delimiter(match)
+            closer_start = find_closer(kind, delimiter, end)
+            # The inline math is not empty
+            if closer_start < 0 or (delimiter == "$" and closer_start == end):
+                match = _SIMPLE_LEXER.match(text, match_start)
+                if match is None:
+                    # E.g. a dollar: the next character may open a token
+                    position = match_start + 1
+                    continue
+                kind = match.lastgroup
+                end = match.end()
+            else:
+                end = closer_start + len(delimiter)
+        tokens.append((kind, match.start(), end, match.start("argument")))
+        position = end
+    return tokens
+
+
+def tokenize_latex(
+    text: str,
+    preserve_commands: Iterable[str] = PRESERVE_COMMANDS,
+    translate_commands: Iterable[str] = TRANSLATE_COMMANDS,
+) -> List[Tuple[str, str, bool]]:
+    """Extract segments from LaTeX text.
+
+    Parameters
+    ----------
+    text : str
+        The LaTeX text to process.
+    preserve_commands : iterable of str, optional
+        The commands which are kept with their argument, untranslated.
+    translate_commands : iterable of str, optional
+        The commands whose argument is translated.
+
+    Returns
+    -------
+    List[Tuple[str, str, bool]]
+        A list of tuples containing the segment, its type, and whether to translate.
+        Concatenating the segments gives back the text.
+    """
+    preserve_commands = set(preserve_commands)
+    translate_commands = set(translate_commands)
+    tokens = _lex_latex(text)
+
+    # Match the braces with a stack
+    matching_brace = {}
+    open_braces = []
+    for index, (kind, _, _, _) in enumerate(tokens):
+        if kind == "open":
+            open_braces.append(index)
+        elif kind == "close" and open_braces:
+            matching_brace[open_braces.pop()] = index
+
+    segments = []
+    text_start = 0
+
+    def flush_text(end):
+        if end > text_start:
+            text_segment = text[text_start:end]
+            # Ne traduire que si ce n'est pas juste des espaces/retours à la ligne
+            if text_segment.strip():
+                segments.append((text_segment, "normal_text", True))
+            else:
+                segments.append((text_segment, "whitespace", False))
+
+    number_of_tokens = len(tokens)
+    index = 0
+    while index < number_of_tokens:
+        kind, start, end, argument_start = tokens[index]
+        if kind in _TEXT_TOKENS:
+            index += 1
+            continue
+        flush_text(start)
+        if kind == "command":
+            next_index = index + 1
+            if argument_start >= 0:
+                # Commande complète trouvée, avec un argument simple
+                name_end = argument_start - 1
+                content_end = end - 1
+                command_end = end
+                close_index = index
+            elif (
+                next_index < number_of_tokens
+                and tokens[next_index][0] == "open"
+                and tokens[next_index][1] == end
+                and next_index in matching_brace
+            ):
+                # Commande complète trouvée
+                name_end = end
+                close_index = matching_brace[next_index]
+                content_end, command_end = tokens[close_index][1:3]
+            else:
+                close_index = None
+            if close_index is not None:
+                command = text[start + 1 : name_end].rstrip("*")
+                if command in preserve_commands:
+                    segments.append((text[start:command_end], "preserve", False))
+                elif command in translate_commands:
+                    segments.append((text[start : name_end + 1], "command_start", False))
+                    segments.append(
+                        (text[name_end + 1 : content_end], "translate_content", True)
+                    )
+                    segments.append(("}", "command_end", False))
+                else:
+                    segments.append((text[start:command_end], "unknown_command", False))
+                text_start = command_end
+                index = close_index + 1
+                continue
+            # Commande sans accolades ou malformée
+            segments.append((text[start:end], "command_no_braces", False))
+        else:
+            segments.append((text[start:end], _STANDALONE_TOKENS[kind], False))
+        text_start = end
+        index += 1
+    flush_text(len(text))
+    return segments
@@ -0,0 +1,39 @@
+"""
+Offline estimation of the number of tokens of a text.
+
+The exact count depends on the tokenizer of each model, which is not
+available locally.
+The estimate of this module mimics a BPE tokenizer: short words are one
+token, long words are split, numbers are grouped by three digits and each
+symbol is a token.
+It slightly overestimates the count on French LaTeX, which is the safe side
+when checking the context window.
+"""
+import re
+
+_WORD_PATTERN = re.compile(r"[^\W\d_]+")
+_NUMBER_PATTERN = re.compile(r"\d+")
+_SYMBOL_PATTERN = re.compile(r"[^\w\s]|_")
+_NEWLINE_PATTERN = re.compile(r"\n+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens of a text.
+
+    Parameters
+    ----------
+    text : str
+        The text.
+
+    Returns
+    -------
+    number_of_tokens : int
+        The estimated number of tokens.
+    """
+    number_of_tokens = sum(1 + len(word) // 6 for word in _WORD_PATTERN.findall(text))
+    number_of_tokens += sum(
+        (len(number) + 2) // 3 for number in _NUMBER_PATTERN.findall(text)
+    )
+    number_of_tokens += len(_SYMBOL_PATTERN.findall(text))
+    number_of_tokens += len(_NEWLINE_PATTERN.findall(text))
+    return number_of_tokens
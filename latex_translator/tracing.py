@@ -0,0 +1,371 @@
+"""
+Timing of the stages of a translation.
+
+A translation is traced as a tree of spans: the job, then its stages, e.g.
+building the prompt, tokenizing and chunking the document, and for each
+chunk the wait in the queue, the requests, the time to first token, the
+cleanup of the output, and finally the assembly of the translation.
+The trace shows where a slow translation spent its time.
+
+The trace is exported as JSON, with the times relative to the start of the
+trace, or in the OTLP/JSON format of OpenTelemetry, which the collectors
+and the tracing tools can import.
+
+The current span is kept in a context variable, so that the nested stages
+are attached to it without passing it around.
+The threads of a thread pool do not inherit it: the spans started in a
+worker thread are given their parent explicitly.
+"""
+import contextlib
+import contextvars
+import os
+import threading
+import time
+from typing import List, Optional
+
+# The kinds of the OpenTelemetry spans
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+# The status code of a failed span in OpenTelemetry
+STATUS_CODE_ERROR = 2
+
+# The spans which send a request to the provider
+CLIENT_SPAN_NAMES = {"request"}
+
+_current_span = contextvars.ContextVar("latex_translator_current_span", default=None)
+
+
+def get_current_span():
+    """Return the span of the current context, or None."""
+    return _current_span.get()
+
+
+class Span:
+    def __init__(
+        self, name: str, trace_id: str, parent_id=None, start_time=None, attributes=None
+    ):
+        """Initialize the Span.
+
+        Parameters
+        ----------
+        name : str
+            The name of the stage, e.g. "request".
+        trace_id : str
+            The identifier of the trace, 32 hexadecimal digits.
+        parent_id : str, optional
+            The identifier of the parent span, if any.
+        start_time : float, optional
+            The start time, in seconds since the epoch. Defaults to now.
+        attributes : dict, optional
+            The attributes of the span, e.g. the index of the chunk.
+        """
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_time = time.time() if start_time is None else start_time
+        self.end_time = None
+        self.attributes = dict(attributes or {})
+        self.error = None
+
+    def set_attribute(self, key: str, value) -> None:
+        """Set an attribute of the span."""
+        self.attributes[key] = value
+
+    def end(self, end_time=None) -> None:
+        """End the span.
+
+        Parameters
+        ----------
+        end_time : float, optional
+            The end time, in seconds since the epoch. Defaults to now.
+        """
+        self.end_time = time.time() if end_time is None else end_time
+
+    @property
+    def duration(self) -> Optional[float]:
+        """The duration of the span in seconds, or None if it is not ended."""
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+
+def _get_otlp_value(value) -> dict:
+    """Return an attribute value in the OTLP/JSON format."""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # The 64 bits integers are strings in OTLP/JSON
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Tracer:
+    def __init__(self, service_name="latex_translator"):
+        """Initialize the Tracer.
+
+        A tracer holds the spans of one trace, e.g. of one translation.
+        It is thread-safe.
+
+        Parameters
+        ----------
+        service_name : str, optional
+            The name of the service in the OpenTelemetry export.
+            Defaults to "latex_translator".
+        """
+        self.service_name = service_name
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def start_span(
+        self, name: str, parent: Optional[Span] = None, start_time=None, **attributes
+    ) -> Span:
+        """Start a span, which the caller must end.
+
+        Parameters
+        ----------
+        name : str
+            The name of the stage.
+        parent : Span, optional
+            The parent span.
+            If None, use the current span, if it belongs to this trace.
+        start_time : float, optional
+            The start time, in seconds since the epoch. Defaults to now.
+        **attributes
+            The attributes of the span.
+
+        Returns
+        -------
+        span : Span
+            The span.
+        """
+        if parent is None:
+            parent = get_current_span()
+            if parent is not None and parent.trace_id != self.trace_id:
+                parent = None
+        span = Span(
+            name,
+            self.trace_id,
+            None if parent is None else parent.span_id,
+            start_time,
+            attributes,
+        )
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    @contextlib.contextmanager
+    def span(
+        self, name: str, parent: Optional[Span] = None, start_time=None, **attributes
+    ):
+        """Trace a stage: the span is the current span within the block.
+
+        Parameters
+        ----------
+        name : str
+            The name of the stage.
+        parent : Span, optional
+            The parent span. If None, use the current span.
+        start_time : float, optional
+            The start time, in seconds since the epoch. Defaults to now.
+        **attributes
+            The attributes of the span.
+
+        Yields
+        ------
+        span : Span
+            The span, ended when the block exits.
+            If the block raises an exception, it is stored in the span.
+        """
+        span = self.start_span(name, parent, start_time, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = str(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    def add_span(
+        self,
+        name: str,
+        start_time: float,
+        end_time: float,
+        parent: Optional[Span] = None,
+        **attributes,
+    ) -> Span:
+        """Add a stage which was measured without a block, e.g. a wait.
+
+        Parameters
+        ----------
+        name : str
+            The name of the stage.
+        start_time : float
+            The start time, in seconds since the epoch.
+        end_time : float
+            The end time, in seconds since the epoch.
+        parent : Span, optional
+            The parent span. If None, use the current span.
+        **attributes
+            The attributes of the span.
+
+        Returns
+        -------
+        span : Span
+            The ended span.
+        """
+        span = self.start_span(name, parent, start_time, **attributes)
+        span.end(end_time)
+        return span
+
+    def get_spans(self) -> List[Span]:
+        """Return the spans, ordered by start time."""
+        with self._lock:
+            return sorted(self.spans, key=lambda span: span.start_time)
+
+    def get_stage_durations(self) -> dict:
+        """Return the total duration of each stage.
+
+        Returns
+        -------
+        durations : dict
+            The sum of the durations of the ended spans of each name, in
+            seconds.
+            The stages of the chunks overlap when the chunks are translated
+            concurrently, so that their sum may exceed the wall time.
+        """
+        durations = {}
+        for span in self.get_spans():
+            if span.duration is not None:
+                durations[span.name] = durations.get(span.name, 0.0) + span.duration
+        return durations
+
+    def to_json(self) -> dict:
+        """Export the trace as JSON.
+
+        Returns
+        -------
+        trace : dict
+            The identifier of the trace and the list of its spans, each
+            one with its name, its identifier and the one of its parent,
+            its start and end times in seconds since the start of the
+            trace, its duration, its attributes and its error, if any.
+        """
+        spans = self.get_spans()
+        origin = spans[0].start_time if spans else 0.0
+        return {
+            "trace_id": self.trace_id,
+            "spans": [
+                {
+                    "name": span.name,
+                    "span_id": span.span_id,
+                    "parent_id": span.parent_id,
+                    "start": span.start_time - origin,
+                    "end": None if span.end_time is None else span.end_time - origin,
+                    "duration": span.duration,
+                    "attributes": dict(span.attributes),
+                    "error": span.error,
+                }
+                for span in spans
+            ],
+        }
+
+    def to_otlp(self) -> dict:
+        """Export the trace in the OTLP/JSON format of OpenTelemetry.
+
+        The spans which are not ended are skipped.
+
+        Returns
+        -------
+        trace : dict
+            The resourceSpans of an OTLP export request, which can be
+            posted to the /v1/traces endpoint of a collector.
+        """
+        otlp_spans = []
+        for span in self.get_spans():
+            if span.end_time is None:
+                continue
+            otlp_span = {
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "parentSpanId": span.parent_id or "",
+                "name": span.name,
+                "kind": (
+                    SPAN_KIND_CLIENT
+                    if span.name in CLIENT_SPAN_NAMES
+                    else SPAN_KIND_INTERNAL
+                ),
+                "startTimeUnixNano": str(int(span.start_time * 1e9)),
+                "endTimeUnixNano": str(int(span.end_time * 1e9)),
+                "attributes": [
+                    {"key": key, "value": _get_otlp_value(value)}
+                    for key, value in span.attributes.items()
+                ],
+            }
+            if span.error is not None:
+                otlp_span["status"] = {
+                    "code": STATUS_CODE_ERROR,
+                    "message": span.error,
+                }
+            otlp_spans.append(otlp_span)
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": {"stringValue": self.service_name},
+                            }
+                        ]
+                    },
+                    "scopeSpans": [
+                        {"scope": {"name": "latex_translator"}, "spans": otlp_spans}
+                    ],
+                }
+            ]
+        }
+
+
+def get_timeline(trace: dict) -> List[dict]:
+    """Return the rows of a timeline of a trace, one row per chunk.
+
+    Parameters
+    ----------
+    trace : dict
+        The trace, exported by Tracer.to_json().
+
+    Returns
+    -------
+    timeline : list of dict
+        For each ended stage, the row ("document", or "bloc N" for the
+        stages of the N-th chunk), the name of the stage, and its start and
+        end times, in seconds since the start of the trace.
+        The spans of the jobs and of the chunks are not returned, since
+        their stages cover them.
+    """
+    chunk_rows = {
+        span["span_id"]: f"bloc {span['attributes'].get('index', '?')}"
+        for span in trace["spans"]
+        if span["name"] == "translate_chunk"
+    }
+    timeline = []
+    for span in trace["spans"]:
+        if span["end"] is None or span["span_id"] in chunk_rows:
+            continue
+        if span["parent_id"] is None and span["name"].startswith("translate"):
+            continue
+        timeline.append(
+            {
+                "row": chunk_rows.get(span["parent_id"], "document"),
+                "stage": span["name"],
+                "start": span["start"],
+                "end": span["end"],
+            }
+        )
+    return timeline
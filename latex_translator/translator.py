@@ -0,0 +1,1430 @@
+"""
+The translator of a raw LaTeX document.
+
+The whole document is sent to the AI, split into chunks which fit the
+context of the model.
+This module does not depend on Streamlit: the progress and the errors are
+sent to a reporter, so that the translator can be used by the app, by the
+command line or by a batch job.
+The SDKs of the providers are only imported when the first client is
+created, so that importing this module is fast.
+"""
+import contextlib
+import re
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from latex_translator.checkpoint import Checkpoint, make_checkpoint_key
+from latex_translator.chunking import (
+    get_chunk_token_budget,
+    pack_latex_blocks,
+    split_latex_blocks,
+)
+from latex_translator.clients import get_client
+from latex_translator.engine import ConcurrentTranslationEngine, merge_finish_reasons
+from latex_translator.forecast import (
+    MESSAGE_OVERHEAD_TOKENS,
+    estimate_completion_tokens,
+    forecast_requests,
+)
+from latex_translator.glossary import (
+    MAX_GLOSSARY_TOKENS,
+    Glossary,
+    find_missing_terms,
+    get_glossary_instructions,
+)
+from latex_translator.incremental import plan_incremental_translation
+from latex_translator.masking import MASKING_INSTRUCTIONS, mask_latex, unmask_latex
+from latex_translator.memory import (
+    EXAMPLE_SIMILARITY,
+    MAX_MEMORY_EXAMPLE_TOKENS,
+    MAX_MEMORY_EXAMPLES,
+    get_memory_instructions,
+    plan_memory_translation,
+)
+from latex_translator.packing import split_blanks
+from latex_translator.ratelimit import RetryBudget, call_with_retry, get_rate_limiter
+from latex_translator.reporting import TranslationReporter
+from latex_translator.tokens import estimate_tokens
+from latex_translator.tracing import Tracer, get_current_span
+from latex_translator.validation import validate_translation
+
+
+def _get_stream_usage(completion_chunk):
+    """Return the usage of a chunk of a streamed completion, or None.
+
+    The usage comes with the final chunk: in its usage attribute with
+    OpenAI, or in its x_groq attribute with Groq.
+    """
+    usage = getattr(completion_chunk, "usage", None)
+    if usage is None:
+        x_groq = getattr(completion_chunk, "x_groq", None)
+        usage = getattr(x_groq, "usage", None)
+    return usage
+
+
+class LaTeXRawTranslator:
+    def __init__(
+        self,
+        use_groq=True,
+        model="llama3-8b-8192",
+        latex_mode=False,
+        temperature=0.3,
+        tone_description="",
+        keywords_list=[],
+        abstract_text="",
+        difficult_terms_dict=dict(),
+        must_clean_llm_output=True,
+        cache=None,
+        max_concurrency=4,
+        max_chunk_tokens=None,
+        request_semaphore=None,
+        reporter=None,
+        use_masking=True,
+        rate_limiter=None,
+        max_retries=20,
+        router=None,
+        glossary=None,
+        validate_output=True,
+        max_validation_retries=1,
+        cascade_models=None,
+        memory=None,
+        checkpoint_directory=None,
+    ):
+        """Initialize the LaTeXRawTranslator.
+
+        This class pushes the content to the AI, then ask it to translate.
+
+        Parameters
+        ----------
+        use_groq : bool, optional
+            Whether to use the Groq API.
+            Otherwise, use OpenAI.
+            Defaults to True.
+        model : str, optional
+            The model to use for translation. Defaults to "llama3-8b-8192".
+        latex_mode : bool, optional
+            Whether to enable LaTeX mode. Defaults to False.
+        tone_description : str, optional
+            The description of the tone of the translation
+        keywords_list : list, optional
+            The list of keywords
+        abstract_text : str, optional
+            The abstract
+        difficult_terms_dict : dict, optional
+            The dictionary of difficult terms.
+            Like the terms of the glossary, a term is only sent with the
+            chunks in which it appears.
+        must_clean_llm_output : bool, optional
+            Clean the LLM output if necessary
+        cache : TranslationCache, optional
+            The cache of the translations.
+            If None, the translations are not cached.
+        max_concurrency : int, optional
+            The maximum number of chunk translations in flight.
+            Defaults to 4.
+        max_chunk_tokens : int, optional
+            The maximum number of tokens of a chunk.
+            If None, it is derived from the context window of the model.
+        request_semaphore : threading.Semaphore, optional
+            A semaphore acquired around each request to the AI.
+            Sharing it between several translators bounds the total number
+            of requests in flight, e.g. when translating several documents
+            at once.
+        reporter : TranslationReporter, optional
+            The receiver of the progress and of the errors.
+            If None, the errors are printed.
+        use_masking : bool, optional
+            Whether to replace the math, the citations, the references, the
+            labels, the paths of the figures and the comments by
+            placeholders before sending the text, in LaTeX mode.
+            Defaults to True.
+        rate_limiter : RateLimiter, optional
+            The rate limiter of the requests.
+            If None, use the limiter of the provider, shared by the process.
+        max_retries : int, optional
+            The maximum number of retries of the failed requests, for all
+            the requests of a translation. Defaults to 20.
+        router : Router, optional
+            The router of the requests between several endpoints, with
+            failover and hedging.
+            If None, the requests are sent to the model of the provider.
+            The model is still used to split the document and as the key
+            of the cache.
+        glossary : Glossary, optional
+            The glossary of the terms with an imposed translation, e.g.
+            loaded from a TSV file.
+            The difficult terms replace the translations of its terms.
+        validate_output : bool, optional
+            Whether to check the translation of each chunk: its structure
+            with latex_translator.validation, in LaTeX mode, and the
+            translations of the terms of the glossary which appear in it.
+            Defaults to True.
+        max_validation_retries : int, optional
+            The number of times a chunk whose translation is invalid is
+            translated again, without the cache. Defaults to 1.
+            Ignored with a cascade.
+        cascade_models : list of str, optional
+            The larger models of the provider to which a chunk whose
+            translation is invalid is sent, in turn, until a translation is
+            valid, e.g. ["llama3-70b-8192"] after "llama3-8b-8192".
+            Most chunks are then translated at the speed of the model.
+            The document is split for the context window of the model,
+            which should not be larger than the ones of the cascade.
+            If None, the invalid chunks are translated again by the model.
+        memory : TranslationMemory, optional
+            The translation memory of the past translations.
+            The paragraphs almost identical to stored ones reuse their
+            translation, the similar ones are sent as examples with their
+            chunk, and the valid translations of the chunks are stored.
+            If None, no memory is used.
+        checkpoint_directory : str, optional
+            The directory of the checkpoints of the translations, e.g.
+            latex_translator.checkpoint.get_default_checkpoint_directory().
+            The translation of each chunk is written to the checkpoint of
+            the document as soon as it completes, and translating the same
+            document with the same settings again resumes from it.
+            If None, there is no checkpoint.
+        """
+        # The clients are shared by all the translators of the process
+        if use_groq:
+            self.provider = "groq"
+        else:
+            self.provider = "openai"
+            # Use model = "gpt-3.5-turbo" with OpenAI
+        # The client is created on first use, so that the forecast works offline
+        self._client = None
+
+        self.model = model
+        self.latex_mode = latex_mode
+        if temperature < 0.0 or temperature > 1.0:
+            raise ValueError(
+                f"Temperature must be in [0, 1], but temperature={temperature}"
+            )
+        self.temperature = temperature
+        self.tone_description = tone_description
+        self.keywords_list = keywords_list
+        self.abstract_text = abstract_text
+        self.difficult_terms_dict = difficult_terms_dict
+        self.must_clean_llm_output = must_clean_llm_output
+        self.cache = cache
+        if max_concurrency < 1:
+            raise ValueError(
+                f"The concurrency must be at least 1, but max_concurrency={max_concurrency}"
+            )
+        self.max_concurrency = max_concurrency
+        self.max_chunk_tokens = max_chunk_tokens
+        self.request_semaphore = request_semaphore
+        if reporter is None:
+            reporter = TranslationReporter()
+        self.reporter = reporter
+        self.use_masking = use_masking
+        if rate_limiter is None:
+            rate_limiter = get_rate_limiter(self.provider)
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.retry_budget = RetryBudget(max_retries)
+        self.router = router
+        self.glossary = glossary
+        # The glossary and the difficult terms, merged on first use
+        self._merged_glossary = None
+        self.validate_output = validate_output
+        self.max_validation_retries = max_validation_retries
+        self.cascade_models = list(cascade_models or [])
+        self.memory = memory
+        # The use of the memory by the last translation
+        self.memory_statistics = {}
+        self._memory_lock = threading.Lock()
+        self.checkpoint_directory = checkpoint_directory
+        # The checkpoint of the translation in progress
+        self.checkpoint = None
+        # The number of chunks of the last translation read from its checkpoint
+        self.resumed_chunks = 0
+        # The errors of the last translation
+        self.errors = []
+        # The verdict of the validation of each chunk of the last translation
+        self.verdicts = []
+        self._verdicts_lock = threading.Lock()
+        # The statistics of the last incremental translation
+        self.statistics = {}
+        # The timing of the stages of the last translation
+        self.tracer = Tracer()
+
+    @property
+    def client(self):
+        """The client of the provider, shared by all the translators."""
+        if self._client is None:
+            self._client = get_client(self.provider)
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    def clean_llm_output(self, text: str) -> str:
+        """
+        Removes the phrase "Here is the translation:" from the beginning of a string.
+
+        Args:
+            text: The input string, which may contain the phrase.
+
+        Returns:
+            The cleaned string, with the phrase removed if it was present at the start.
+        """
+        if self.must_clean_llm_output:
+            # Use str.startswith() for an efficient check.
+            # For Llama
+            for phrase_to_remove in [
+                "Here is the translation:",
+                "Here is the translated text:",
+            ]:
+                if text.strip().startswith(phrase_to_remove):
+                    # Remove the phrase and any leading whitespace that might be left.
+                    text = text.strip()[len(phrase_to_remove) :].strip()
+
+            # Cleanup if necessary
+            # For Qwen
+            text = re.sub(r"<think>.*?</think>\s*", "", text, flags=re.DOTALL)
+        return text
+
+    def set_tone(self, tone_description):
+        """Set the tone description.
+
+        Parameters
+        ----------
+        tone_description : str
+            Description of the desired tone for the translation.
+        """
+        self.tone_description = tone_description
+
+    def set_keywords(self, keywords_list):
+        """Set the keywords list.
+
+        Parameters
+        ----------
+        keywords_list : list of str
+            List of keywords related to the text.
+        """
+        self.keywords_list = keywords_list
+
+    def set_abstract(self, abstract_text):
+        """Set the abstract text.
+
+        Parameters
+        ----------
+        abstract_text : str
+            Summary or abstract of the document.
+        """
+        self.abstract_text = abstract_text
+
+    def set_difficult_terms_dict(self, difficult_terms_dict):
+        """Set the dictionary of difficult terms.
+
+        Parameters
+        ----------
+        difficult_terms_dict : dict
+            Mapping of complex terms to their simplified explanations.
+        """
+        self.difficult_terms_dict = difficult_terms_dict
+        self._merged_glossary = None
+
+    def set_glossary(self, glossary):
+        """Set the glossary.
+
+        Parameters
+        ----------
+        glossary : Glossary or None
+            The glossary of the terms with an imposed translation.
+        """
+        self.glossary = glossary
+        self._merged_glossary = None
+
+    def get_glossary(self) -> Glossary:
+        """Return the glossary merged with the difficult terms."""
+        if self._merged_glossary is None:
+            merged_glossary = Glossary()
+            if self.glossary is not None:
+                merged_glossary.update(self.glossary)
+            merged_glossary.update(self.difficult_terms_dict)
+            self._merged_glossary = merged_glossary
+        return self._merged_glossary
+
+    def set_reporter(self, reporter):
+        """Set the reporter.
+
+        Parameters
+        ----------
+        reporter : TranslationReporter
+            The receiver of the progress and of the errors.
+        """
+        self.reporter = reporter
+
+    def get_prompt(self) -> str:
+        """Generate the prompt instruction string.
+
+            Constructs a detailed instruction set for a scientific translator,
+            incorporating tone, keywords and abstract.
+            The difficult terms are added to the request of each chunk in
+            which they appear.
+
+            Returns
+            -------
+            str
+                The generated prompt instructions.
+            """
+        prompt_instructions = (
+                "- You are a professional scientific translator. \n"
+            "- Keep punctuation as is. \n"
+            "- Keep carriage returns as is. \n"
+            "- Do not print: 'Here is the translation:'. \n"
+        )
+        if self.latex_mode:
+            prompt_instructions += (
+                "- You are a professional scientific translator. \n"
+                "- Preserve any LaTeX syntax intact. \n"
+                "- Translate only the content, not the LaTeX commands. \n"
+                "- Write a consistent LaTeX code. \n"
+                "- Do not translate the comments, indicated by '%' LaTeX command. \n"
+                "- Do not modify commands such as : `\\label{}`, `\\ref{}`, `\\cite{}`, etc. \n"
+                "- Translate the content of the formatting commands such as : `\\emph{}`, `\\textbf{}`, `\\section{}`, `\\caption{}`, etc. \n"
+            )
+        if len(self.tone_description) > 0:
+            prompt_instructions += f"- {self.tone_description}\n"
+        if self.keywords_list:
+            keywords_str = ", ".join(self.keywords_list)
+            prompt_instructions += (
+                f"- The text is related to the following keywords: {keywords_str}.\n"
+            )
+        if self.abstract_text:
+            prompt_instructions += f"- The abstract of the document is as follows:\n\n"
+            prompt_instructions += f"{self.abstract_text}\n"
+        return prompt_instructions
+
+    def split_document(self, latex_content: str, prompt_instructions: str) -> List[str]:
+        """Split the document into chunks which fit the context of the model.
+
+        Parameters
+        ----------
+        latex_content : str
+            The LaTeX content to translate.
+        prompt_instructions : str
+            The prompt instructions sent with each chunk.
+
+        Returns
+        -------
+        chunks : list of str
+            The chunks. Concatenating them gives back the document.
+        """
+        max_tokens = self.max_chunk_tokens
+        if max_tokens is None:
+            prompt_tokens = estimate_tokens(prompt_instructions)
+            if len(self.get_glossary()) > 0:
+                # The room of the terms found in the chunk
+                prompt_tokens += MAX_GLOSSARY_TOKENS
+            if self.memory is not None:
+                # The room of the examples of the memory
+                prompt_tokens += MAX_MEMORY_EXAMPLE_TOKENS
+            max_tokens = get_chunk_token_budget(self.model, prompt_tokens)
+        with self.tracer.span("tokenize") as span:
+            blocks = split_latex_blocks(latex_content)
+            span.set_attribute("blocks", len(blocks))
+        with self.tracer.span("chunk") as span:
+            chunks = pack_latex_blocks(blocks, max_tokens)
+            span.set_attribute("chunks", len(chunks))
+        return chunks
+
+    def forecast(self, latex_content: str, max_concurrency=None) -> dict:
+        """Forecast the tokens, the duration and the cost of a translation.
+
+        The forecast is computed offline, with the prompt of get_prompt()
+        and the chunks of split_document(), without the examples of the
+        translation memory.
+
+        Parameters
+        ----------
+        latex_content : str
+            The LaTeX content to translate.
+        max_concurrency : int, optional
+            The maximum number of requests in flight.
+            If None, use the concurrency of the translator.
+            Use 1 for translate_streaming(), which sends the chunks one after
+            the other.
+
+        Returns
+        -------
+        forecast : dict
+            The forecast of latex_translator.forecast.forecast_requests(),
+            with the number of tokens of the document.
+        """
+        if max_concurrency is None:
+            max_concurrency = self.max_concurrency
+        prompt_instructions = self.get_prompt()
+        chunks = self.split_document(latex_content, prompt_instructions)
+        request_tokens = []
+        for chunk in chunks:
+            content = chunk.strip()
+            if not content:
+                continue
+            request_content, request_instructions, _ = self._prepare_request(
+                content, prompt_instructions, True
+            )
+            content_tokens = estimate_tokens(request_content)
+            request_tokens.append(
+                (
+                    estimate_tokens(request_instructions)
+                    + content_tokens
+                    + MESSAGE_OVERHEAD_TOKENS,
+                    estimate_completion_tokens(content_tokens),
+                )
+            )
+        forecast = forecast_requests(request_tokens, self.model, max_concurrency)
+        forecast["document_tokens"] = estimate_tokens(latex_content)
+        if len(request_tokens) > 1 and self.max_chunk_tokens is None:
+            forecast["warnings"].insert(
+                0,
+                f"Le document dépasse la capacité d'une requête du modèle "
+                f"{self.model} : il sera découpé en {len(request_tokens)} blocs.",
+            )
+        return forecast
+
+    def _get_messages(self, content: str, prompt_instructions: str):
+        """Build the messages of the chat completion for one chunk."""
+        return [
+            {
+                "role": "user",
+                "content": prompt_instructions,
+            },
+            {"role": "user", "content": f"Here is the text: {content}"},
+        ]
+
+    def _create_completion(
+        self, content: str, prompt_instructions: str, model=None, **arguments
+    ):
+        """Send the chat completion of one chunk.
+
+        The request waits for the rate limiter, is sent within the request
+        semaphore, and is retried within the retry budget.
+        With a router, the request is sent to the healthiest endpoint, and
+        retried when all the endpoints failed.
+        With a model, e.g. of the cascade, the request is sent to this model
+        of the provider, without the router.
+        """
+        request_semaphore = self.request_semaphore
+        if request_semaphore is None:
+            request_semaphore = contextlib.nullcontext()
+        content_tokens = estimate_tokens(content)
+        tokens = (
+            estimate_tokens(prompt_instructions)
+            + content_tokens
+            + MESSAGE_OVERHEAD_TOKENS
+            + estimate_completion_tokens(content_tokens)
+        )
+
+        # The hedged requests are sent from another thread
+        parent_span = get_current_span()
+
+        def record_usage(usage, span, rate_limiter):
+            if usage is not None:
+                rate_limiter.record_usage(tokens, usage.total_tokens)
+                span.set_attribute("tokens", usage.total_tokens)
+
+        def record_stream(stream, span, rate_limiter):
+            # The span of a stream ends when its last chunk is received
+            usage = None
+            try:
+                for completion_chunk in stream:
+                    usage = _get_stream_usage(completion_chunk) or usage
+                    yield completion_chunk
+            except BaseException as e:
+                span.error = str(e)
+                raise
+            finally:
+                span.end()
+                record_usage(usage, span, rate_limiter)
+
+        def send_request(client, model, rate_limiter):
+            span = self.tracer.start_span("request", parent_span, model=model)
+            try:
+                with request_semaphore:
+                    # The raw response gives the rate-limit headers
+                    response = client.chat.completions.with_raw_response.create(
+                        model=model,
+                        messages=self._get_messages(content, prompt_instructions),
+                        temperature=self.temperature,
+                        **arguments,
+                    )
+            except BaseException as e:
+                span.error = str(e)
+                span.end()
+                raise
+            rate_limiter.update_from_headers(response.headers)
+            completion = response.parse()
+            if arguments.get("stream"):
+                return record_stream(completion, span, rate_limiter)
+            span.end()
+            record_usage(getattr(completion, "usage", None), span, rate_limiter)
+            return completion
+
+        if model is not None or self.router is None:
+            return call_with_retry(
+                lambda: send_request(self.client, model or self.model, self.rate_limiter),
+                self.rate_limiter,
+                self.retry_budget,
+                tokens,
+            )
+
+        def send_to_endpoint(endpoint):
+            endpoint.rate_limiter.wait(tokens)
+            return send_request(endpoint.client, endpoint.model, endpoint.rate_limiter)
+
+        # A stream cannot be hedged, since its chunks are shown as they come
+        hedge = False if arguments.get("stream") else None
+        return call_with_retry(
+            lambda: self.router.call(send_to_endpoint, hedge), None, self.retry_budget
+        )
+
+    def _get_cached_translation(
+        self, content: str, prompt_instructions: str, use_cache: bool = True, model=None
+    ):
+        """Look up the translation of a chunk in the cache.
+
+        If use_cache is False, only the key is computed, so that the new
+        translation replaces the cached one.
+        The model defaults to the model of the translator.
+
+        Returns
+        -------
+        cache_key : str or None
+            The key of the chunk, or None if there is no cache.
+        cached_translation : tuple(str, str) or None
+            The raw translation and the finish reason, or None if the chunk
+            is not in the cache.
+        """
+        if self.cache is None:
+            return None, None
+        cache_key = self.cache.make_key(
+            content, prompt_instructions, model or self.model, self.temperature
+        )
+        if not use_cache:
+            return cache_key, None
+        return cache_key, self.cache.get(cache_key)
+
+    def _get_memory_examples(self, content: str) -> List[Tuple[str, str]]:
+        """Return the segments of the memory which are similar to the blocks of a chunk.
+
+        Returns
+        -------
+        examples : list of tuple(str, str)
+            The sources and the translations of at most MAX_MEMORY_EXAMPLES
+            segments, from the most similar.
+        """
+        segments = {}
+        for block, _ in split_latex_blocks(content):
+            for similarity, source, translation in self.memory.search(
+                block, EXAMPLE_SIMILARITY, MAX_MEMORY_EXAMPLES
+            ):
+                if similarity > segments.get(source, (0.0, ""))[0]:
+                    segments[source] = similarity, translation
+        examples = sorted(segments.items(), key=lambda item: item[1][0], reverse=True)
+        examples = [
+            (source, translation)
+            for source, (_, translation) in examples[:MAX_MEMORY_EXAMPLES]
+        ]
+        with self._memory_lock:
+            self.memory_statistics["examples"] = (
+                self.memory_statistics.get("examples", 0) + len(examples)
+            )
+        return examples
+
+    def _get_memory_instructions(self, content: str) -> str:
+        """Return the prompt instructions with the similar translations of the memory.
+
+        They are added to the prompt instructions of the request only when
+        it is sent: they change as the memory grows, so that they are not
+        part of the key of the cache, and the forecast does not search the
+        memory.
+
+        Returns
+        -------
+        memory_instructions : str
+            The instructions, empty if there is no memory.
+        """
+        if self.memory is None:
+            return ""
+        return get_memory_instructions(self._get_memory_examples(content))
+
+    def _remember_chunk(self, chunk: str, result: Tuple[str, int, str]) -> None:
+        """Store the translation of a chunk in the memory, if it is valid."""
+        translation, _, finish_reason = result
+        if self.memory is None or finish_reason != "stop":
+            return
+        if self.validate_output and self.check_chunk(chunk, translation):
+            return
+        number_stored = self.memory.add_translation(chunk, translation)
+        with self._memory_lock:
+            self.memory_statistics["stored_segments"] = (
+                self.memory_statistics.get("stored_segments", 0) + number_stored
+            )
+
+    def _prepare_request(
+        self, content: str, prompt_instructions: str, use_masking: bool
+    ):
+        """Prepare the request of a chunk.
+
+        The translations of the terms of the glossary which appear in the
+        chunk are added to the prompt instructions, and the content is
+        masked, if the masking is enabled.
+
+        Returns
+        -------
+        request_content : str
+            The content sent to the AI.
+        request_instructions : str
+            The prompt instructions sent to the AI.
+        masked_parts : list of str
+            The masked parts, empty if nothing is masked.
+        """
+        prompt_instructions += get_glossary_instructions(
+            self.get_glossary().find_terms(content)
+        )
+        if not (use_masking and self.use_masking and self.latex_mode):
+            return content, prompt_instructions, []
+        masked_content, masked_parts = mask_latex(content)
+        if not masked_parts:
+            return content, prompt_instructions, []
+        return masked_content, prompt_instructions + MASKING_INSTRUCTIONS, masked_parts
+
+    def translate_chunk(
+        self,
+        chunk: str,
+        prompt_instructions: str,
+        use_masking: bool = True,
+        use_cache: bool = True,
+        model: Optional[str] = None,
+        cache_entries: Optional[list] = None,
+    ) -> Tuple[str, int, str]:
+        """Translate one chunk of the document.
+
+        The blanks around the chunk are kept as is, since the AI does not
+        reliably reproduce them.
+        If the AI does not keep the placeholders of the masked parts, the
+        chunk is translated again without masking.
+
+        Parameters
+        ----------
+        chunk : str
+            The LaTeX content to translate.
+        prompt_instructions : str
+            The prompt instructions.
+        use_masking : bool, optional
+            Whether to mask the untranslatable parts, if the masking of
+            the translator is enabled. Defaults to True.
+        use_cache : bool, optional
+            Whether to read the translation from the cache, if any.
+            The new translation is stored in the cache in any case, see
+            cache_entries. Defaults to True.
+        model : str, optional
+            The model of the provider to use instead of the model of the
+            translator, e.g. a model of the cascade.
+        cache_entries : list, optional
+            If given, the entry of the new translation in the cache is
+            appended to it, as a tuple (key, raw translation, finish reason),
+            instead of being stored, e.g. so that validate_chunk() only
+            stores the translation it keeps.
+
+        Returns
+        -------
+        traduction : str
+            The translated text.
+        total_tokens : int
+            The number of token used
+        finish_reason : str
+            The reason of finishing the AI job.
+        """
+        leading_blanks, content, trailing_blanks = split_blanks(chunk)
+        if not content:
+            return chunk, 0, "stop"
+        with self.tracer.span("mask"):
+            request_content, request_instructions, masked_parts = self._prepare_request(
+                content, prompt_instructions, use_masking
+            )
+        cache_key, cached_translation = self._get_cached_translation(
+            request_content, request_instructions, use_cache, model
+        )
+        if cached_translation is not None:
+            translated_text, finish_reason = cached_translation
+            total_tokens = 0
+        else:
+            chat_completion = self._create_completion(
+                request_content,
+                request_instructions + self._get_memory_instructions(content),
+                model,
+            )
+            translated_text = chat_completion.choices[0].message.content
+            total_tokens = chat_completion.usage.total_tokens
+            finish_reason = chat_completion.choices[0].finish_reason
+        raw_translation = translated_text
+        with self.tracer.span("clean_output"):
+            translated_text = self.clean_llm_output(translated_text).strip()
+            is_complete = True
+            if masked_parts:
+                translated_text, is_complete = unmask_latex(translated_text, masked_parts)
+        # Only complete translations, whose placeholders are kept, are worth
+        # reusing
+        if (
+            self.cache is not None
+            and cached_translation is None
+            and finish_reason == "stop"
+            and is_complete
+        ):
+            if cache_entries is None:
+                self.cache.put(cache_key, raw_translation, finish_reason)
+            else:
+                cache_entries.append((cache_key, raw_translation, finish_reason))
+        if not is_complete:
+            print("Marqueurs perdus par l'IA : traduction sans masquage")
+            translation, retry_tokens, finish_reason = self.translate_chunk(
+                chunk,
+                prompt_instructions,
+                use_masking=False,
+                use_cache=use_cache,
+                model=model,
+                cache_entries=cache_entries,
+            )
+            return translation, total_tokens + retry_tokens, finish_reason
+        return leading_blanks + translated_text + trailing_blanks, total_tokens, finish_reason
+
+    def check_chunk(self, chunk: str, translation: str) -> List[str]:
+        """Return the issues of the translation of a chunk, without any request.
+
+        In LaTeX mode, the structure of the translation is checked with
+        validate_translation().
+        The imposed translations of the terms of the glossary which appear
+        in the chunk must appear in the translation.
+        """
+        issues = []
+        if self.latex_mode:
+            issues += validate_translation(chunk, translation)
+        for source_term, target_term in find_missing_terms(
+            self.get_glossary().find_terms(chunk), translation
+        ):
+            issues.append(
+                f"Terme du glossaire non respecté : '{source_term}' → '{target_term}'"
+            )
+        return issues
+
+    def validate_chunk(
+        self,
+        index: int,
+        chunk: str,
+        result: Tuple[str, int, str],
+        prompt_instructions: str,
+    ) -> Tuple[str, int, str]:
+        """Check the translation of a chunk, and translate it again if it is invalid.
+
+        With a cascade, the chunk is sent to the models of the cascade in
+        turn, until its translation is valid.
+        Otherwise, it is translated again by the model, without the cache.
+        A failed attempt is skipped, and the previous translation is kept.
+        The verdict is added to the verdicts attribute.
+
+        Parameters
+        ----------
+        index : int
+            The index of the chunk in the document.
+        chunk : str
+            The LaTeX content of the chunk.
+        result : tuple(str, int, str)
+            The translation of the chunk, its tokens and its finish reason.
+        prompt_instructions : str
+            The prompt instructions.
+
+        Returns
+        -------
+        result : tuple(str, int, str)
+            The translation with the fewest issues, the tokens of all the
+            attempts and its finish reason.
+        """
+        translation, total_tokens, finish_reason = result
+        if not self.validate_output or finish_reason == "Erreur":
+            return result
+        if not (self.latex_mode or len(self.get_glossary())):
+            return result
+        with self.tracer.span("validation"):
+            issues = self.check_chunk(chunk, translation)
+        if self.cascade_models:
+            retry_models = self.cascade_models
+        else:
+            retry_models = [self.model] * self.max_validation_retries
+        model = self.model
+        attempts = 1
+        for retry_model in retry_models:
+            if not issues:
+                break
+            print(f"Bloc {index} invalide ({model}) : {'; '.join(issues)}")
+            attempts += 1
+            # The retry is only stored in the cache if it is kept, so that
+            # the cache holds the kept translation
+            cache_entries = []
+            with self.tracer.span("validation_retry", index=index, model=retry_model):
+                try:
+                    # The cache only holds the invalid translation of the model
+                    retry_translation, retry_tokens, retry_finish_reason = (
+                        self.translate_chunk(
+                            chunk,
+                            prompt_instructions,
+                            use_cache=retry_model != self.model,
+                            model=retry_model,
+                            cache_entries=cache_entries,
+                        )
+                    )
+                except Exception as e:
+                    # The previous translation is kept
+                    print(f"Bloc {index} : échec de {retry_model} : {e}")
+                    continue
+                retry_issues = self.check_chunk(chunk, retry_translation)
+            total_tokens += retry_tokens
+            # On a tie, the later attempt is kept, e.g. of a larger model
+            if len(retry_issues) <= len(issues):
+                translation, finish_reason, issues, model = (
+                    retry_translation,
+                    retry_finish_reason,
+                    retry_issues,
+                    retry_model,
+                )
+                for cache_entry in cache_entries:
+                    self.cache.put(*cache_entry)
+        with self._verdicts_lock:
+            self.verdicts.append(
+                {
+                    "index": index,
+                    "valid": not issues,
+                    "issues": issues,
+                    "attempts": attempts,
+                    "model": model,
+                }
+            )
+        return translation, total_tokens, finish_reason
+
+    def get_tier_statistics(self) -> List[dict]:
+        """Return the statistics of each model used by the last translation.
+
+        Returns
+        -------
+        tiers : list of dict
+            For the model, then each model of the cascade, then the other
+            models, e.g. of the router: its name, its number of requests,
+            their tokens and their total duration in seconds, and the
+            number of chunks whose kept translation comes from it.
+            The chunks are only counted when their translation is checked.
+        """
+        tiers = {}
+
+        def get_tier(model):
+            if model not in tiers:
+                tiers[model] = {
+                    "model": model,
+                    "requests": 0,
+                    "tokens": 0,
+                    "duration": 0.0,
+                    "chunks": 0,
+                }
+            return tiers[model]
+
+        for model in [self.model] + self.cascade_models:
+            get_tier(model)
+        for span in self.tracer.get_spans():
+            if span.name != "request" or span.duration is None:
+                continue
+            tier = get_tier(span.attributes.get("model"))
+            tier["requests"] += 1
+            tier["tokens"] += span.attributes.get("tokens", 0)
+            tier["duration"] += span.duration
+        with self._verdicts_lock:
+            for verdict in self.verdicts:
+                get_tier(verdict.get("model", self.model))["chunks"] += 1
+        return list(tiers.values())
+
+    def get_checkpoint_key(self, latex_content: str, prompt_instructions: str) -> str:
+        """Return the key of the checkpoint of a document.
+
+        The key depends on the document and on the settings which change
+        its translation: the provider, the model and the cascade, the
+        temperature, the modes, the prompt instructions and the glossary.
+        """
+        settings = {
+            "provider": self.provider,
+            "model": self.model,
+            "cascade_models": self.cascade_models,
+            "temperature": self.temperature,
+            "latex_mode": self.latex_mode,
+            "use_masking": self.use_masking,
+            "must_clean_llm_output": self.must_clean_llm_output,
+            "prompt_instructions": prompt_instructions,
+            "glossary": sorted(self.get_glossary().items()),
+        }
+        return make_checkpoint_key(latex_content, settings)
+
+    def _open_checkpoint(self, latex_content: str, prompt_instructions: str) -> None:
+        """Open the checkpoint of a document, if the checkpoints are enabled."""
+        self.resumed_chunks = 0
+        self.checkpoint = None
+        if self.checkpoint_directory is None:
+            return
+        self.checkpoint = Checkpoint(
+            self.get_checkpoint_key(latex_content, prompt_instructions),
+            self.checkpoint_directory,
+        )
+        if len(self.checkpoint) > 0:
+            print(f"Reprise : {len(self.checkpoint)} blocs dans {self.checkpoint.path}")
+
+    def _close_checkpoint(self, finish_reason: str) -> None:
+        """Delete the checkpoint if the translation is complete, keep it otherwise."""
+        if self.checkpoint is not None and finish_reason == "stop" and not self.errors:
+            self.checkpoint.remove()
+        self.checkpoint = None
+
+    def _resume_chunk(self, index: int, chunk: str) -> Optional[Tuple[str, int, str]]:
+        """Return the translation of a chunk read from the checkpoint, if any.
+
+        Its verdict is added to the verdicts attribute, and its tokens are
+        not counted again.
+        """
+        if self.checkpoint is None or not chunk.strip():
+            return None
+        record = self.checkpoint.get(chunk)
+        if record is None:
+            return None
+        with self._verdicts_lock:
+            if record["verdict"] is not None:
+                self.verdicts.append(dict(record["verdict"], index=index))
+            self.resumed_chunks += 1
+        return record["translation"], 0, record["finish_reason"]
+
+    def _checkpoint_chunk(
+        self, index: int, chunk: str, result: Tuple[str, int, str]
+    ) -> None:
+        """Write the translation of a chunk to the checkpoint, if it is complete."""
+        translation, total_tokens, finish_reason = result
+        if self.checkpoint is None or finish_reason != "stop" or not chunk.strip():
+            return
+        with self._verdicts_lock:
+            verdict = next(
+                (verdict for verdict in self.verdicts if verdict["index"] == index),
+                None,
+            )
+        self.checkpoint.record(chunk, translation, total_tokens, finish_reason, verdict)
+
+    def translate(self, latex_content: str) -> Tuple[str, int, str]:
+        """Translate a complete LaTeX document.
+
+        The document is split into chunks which fit the context of the
+        model, and the chunks are translated concurrently.
+        The progress and the errors are sent to the reporter, and the
+        errors are also stored in the errors attribute.
+
+        Parameters
+        ----------
+        latex_content : str
+            The LaTeX content to translate.
+
+        Returns
+        -------
+        traduction : str
+            The translated text.
+        total_tokens : int
+            The number of token used
+        finish_reason : str
+            The reason of finishing the AI job.
+        """
+        self.tracer = Tracer()
+        with self.tracer.span("translate", document_tokens=estimate_tokens(latex_content)):
+            with self.tracer.span("prompt"):
+                prompt_instructions = self.get_prompt()
+            print(f"prompt_instructions:\n{prompt_instructions}")
+            return self._translate_plan([(latex_content, None)], prompt_instructions)
+
+    def _translate_plan(
+        self, plan: List[Tuple[str, Optional[str]]], prompt_instructions: str
+    ) -> Tuple[str, int, str]:
+        """Translate the pieces of a document which have no translation yet.
+
+        With a memory, the blocks of these pieces which are almost identical
+        to stored segments reuse their translation.
+
+        Parameters
+        ----------
+        plan : list of tuple(str, str or None)
+            The pieces of the document, each one with its translation, or
+            None if it must be translated.
+        prompt_instructions : str
+            The prompt instructions.
+
+        Returns
+        -------
+        traduction : str
+            The translated text.
+        total_tokens : int
+            The number of token used
+        finish_reason : str
+            The reason of finishing the AI job.
+        """
+        self.memory_statistics = {}
+        self._open_checkpoint(
+            "".join(piece for piece, _ in plan), prompt_instructions
+        )
+        if self.memory is not None:
+            memory_plan = []
+            number_reused = 0
+            with self.tracer.span("memory"):
+                for piece, translation in plan:
+                    if translation is not None:
+                        memory_plan.append((piece, translation))
+                        continue
+                    piece_plan = plan_memory_translation(self.memory, piece)
+                    number_reused += sum(
+                        block_translation is not None and block.strip() != ""
+                        for block, block_translation in piece_plan
+                    )
+                    memory_plan += piece_plan
+            self.memory_statistics["reused_blocks"] = number_reused
+            plan = memory_plan
+        # The translation of each piece, or the range of its chunks
+        pieces = []
+        chunks = []
+        for piece, translation in plan:
+            if translation is None:
+                # A piece may be too long for one request
+                piece_chunks = self.split_document(piece, prompt_instructions)
+                pieces.append((len(chunks), len(chunks) + len(piece_chunks)))
+                chunks += piece_chunks
+            else:
+                pieces.append(translation)
+        results = self._translate_chunks(chunks, prompt_instructions)
+
+        with self.tracer.span("assembly"):
+            translated_text = "".join(
+                piece
+                if isinstance(piece, str)
+                else "".join(
+                    translation for translation, _, _ in results[slice(*piece)]
+                )
+                for piece in pieces
+            )
+        total_tokens = sum(tokens for _, tokens, _ in results)
+        finish_reason = merge_finish_reasons(
+            [chunk_finish_reason for _, _, chunk_finish_reason in results]
+        )
+        self._close_checkpoint(finish_reason)
+        return translated_text, total_tokens, finish_reason
+
+    def _translate_chunks(self, chunks: List[str], prompt_instructions: str):
+        """Translate chunks concurrently and report the progress and the errors."""
+        self.errors = []
+        self.verdicts = []
+        self.retry_budget = RetryBudget(self.max_retries)
+        self.reporter.on_start(len(chunks))
+        # The chunks run in worker threads, which do not inherit the span
+        parent_span = get_current_span()
+        submit_time = time.time()
+
+        def translate_one(indexed_chunk):
+            index, chunk = indexed_chunk
+            with self.tracer.span(
+                "translate_chunk",
+                parent_span,
+                submit_time,
+                index=index,
+                tokens=estimate_tokens(chunk),
+            ) as span:
+                self.tracer.add_span("queue_wait", submit_time, time.time())
+                try:
+                    result = self._resume_chunk(index, chunk)
+                    if result is None:
+                        result = self.translate_chunk(chunk, prompt_instructions)
+                        result = self.validate_chunk(
+                            index, chunk, result, prompt_instructions
+                        )
+                        self._remember_chunk(chunk, result)
+                        self._checkpoint_chunk(index, chunk, result)
+                except Exception as e:
+                    # The reporter is only used in the calling thread
+                    self.errors.append(str(e))
+                    span.error = str(e)
+                    result = chunk, 0, "Erreur"
+                span.set_attribute("finish_reason", result[2])
+            return result
+
+        engine = ConcurrentTranslationEngine(
+            translate_one,
+            max_concurrency=self.max_concurrency,
+            progress_callback=self.reporter.on_progress,
+        )
+        try:
+            results = engine.translate_all(list(enumerate(chunks)))
+            self.verdicts.sort(key=lambda verdict: verdict["index"])
+        finally:
+            for error in self.errors:
+                self.reporter.on_error(error)
+            self.reporter.on_finish()
+        return results
+
+    def translate_incremental(
+        self, latex_content: str, previous_source: str, previous_translation: str
+    ) -> Tuple[str, int, str]:
+        """Translate a revised LaTeX document, reusing its previous translation.
+
+        Only the blocks which changed since the previous source are
+        translated, and the translation of the other blocks is kept as is.
+        If the previous translation cannot be paired with its source, the
+        whole document is translated.
+        The statistics attribute stores whether the previous translation
+        was paired with its source, and the number of reused and of
+        translated pieces of the document.
+
+        Parameters
+        ----------
+        latex_content : str
+            The new version of the LaTeX content to translate.
+        previous_source : str
+            The previous version of the LaTeX content.
+        previous_translation : str
+            The translation of the previous version.
+
+        Returns
+        -------
+        traduction : str
+            The translated text.
+        total_tokens : int
+            The number of token used
+        finish_reason : str
+            The reason of finishing the AI job.
+        """
+        self.tracer = Tracer()
+        with self.tracer.span("plan"):
+            plan = plan_incremental_translation(
+                previous_source, previous_translation, latex_content
+            )
+        if plan is None:
+            print("La traduction précédente ne correspond pas à sa source")
+            self.statistics = {"aligned": False}
+            return self.translate(latex_content)
+        with self.tracer.span("prompt"):
+            prompt_instructions = self.get_prompt()
+        print(f"prompt_instructions:\n{prompt_instructions}")
+        translated_text, total_tokens, finish_reason = self._translate_plan(
+            plan, prompt_instructions
+        )
+        self.statistics = {
+            "aligned": True,
+            "reused_pieces": sum(
+                translation is not None and piece.strip() != ""
+                for piece, translation in plan
+            ),
+            "translated_pieces": sum(translation is None for _, translation in plan),
+        }
+        return translated_text, total_tokens, finish_reason
+
+    def stream_chunk(
+        self, chunk: str, prompt_instructions: str, on_delta=None
+    ) -> Tuple[str, int, str]:
+        """Translate one chunk of the document, receiving the output as it is generated.
+
+        Parameters
+        ----------
+        chunk : str
+            The LaTeX content to translate.
+        prompt_instructions : str
+            The prompt instructions.
+        on_delta : callable, optional
+            A function called as on_delta(partial_translation) each time a
+            piece of the output arrives, with the output received so far.
+
+        Returns
+        -------
+        traduction : str
+            The translated text.
+        total_tokens : int
+            The number of token used
+        finish_reason : str
+            The reason of finishing the AI job.
+        """
+        leading_blanks, content, trailing_blanks = split_blanks(chunk)
+        if not content:
+            return chunk, 0, "stop"
+        with self.tracer.span("mask"):
+            request_content, request_instructions, masked_parts = self._prepare_request(
+                content, prompt_instructions, True
+            )
+        cache_key, cached_translation = self._get_cached_translation(
+            request_content, request_instructions
+        )
+        if cached_translation is not None:
+            translated_text, finish_reason = cached_translation
+            total_tokens = 0
+        else:
+            stream_arguments = {}
+            if self.provider == "openai":
+                # Groq always sends the usage with the last chunk
+                stream_arguments["stream_options"] = {"include_usage": True}
+            request_time = time.time()
+            stream = self._create_completion(
+                request_content,
+                request_instructions + self._get_memory_instructions(content),
+                stream=True,
+                **stream_arguments,
+            )
+            pieces = []
+            total_tokens = 0
+            finish_reason = None
+            first_token_time = None
+            for completion_chunk in stream:
+                if completion_chunk.choices:
+                    choice = completion_chunk.choices[0]
+                    if choice.delta is not None and choice.delta.content:
+                        if first_token_time is None:
+                            first_token_time = time.time()
+                            self.tracer.add_span(
+                                "time_to_first_token", request_time, first_token_time
+                            )
+                        pieces.append(choice.delta.content)
+                        if on_delta is not None:
+                            on_delta(unmask_latex("".join(pieces), masked_parts)[0])
+                    if choice.finish_reason is not None:
+                        finish_reason = choice.finish_reason
+                usage = _get_stream_usage(completion_chunk)
+                if usage is not None:
+                    total_tokens = usage.total_tokens
+            if first_token_time is not None:
+                self.tracer.add_span("generation", first_token_time, time.time())
+            translated_text = "".join(pieces)
+        raw_translation = translated_text
+        with self.tracer.span("clean_output"):
+            translated_text = self.clean_llm_output(translated_text).strip()
+            is_complete = True
+            if masked_parts:
+                translated_text, is_complete = unmask_latex(translated_text, masked_parts)
+        if (
+            self.cache is not None
+            and cached_translation is None
+            and finish_reason == "stop"
+            and is_complete
+        ):
+            self.cache.put(cache_key, raw_translation, finish_reason)
+        if not is_complete:
+            print("Marqueurs perdus par l'IA : traduction sans masquage")
+            translation, retry_tokens, finish_reason = self.translate_chunk(
+                chunk, prompt_instructions, use_masking=False
+            )
+            return translation, total_tokens + retry_tokens, finish_reason
+        return leading_blanks + translated_text + trailing_blanks, total_tokens, finish_reason
+
+    def translate_streaming(self, latex_content: str, on_text=None):
+        """Translate a complete LaTeX document, receiving the output as it is generated.
+
+        The chunks of the document are translated one after the other, so
+        that the output arrives in the order of the document.
+        The progress and the errors are sent to the reporter, and the
+        errors are also stored in the errors attribute.
+
+        Parameters
+        ----------
+        latex_content : str
+            The LaTeX content to translate.
+        on_text : callable, optional
+            A function called as on_text(partial_translation) each time a
+            piece of the output arrives, with the translation of the
+            document received so far.
+
+        Returns
+        -------
+        traduction : str
+            The translated text.
+        total_tokens : int
+            The number of token used
+        finish_reason : str
+            The reason of finishing the AI job.
+        time_to_first_token : float or None
+            The time between the start of the translation and the first
+            piece of output, in seconds, or None if nothing was received.
+        """
+        self.tracer = Tracer()
+        with self.tracer.span(
+            "translate_streaming", document_tokens=estimate_tokens(latex_content)
+        ):
+            start_time = time.time()
+            time_to_first_token = None
+            with self.tracer.span("prompt"):
+                prompt_instructions = self.get_prompt()
+            print(f"prompt_instructions:\n{prompt_instructions}")
+            chunks = self.split_document(latex_content, prompt_instructions)
+            self.errors = []
+            self.verdicts = []
+            self.memory_statistics = {}
+            self._open_checkpoint(latex_content, prompt_instructions)
+            self.retry_budget = RetryBudget(self.max_retries)
+            self.reporter.on_start(len(chunks))
+            translated_chunks = []
+            total_tokens = 0
+            finish_reasons = []
+            for index, chunk in enumerate(chunks):
+                translated_text = "".join(translated_chunks)
+                leading_blanks = split_blanks(chunk)[0]
+
+                def on_delta(partial_translation):
+                    nonlocal time_to_first_token
+                    if time_to_first_token is None:
+                        time_to_first_token = time.time() - start_time
+                    if on_text is not None:
+                        on_text(
+                            translated_text
+                            + leading_blanks
+                            + self.clean_llm_output(partial_translation)
+                        )
+
+                with self.tracer.span(
+                    "translate_chunk", index=index, tokens=estimate_tokens(chunk)
+                ) as span:
+                    try:
+                        result = self._resume_chunk(index, chunk)
+                        if result is None:
+                            result = self.validate_chunk(
+                                index,
+                                chunk,
+                                self.stream_chunk(chunk, prompt_instructions, on_delta),
+                                prompt_instructions,
+                            )
+                            self._remember_chunk(chunk, result)
+                            self._checkpoint_chunk(index, chunk, result)
+                        translated_chunk, chunk_tokens, chunk_finish_reason = result
+                    except Exception as e:
+                        self.errors.append(str(e))
+                        self.reporter.on_error(str(e))
+                        span.error = str(e)
+                        translated_chunk, chunk_tokens, chunk_finish_reason = (
+                            chunk,
+                            0,
+                            "Erreur",
+                        )
+                    span.set_attribute("finish_reason", chunk_finish_reason)
+                if (
+                    time_to_first_token is None
+                    and chunk.strip()
+                    and chunk_finish_reason != "Erreur"
+                ):
+                    # The chunk came from the cache
+                    time_to_first_token = time.time() - start_time
+                translated_chunks.append(translated_chunk)
+                total_tokens += chunk_tokens
+                finish_reasons.append(chunk_finish_reason)
+                if on_text is not None:
+                    on_text("".join(translated_chunks))
+                self.reporter.on_progress(len(translated_chunks), len(chunks))
+            self.reporter.on_finish()
+
+            with self.tracer.span("assembly"):
+                translated_text = "".join(translated_chunks)
+            finish_reason = merge_finish_reasons(finish_reasons)
+            self._close_checkpoint(finish_reason)
+        return translated_text, total_tokens, finish_reason, time_to_first_token
@@ -0,0 +1,161 @@
+"""
+Structural validation of the translation of a chunk.
+
+The finish reason of the AI only tells whether the output was cut.
+A complete output can still break the document: a dropped brace or
+\\end{...} stops the compilation, and a changed \\label or \\ref breaks
+the cross-references.
+This module compares a chunk with its translation, without any request:
+the balance of the braces, the commands and the environments, the labels,
+the references and the citations, the placeholders, and the ratio of the
+lengths.
+The translator translates the chunks which fail again.
+
+The comments are ignored, since they are not translated.
+The French typographic commands, such as \\og and \\fg, are ignored, since
+the translation may legitimately drop them.
+"""
+import re
+from collections import Counter
+from typing import List
+
+# The bounds of the ratio of the length of a translation to the length of
+# its source, from French to English
+MIN_LENGTH_RATIO = 0.5
+MAX_LENGTH_RATIO = 2.0
+
+# The shorter sources are not checked for their length ratio
+MIN_LENGTH_FOR_RATIO = 200
+
+# The commands which the translation may drop or add
+IGNORED_COMMANDS = {"og", "fg", "xspace", "nobreakspace", "ie", "eg"}
+
+# The commands whose argument is a key, kept as is by the translation
+KEY_COMMANDS = (
+    "label",
+    "ref",
+    "eqref",
+    "pageref",
+    "autoref",
+    "cref",
+    "Cref",
+    "cite",
+    "citep",
+    "citet",
+    "citeauthor",
+    "citeyear",
+)
+
+_COMMENT_PATTERN = re.compile(r"(?<!\\)%[^\n]*")
+_COMMAND_PATTERN = re.compile(r"\\([a-zA-Z]+)\*?")
+_ENVIRONMENT_PATTERN = re.compile(r"\\(begin|end)\s*\{([^{}]*)\}")
+_KEY_PATTERN = re.compile(
+    r"\\(" + "|".join(KEY_COMMANDS) + r")\*?(?:\s*\[[^\[\]]*\])*\s*\{([^{}]*)\}"
+)
+_PLACEHOLDER_PATTERN = re.compile(r"\[\[\s*(\d+)\s*\]\]")
+# The escaped braces and backslashes do not count
+_ESCAPE_PATTERN = re.compile(r"\\[\\{}]")
+
+
+def get_brace_balance(text: str) -> int:
+    """Return the number of opening braces minus the number of closing ones."""
+    text = _ESCAPE_PATTERN.sub("", text)
+    return text.count("{") - text.count("}")
+
+
+def get_commands(text: str) -> Counter:
+    """Return the number of occurrences of each command of a text.
+
+    The environments, which are checked by get_environments(), and the
+    ignored commands are left out.
+    """
+    return Counter(
+        name
+        for name in _COMMAND_PATTERN.findall(text)
+        if name not in IGNORED_COMMANDS and name not in ("begin", "end")
+    )
+
+
+def get_environments(text: str) -> Counter:
+    """Return the number of \\begin and \\end of each environment."""
+    return Counter(
+        (command, name.strip()) for command, name in _ENVIRONMENT_PATTERN.findall(text)
+    )
+
+
+def get_keys(text: str) -> Counter:
+    """Return the keys of the labels, the references and the citations."""
+    return Counter(
+        (command, key.strip()) for command, key in _KEY_PATTERN.findall(text)
+    )
+
+
+def _get_differences(expected: Counter, actual: Counter, format_item):
+    """Return the items missing from actual, and the items added to it."""
+    differences = []
+    for difference in (expected - actual, actual - expected):
+        differences.append(
+            [
+                format_item(item) + (f" ×{count}" if count > 1 else "")
+                for item, count in sorted(difference.items())
+            ]
+        )
+    return differences
+
+
+def validate_translation(source: str, translation: str) -> List[str]:
+    """Check that a translation keeps the structure of its source.
+
+    Parameters
+    ----------
+    source : str
+        The LaTeX source of a chunk.
+    translation : str
+        Its translation.
+
+    Returns
+    -------
+    issues : list of str
+        The description of each difference of structure, empty if the
+        translation is valid.
+    """
+    source_text = _COMMENT_PATTERN.sub("", source)
+    translated_text = _COMMENT_PATTERN.sub("", translation)
+    issues = []
+
+    source_balance = get_brace_balance(source_text)
+    translation_balance = get_brace_balance(translated_text)
+    if source_balance != translation_balance:
+        issues.append(
+            f"Accolades déséquilibrées : {translation_balance:+d} dans la traduction, "
+            f"{source_balance:+d} dans la source"
+        )
+    missing_items = []
+    added_items = []
+    for get_items, format_item in (
+        (get_environments, lambda item: f"\\{item[0]}{{{item[1]}}}"),
+        (get_commands, lambda name: f"\\{name}"),
+        (get_keys, lambda item: f"\\{item[0]}{{{item[1]}}}"),
+        (
+            lambda text: Counter(_PLACEHOLDER_PATTERN.findall(text)),
+            lambda number: f"[[{number}]]",
+        ),
+    ):
+        missing, added = _get_differences(
+            get_items(source_text), get_items(translated_text), format_item
+        )
+        missing_items += missing
+        added_items += added
+    if missing_items:
+        issues.append(f"Manque dans la traduction : {', '.join(missing_items)}")
+    if added_items:
+        issues.append(f"En trop dans la traduction : {', '.join(added_items)}")
+
+    source_length = len(source.strip())
+    if source_length >= MIN_LENGTH_FOR_RATIO:
+        length_ratio = len(translation.strip()) / source_length
+        if not MIN_LENGTH_RATIO <= length_ratio <= MAX_LENGTH_RATIO:
+            issues.append(
+                f"Longueur suspecte : la traduction fait {length_ratio:.0%} de la source"
+            )
+    return issues
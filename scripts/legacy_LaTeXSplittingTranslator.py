@@ -1,6 +1,38 @@
+import re
+from typing import List, Optional, Tuple
+
+# The repository root must be on the path, e.g. with
+# python -m scripts.legacy_LaTeXSplittingTranslator
+from latex_translator.clients import get_async_client, get_client
+from latex_translator.engine import ConcurrentTranslationEngine, merge_finish_reasons
+from latex_translator.packing import (
+    BATCH_INSTRUCTIONS,
+    format_batch,
+    normalize_blanks,
+    pack_segments,
+    parse_batch,
+    split_blanks,
+)
+from latex_translator.ratelimit import (
+    RetryBudget,
+    call_with_retry,
+    call_with_retry_async,
+    get_rate_limiter,
+)
+from latex_translator.reporting import TranslationReporter
+from latex_translator.tokens import estimate_tokens
+from latex_translator.tokenizer import (
+    PRESERVE_COMMANDS,
+    TRANSLATE_COMMANDS,
+    tokenize_latex,
+)
+
+
 class LaTeXSplittingTranslator:
     def __init__(self, use_groq=True, model="llama3-8b-8192", temperature=0.3,
-                 tone_description=""):
+                 tone_description="", max_concurrency=8, cache=None,
+                 coalesce_segments=True, max_batch_tokens=1500,
+                 max_batch_segments=40, max_retries=20, reporter=None):
         """Initialize the LaTeXSplittingTranslator.
 
         This class splits the text into LaTeX segments, translate each
@@ -18,97 +50,81 @@ class LaTeXSplittingTranslator:
             The temperature of the model.
         tone_description : str, optional
             The description of the tone of the translation
+        max_concurrency : int, optional
+            The maximum number of segment translations in flight.
+            Defaults to 8.
+        cache : TranslationCache, optional
+            The cache of the translations.
+            If None, the translations are not cached.
+        coalesce_segments : bool, optional
+            Whether to send several small segments in a single request.
+            Defaults to True.
+        max_batch_tokens : int, optional
+            The maximum number of tokens of the segments of a request.
+            Defaults to 1500.
+        max_batch_segments : int, optional
+            The maximum number of segments of a request. Defaults to 40.
+        max_retries : int, optional
+            The maximum number of retries of the failed requests, for all
+            the requests of a translation. Defaults to 20.
+        reporter : TranslationReporter, optional
+            The receiver of the progress and of the errors.
+            If None, the errors are printed.
         """
+        # The clients are shared by all the translators of the process
         if use_groq:
-            self.client = Groq(
-                # This is the default and can be omitted
-                api_key=os.environ.get("GROQ_API_KEY"),
-                http_client=httpx.Client(
-                    proxy=os.environ.get("HTTP_PROXY"),
-                    verify=False,  # or path to your CA bundle
-                ),
-            )
+            self.client = get_client("groq")
+            self.async_client = get_async_client("groq")
+            self.rate_limiter = get_rate_limiter("groq")
         else:
-            self.client = OpenAI()
+            self.client = get_client("openai")
+            self.async_client = get_async_client("openai")
+            self.rate_limiter = get_rate_limiter("openai")
             # Use model = "gpt-3.5-turbo" with OpenAI
 
         self.model = model
         # Commandes LaTeX à préserver (ne pas traduire)
-        self.preserve_commands = {
-            "label",
-            "ref",
-            "cite",
-            "citep",
-            "citet",
-            "pageref",
-            "eqref",
-            "includegraphics",
-            "input",
-            "include",
-            "bibliography",
-            "bibliographystyle",
-            "newcommand",
-            "renewcommand",
-            "documentclass",
-            "usepackage",
-            "begin",
-            "end",
-            "item",
-            "itemize",
-            "enumerate",
-            "description",
-            "label",
-            "ref",
-            "cite",
-            "includegraphics",
-            "caption",
-            "footnote",
-            "mathbb",
-            "mathbf",
-            "mathrm",
-            "mathcal",
-            "frac",
-            "sqrt",
-            "sum",
-            "int",
-            "lim",
-            "infty",
-            "left",
-            "right",
-            "author",
-            "marginpar",
-        }
+        self.preserve_commands = set(PRESERVE_COMMANDS)
 
         # Commandes LaTeX dont le contenu doit être traduit
-        self.translate_commands = {
-            "emph",
-            "textbf",
-            "textit",
-            "underline",
-            "textsc",
-            "textsf",
-            "texttt",
-            "title",
-            "section",
-            "subsection",
-            "subsubsection",
-            "chapter",
-            "part",
-            "paragraph",
-            "subparagraph",
-            "caption",
-            "footnote",
-        }
+        self.translate_commands = set(TRANSLATE_COMMANDS)
         if temperature < 0.0 or temperature > 1.0:
             raise ValueError(
                 f"Temperature must be in [0, 1], but temperature={temperature}"
             )
         self.temperature = temperature
         self.tone_description = tone_description
+        if max_concurrency < 1:
+            raise ValueError(
+                f"The concurrency must be at least 1, but max_concurrency={max_concurrency}"
+            )
+        self.max_concurrency = max_concurrency
+        self.cache = cache
+        self.coalesce_segments = coalesce_segments
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_segments = max_batch_segments
+        self.statistics = {}
+        # The errors of the async requests, reported by translate()
+        self.errors = []
+        self.max_retries = max_retries
+        self.retry_budget = RetryBudget(max_retries)
+        if reporter is None:
+            reporter = TranslationReporter()
+        self.reporter = reporter
 
     def set_tone(self, tone_description):
         self.tone_description = tone_description
 
+    def set_reporter(self, reporter):
+        """Set the reporter.
+
+        Parameters
+        ----------
+        reporter : TranslationReporter
+            The receiver of the progress and of the errors.
+        """
+        self.reporter = reporter
+
     def extract_latex_segments(self, text: str) -> List[Tuple[str, str, bool]]:
         """Extract segments from LaTeX text.
 
@@ -121,67 +137,66 @@ class LaTeXSplittingTranslator:
         -------
         List[Tuple[str, str, bool]]
             A list of tuples containing the segment, its type, and whether to translate.
+            See latex_translator.tokenizer for the types of segments.
         """
-        segments = []
-        i = 0
-
-        while i < len(text):
-            if text[i] == "\\":
-                # Trouver la fin de la commande
-                j = i + 1
-                while j < len(text) and text[j].isalpha():
-                    j += 1
-
-                command = text[i + 1 : j]
-
-                if j < len(text) and text[j] == "{":
-                    # Trouver l'accolade fermante correspondante
-                    brace_count = 1
-                    k = j + 1
-                    while k < len(text) and brace_count > 0:
-                        if text[k] == "{":
-                            brace_count += 1
-                        elif text[k] == "}":
-                            brace_count -= 1
-                        k += 1
-
-                    if brace_count == 0:
-                        # Commande complète trouvée
-                        full_command = text[i:k]
-                        content = text[j + 1 : k - 1]
-
-                        if command in self.preserve_commands:
-                            segments.append((full_command, "preserve", False))
-                        elif command in self.translate_commands:
-                            segments.append((f"\\{command}{{", "command_start", False))
-                            segments.append((content, "translate_content", True))
-                            segments.append(("}", "command_end", False))
-                        else:
-                            segments.append((full_command, "unknown_command", False))
-
-                        i = k
-                        continue
-
-                # Commande sans accolades ou malformée
-                segments.append((text[i:j], "command_no_braces", False))
-                i = j
-            else:
-                # Texte normal - chercher le prochain backslash ou la fin
-                j = i
-                while j < len(text) and text[j] != "\\":
-                    j += 1
+        return tokenize_latex(text, self.preserve_commands, self.translate_commands)
 
-                if j > i:
-                    text_segment = text[i:j]
-                    # Ne traduire que si ce n'est pas juste des espaces/retours à la ligne
-                    if text_segment.strip():
-                        segments.append((text_segment, "normal_text", True))
-                    else:
-                        segments.append((text_segment, "whitespace", False))
+    def _get_messages(self, text: str, prompt: str, use_text_tag=False):
+        """Build the messages of the chat completion for one segment."""
+        if use_text_tag:
+            prompt += "Encadre le texte avec des balises <text> ... </text>."
+        return [
+            {
+                "role": "user",
+                "content": prompt,
+            },
+            {"role": "user", "content": f"Here is the text: {text}"},
+        ]
+
+    def _read_completion(self, chat_completion, use_text_tag=False):
+        """Extract the translation, the tokens and the finish reason."""
+        ai_result = chat_completion.choices[0].message.content
+        total_tokens = chat_completion.usage.total_tokens
+        finish_reason = chat_completion.choices[0].finish_reason
+
+        print(f"ai_result: {ai_result}")
+        if use_text_tag:
+            resultat_re = re.search(r"<text>(.*?)</text>", ai_result)
+            if resultat_re:
+                traduction = resultat_re.group(1)
+            else:
+                print("> Aucune balise <text> trouvée.")
+                traduction = ai_result
+        else:
+            traduction = ai_result
+        return traduction, total_tokens, finish_reason
 
-                i = j
+    def _get_cached_translation(self, text: str, prompt: str, use_text_tag=False):
+        """Look up the translation of a segment in the cache.
 
-        return segments
+        Returns
+        -------
+        cache_key : str or None
+            The key of the segment, or None if there is no cache.
+        cached_translation : tuple(str, int, str) or None
+            The translation, the number of tokens (zero) and the finish
+            reason, or None if the segment is not in the cache.
+        """
+        if self.cache is None:
+            return None, None
+        if use_text_tag:
+            prompt += "Encadre le texte avec des balises <text> ... </text>."
+        cache_key = self.cache.make_key(text, prompt, self.model, self.temperature)
+        entry = self.cache.get(cache_key)
+        if entry is None:
+            return cache_key, None
+        traduction, finish_reason = entry
+        return cache_key, (traduction, 0, finish_reason)
+
+    def _store_translation(self, cache_key, traduction: str, finish_reason: str):
+        """Store the translation of a segment in the cache, if it is complete."""
+        if cache_key is not None and finish_reason == "stop":
+            self.cache.put(cache_key, traduction, finish_reason)
 
     def translate_segment(
         self, text: str, prompt, use_text_tag=False
@@ -206,44 +221,156 @@ class LaTeXSplittingTranslator:
         finish_reason : str
             The reason of finishing the AI job.
         """
-        if use_text_tag:
-            prompt += "Encadre le texte avec des balises <text> ... </text>."
-        traduction = text
+        cache_key, cached_translation = self._get_cached_translation(
+            text, prompt, use_text_tag
+        )
+        if cached_translation is not None:
+            return cached_translation
         try:
-            chat_completion = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt,
-                    },
-                    {"role": "user", "content": f"Here is the text: {text}"},
-                ],
-                temperature=self.temperature,
+            chat_completion = call_with_retry(
+                lambda: self.client.chat.completions.create(
+                    model=self.model,
+                    messages=self._get_messages(text, prompt, use_text_tag),
+                    temperature=self.temperature,
+                ),
+                self.rate_limiter,
+                self.retry_budget,
+                2 * estimate_tokens(text) + estimate_tokens(prompt),
             )
-            ai_result = chat_completion.choices[0].message.content
-            total_tokens = chat_completion.usage.total_tokens
-            finish_reason = chat_completion.choices[0].finish_reason
-
-            print(f"ai_result: {ai_result}")
-            if use_text_tag:
-                resultat_re = re.search(r"<text>(.*?)</text>", ai_result)
-                if traduction:
-                    traduction = resultat_re.group(1)
-                else:
-                    print("> Aucune balise <text> trouvée.")
-                    traduction = ai_result
-            else:
-                traduction = ai_result
+            traduction, total_tokens, finish_reason = self._read_completion(
+                chat_completion, use_text_tag
+            )
+            self._store_translation(cache_key, traduction, finish_reason)
+        except Exception as e:
+            self.reporter.on_error(str(e))
+            traduction = text
+            total_tokens = 0
+            finish_reason = "Erreur"
+
+        return traduction, total_tokens, finish_reason
+
+    async def translate_segment_async(
+        self, text: str, prompt, use_text_tag=False
+    ) -> Tuple[str, int, str]:
+        """Translate a segment from French to English using the async client.
+
+        This is the coroutine counterpart of translate_segment(), used to
+        translate several segments concurrently.
+
+        Parameters
+        ----------
+        text : str
+            The text to translate.
+        prompt : str
+            Instruction for the translation.
+        use_text_tag : bool, optional
+            Whether to wrap the translation in <text> tags. Defaults to False.
+
+        Returns
+        -------
+        traduction : str
+            The translated text.
+        total_tokens : int
+            The number of token used
+        finish_reason : str
+            The reason of finishing the AI job.
+        """
+        cache_key, cached_translation = self._get_cached_translation(
+            text, prompt, use_text_tag
+        )
+        if cached_translation is not None:
+            return cached_translation
+        traduction, total_tokens, finish_reason = await self._request_segment_async(
+            text, prompt, use_text_tag
+        )
+        self._store_translation(cache_key, traduction, finish_reason)
+        return traduction, total_tokens, finish_reason
 
+    async def _request_segment_async(
+        self, text: str, prompt, use_text_tag=False
+    ) -> Tuple[str, int, str]:
+        """Send one segment to the AI, without using the cache."""
+        try:
+            chat_completion = await call_with_retry_async(
+                lambda: self.async_client.chat.completions.create(
+                    model=self.model,
+                    messages=self._get_messages(text, prompt, use_text_tag),
+                    temperature=self.temperature,
+                ),
+                self.rate_limiter,
+                self.retry_budget,
+                2 * estimate_tokens(text) + estimate_tokens(prompt),
+            )
+            traduction, total_tokens, finish_reason = self._read_completion(
+                chat_completion, use_text_tag
+            )
         except Exception as e:
-            st.error(f"Erreur lors de la traduction : {str(e)}")
+            # The reporter is only used in the calling thread: the errors
+            # are reported by translate()
+            print(f"Erreur lors de la traduction : {str(e)}")
+            self.errors.append(str(e))
             traduction = text
             total_tokens = 0
             finish_reason = "Erreur"
 
         return traduction, total_tokens, finish_reason
 
+    async def translate_batch_async(
+        self, texts: List[str], prompt
+    ) -> Tuple[Optional[List[str]], int, str]:
+        """Translate several segments in a single request.
+
+        The segments are enclosed in numbered delimiters, and the answer
+        is mapped back to the segments.
+
+        Parameters
+        ----------
+        texts : list of str
+            The texts to translate.
+        prompt : str
+            Instruction for the translation.
+
+        Returns
+        -------
+        traductions : list of str or None
+            The translated texts, or None if the request failed or if the
+            delimiters of the answer are broken.
+        total_tokens : int
+            The number of token used
+        finish_reason : str
+            The reason of finishing the AI job.
+        """
+        batch_content = format_batch(texts)
+        try:
+            chat_completion = await call_with_retry_async(
+                lambda: self.async_client.chat.completions.create(
+                    model=self.model,
+                    messages=self._get_messages(
+                        batch_content, prompt + BATCH_INSTRUCTIONS
+                    ),
+                    temperature=self.temperature,
+                ),
+                self.rate_limiter,
+                self.retry_budget,
+                2 * estimate_tokens(batch_content)
+                + estimate_tokens(prompt + BATCH_INSTRUCTIONS),
+            )
+            ai_result, total_tokens, finish_reason = self._read_completion(
+                chat_completion
+            )
+        except Exception as e:
+            # Not an error of the translation: the segments of the batch are
+            # then sent one per request, whose errors are reported
+            print(f"> Échec du lot, traduction segment par segment : {str(e)}")
+            return None, 0, "Erreur"
+
+        traductions = None
+        if finish_reason == "stop":
+            traductions = parse_batch(ai_result, len(texts))
+        if traductions is None:
+            print("> Délimiteurs des segments invalides.")
+        return traductions, total_tokens, finish_reason
+
     def get_prompt(self) -> str:
         prompt = (
             "- You are a professional scientific translator. \n"
@@ -261,6 +388,14 @@ class LaTeXSplittingTranslator:
     def translate(self, latex_content: str) -> Tuple[str, int, str]:
         """Translate a complete LaTeX document.
 
+        The segments which are identical up to their blanks, e.g. the
+        repeated headers of the tables or captions, are translated once.
+        The small segments are grouped into batches, each one translated in
+        a single request.
+        The counters of the run are stored in the statistics attribute,
+        with the dedup ratio: the fraction of the segments which were not
+        translated because an identical segment was.
+
         Parameters
         ----------
         latex_content : str
@@ -276,36 +411,146 @@ class LaTeXSplittingTranslator:
             The reason of finishing the AI job.
         """
         segments = self.extract_latex_segments(latex_content)
-        translated_segments = []
         prompt = self.get_prompt()
         print(f"prompt:\n{prompt}")
+        translated_segments = [segment for segment, _, _ in segments]
+        self.errors = []
+        self.retry_budget = RetryBudget(self.max_retries)
+        self.statistics = {
+            "segments": 0,
+            "unique_segments": 0,
+            "dedup_ratio": 0.0,
+            "cache_hits": 0,
+            "requests": 0,
+            "batches": 0,
+            "fallback_segments": 0,
+        }
 
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        total_tokens = 0
-        finish_reason = ""
-
+        # Only the segments with some content are sent to the AI,
+        # without the blanks around them, and each distinct one only once
+        occurrences = {}
         for i, (segment, segment_type, should_translate) in enumerate(segments):
-            progress = (i + 1) / len(segments)
-            progress_bar.progress(progress)
-            status_text.text(f"Traduction en cours... {i+1}/{len(segments)} segments")
-            print(f"Traduction en cours... {i+1}/{len(segments)} segments")
-            print(
-                f"Segment: {segment}, Type: {segment_type}, Should translate: {should_translate}"
+            if not (should_translate and segment.strip()):
+                continue
+            self.statistics["segments"] += 1
+            occurrences.setdefault(normalize_blanks(segment), []).append(i)
+        self.statistics["unique_segments"] = len(occurrences)
+        if self.statistics["segments"] > 0:
+            self.statistics["dedup_ratio"] = (
+                1.0 - len(occurrences) / self.statistics["segments"]
             )
 
-            if should_translate and segment.strip():
-                translated_segment, local_tokens, finish_reason = (
-                    self.translate_segment(segment, prompt)
+        def fill_occurrences(positions, translated_segment):
+            for i in positions:
+                leading_blanks, _, trailing_blanks = split_blanks(segments[i][0])
+                translated_segments[i] = (
+                    leading_blanks + translated_segment.strip() + trailing_blanks
                 )
-                total_tokens += local_tokens
-                translated_segments.append(translated_segment)
-                print(f"Traduction: {translated_segment}")
+
+        pending = []
+        for positions in occurrences.values():
+            # The first occurrence stands for the others
+            _, content, _ = split_blanks(segments[positions[0]][0])
+            cache_key, cached_translation = self._get_cached_translation(
+                content, prompt
+            )
+            if cached_translation is None:
+                pending.append((positions, content, cache_key))
             else:
-                translated_segments.append(segment)
+                self.statistics["cache_hits"] += 1
+                fill_occurrences(positions, cached_translation[0])
+
+        # Group the small segments into batches
+        batches = []
+        single_positions = []
+        if self.coalesce_segments:
+            for batch in pack_segments(
+                [content for _, content, _ in pending],
+                self.max_batch_tokens,
+                self.max_batch_segments,
+            ):
+                if len(batch) > 1:
+                    batches.append(batch)
+                else:
+                    single_positions.extend(batch)
+        else:
+            single_positions = list(range(len(pending)))
+
+        # The progress counts the requests: the batches, then the single
+        # segments, whose number grows when a batch falls back to them
+        self.reporter.on_start(len(batches) + len(single_positions))
+
+        def get_progress_reporter(number_before):
+            def report_progress(number_done, number_total):
+                self.reporter.on_progress(
+                    number_before + number_done, number_before + number_total
+                )
+
+            return report_progress
 
-        progress_bar.empty()
-        status_text.empty()
+        async def translate_batch(batch):
+            return await self.translate_batch_async(
+                [pending[position][1] for position in batch], prompt
+            )
+
+        engine = ConcurrentTranslationEngine(
+            translate_batch,
+            max_concurrency=self.max_concurrency,
+            progress_callback=get_progress_reporter(0),
+        )
+        batch_results = engine.translate_all(batches)
+
+        translations = [None] * len(pending)
+        total_tokens = 0
+        finish_reasons = []
+        for batch, (batch_translations, batch_tokens, batch_finish_reason) in zip(
+            batches, batch_results
+        ):
+            total_tokens += batch_tokens
+            if batch_translations is None:
+                # Fall back to one request per segment
+                single_positions.extend(batch)
+                self.statistics["fallback_segments"] += len(batch)
+                continue
+            finish_reasons.append(batch_finish_reason)
+            for position, translated_segment in zip(batch, batch_translations):
+                translations[position] = (translated_segment, batch_finish_reason)
+
+        single_positions.sort()
+
+        async def translate_one(content):
+            return await self._request_segment_async(content, prompt)
+
+        engine = ConcurrentTranslationEngine(
+            translate_one,
+            max_concurrency=self.max_concurrency,
+            progress_callback=get_progress_reporter(len(batches)),
+        )
+        results = engine.translate_all(
+            [pending[position][1] for position in single_positions]
+        )
+        for position, (translated_segment, local_tokens, local_finish_reason) in zip(
+            single_positions, results
+        ):
+            total_tokens += local_tokens
+            finish_reasons.append(local_finish_reason)
+            translations[position] = (translated_segment, local_finish_reason)
+
+        for (positions, content, cache_key), (
+            translated_segment,
+            local_finish_reason,
+        ) in zip(pending, translations):
+            print(f"Segment: {content}, Traduction: {translated_segment}")
+            self._store_translation(cache_key, translated_segment, local_finish_reason)
+            fill_occurrences(positions, translated_segment)
+
+        self.statistics["batches"] = len(batches)
+        self.statistics["requests"] = len(batches) + len(single_positions)
+        print(f"Statistiques : {self.statistics}")
+        for error in self.errors:
+            self.reporter.on_error(error)
+        self.reporter.on_finish()
 
         translated_text = "".join(translated_segments)
+        finish_reason = merge_finish_reasons(finish_reasons)
         return translated_text, total_tokens, finish_reason
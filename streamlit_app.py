@@ -13,253 +13,305 @@ A tool to translate a LaTeX text from french to english.
 - Enable/disable LaTeX mode
 - Select translation tone : Academic, Talk, Concise, etc.
 - Set keywords, abstract and difficult terms
+- Load a large glossary from a TSV or CSV file
+- Translate a project of several files, uploaded as a zip or a directory
+- Translate in the background, and find the translations again after a reconnection
 - Copy the translated LaTeX term
 - Download the translated LaTeX term
-- Print the number of tokens, the finish reason, the elapsed time
+- Print the number of tokens, the finish reason, the elapsed time, the time to first token
+- Stream the translation as it is generated
+- Split long documents into chunks which fit the model, translated concurrently
+- Reuse the translations stored in a local cache
+- Translate again only the paragraphs and sections changed since the previous translation
+- Mask the formulas, the citations and the references before sending the text to the AI
+- Forecast the tokens, the duration and the cost before translating, and warn when the document overflows the model
+- Fall back to other models when the selected one fails or is slow, and hedge the slow requests
+- Time each stage of the translation, and export the trace as JSON or for OpenTelemetry
 """
-import streamlit as st
-import re
+import json
 import os
-from openai import OpenAI
-from groq import Groq
-from typing import List, Tuple
-import httpx
-import re
+import streamlit as st
 import time
+import uuid
+import zipfile
+from latex_translator.cache import TranslationCache
+from latex_translator.checkpoint import (
+    delete_old_checkpoints,
+    get_default_checkpoint_directory,
+)
+from latex_translator.comparison import (
+    compare_models,
+    get_default_history_path,
+    save_comparison,
+)
+from latex_translator.glossary import parse_glossary
+from latex_translator.jobs import (
+    CANCELLED,
+    DONE,
+    FAILED,
+    INTERRUPTED,
+    QUEUED,
+    RUNNING,
+    JobQueue,
+)
+from latex_translator.memory import TranslationMemory
+from latex_translator.project import (
+    decode_latex,
+    get_project_files,
+    normalize_project_path,
+    read_zip_project,
+    translate_project,
+    write_zip_project,
+)
+from latex_translator.reporting import TranslationReporter
+from latex_translator.routing import Router, get_endpoint
+from latex_translator.tracing import get_timeline
+from latex_translator.translator import LaTeXRawTranslator
 
 # Configuration de la page Streamlit
 st.set_page_config(page_title="Traducteur LaTeX FR→EN", page_icon="📄", layout="wide")
 
+# The interval between two refreshes of the background jobs, in seconds
+JOB_POLL_INTERVAL = 2.0
 
-class LaTeXRawTranslator:
-    def __init__(
-        self,
-        use_groq=True,
-        model="llama3-8b-8192",
-        latex_mode=False,
-        temperature=0.3,
-        tone_description="",
-        keywords_list=[],
-        abstract_text="",
-        difficult_terms_dict=dict(),
-        must_clean_llm_output=True,
-    ):
-        """Initialize the LaTeXRawTranslator.
-
-        This class pushes the content to the AI, then ask it to translate.
+# The number of outputs of a comparison shown side by side
+COMPARISON_COLUMNS = 3
 
-        Parameters
-        ----------
-        use_groq : bool, optional
-            Whether to use the Groq API.
-            Otherwise, use OpenAI.
-            Defaults to True.
-        model : str, optional
-            The model to use for translation. Defaults to "llama3-8b-8192".
-        latex_mode : bool, optional
-            Whether to enable LaTeX mode. Defaults to False.
-        tone_description : str, optional
-            The description of the tone of the translation
-        keywords_list : list, optional
-            The list of keywords
-        abstract_text : str, optional
-            The abstract
-        difficult_terms_dict : dict, optional
-            The dictionary of difficult terms
-        must_clean_llm_output : bool, optional
-            Clean the LLM output if necessary
-        """
-        if use_groq:
-            self.client = Groq(
-                # This is the default and can be omitted
-                api_key=os.environ.get("GROQ_API_KEY"),
-                http_client=httpx.Client(
-                    proxy=os.environ.get("HTTP_PROXY"),
-                    verify=False,  # or path to your CA bundle
-                ),
-            )
-        else:
-            self.client = OpenAI()
-            # Use model = "gpt-3.5-turbo" with OpenAI
-
-        self.model = model
-        self.latex_mode = latex_mode
-        if temperature < 0.0 or temperature > 1.0:
-            raise ValueError(
-                f"Temperature must be in [0, 1], but temperature={temperature}"
-            )
-        self.temperature = temperature
-        self.tone_description = tone_description
-        self.keywords_list = keywords_list
-        self.abstract_text = abstract_text
-        self.difficult_terms_dict = difficult_terms_dict
-        self.must_clean_llm_output = must_clean_llm_output
-
-    def clean_llm_output(self, text: str) -> str:
-        """
-        Removes the phrase "Here is the translation:" from the beginning of a string.
-
-        Args:
-            text: The input string, which may contain the phrase.
-
-        Returns:
-            The cleaned string, with the phrase removed if it was present at the start.
-        """
-        if self.must_clean_llm_output:
-            # Use str.startswith() for an efficient check.
-            # For Llama
-            for phrase_to_remove in [
-                "Here is the translation:",
-                "Here is the translated text:",
-            ]:
-                if text.strip().startswith(phrase_to_remove):
-                    # Remove the phrase and any leading whitespace that might be left.
-                    text = text.strip()[len(phrase_to_remove) :].strip()
-
-            # Cleanup if necessary
-            # For Qwen
-            text = re.sub(r"<think>.*?</think>\s*", "", text, flags=re.DOTALL)
-        return text
-
-    def set_tone(self, tone_description):
-        """Set the tone description.
-
-        Parameters
-        ----------
-        tone_description : str
-            Description of the desired tone for the translation.
-        """
-        self.tone_description = tone_description
+JOB_STATUS_LABELS = {
+    QUEUED: "⏳ En attente",
+    RUNNING: "🔄 En cours",
+    DONE: "✅ Terminée",
+    FAILED: "❌ Échec",
+    CANCELLED: "🚫 Annulée",
+    INTERRUPTED: "⚠️ Interrompue par un redémarrage du serveur : relancez la traduction pour la reprendre",
+}
 
-    def set_keywords(self, keywords_list):
-        """Set the keywords list.
 
-        Parameters
-        ----------
-        keywords_list : list of str
-            List of keywords related to the text.
-        """
-        self.keywords_list = keywords_list
+class StreamlitReporter(TranslationReporter):
+    def __init__(self, unit="blocs"):
+        """Initialize the StreamlitReporter.
 
-    def set_abstract(self, abstract_text):
-        """Set the abstract text.
+        This reporter shows the progress of the translation with a progress
+        bar and the errors with error boxes.
 
         Parameters
         ----------
-        abstract_text : str
-            Summary or abstract of the document.
+        unit : str, optional
+            The name of the pieces in the progress text.
+            Defaults to "blocs".
         """
-        self.abstract_text = abstract_text
+        super().__init__()
+        self.unit = unit
+        self.progress_bar = None
+        self.status_text = None
+
+    def on_start(self, number_total):
+        self.progress_bar = st.progress(0)
+        self.status_text = st.empty()
+        self.status_text.text(f"Traduction en cours...")
+
+    def on_progress(self, number_done, number_total):
+        self.progress_bar.progress(number_done / number_total)
+        self.status_text.text(
+            f"Traduction en cours... {number_done}/{number_total} {self.unit}"
+        )
 
-    def set_difficult_terms_dict(self, difficult_terms_dict):
-        """Set the dictionary of difficult terms.
+    def on_error(self, error):
+        st.error(f"Erreur lors de la traduction : {error}")
 
-        Parameters
-        ----------
-        difficult_terms_dict : dict
-            Mapping of complex terms to their simplified explanations.
-        """
-        self.difficult_terms_dict = difficult_terms_dict
+    def on_finish(self):
+        self.progress_bar.empty()
+        self.status_text.empty()
 
-    def get_prompt(self) -> str:
-        """Generate the prompt instruction string.
 
-            Constructs a detailed instruction set for a scientific translator,
-            incorporating tone, keywords, abstract, and difficult terms.
-
-            Returns
-            -------
-            str
-                The generated prompt instructions.
-            """
-        prompt_instructions = (
-                "- You are a professional scientific translator. \n"
-            "- Keep punctuation as is. \n"
-            "- Keep carriage returns as is. \n"
-            "- Do not print: 'Here is the translation:'. \n"
-        )
-        if self.latex_mode:
-            prompt_instructions += (
-                "- You are a professional scientific translator. \n"
-                "- Preserve any LaTeX syntax intact. \n"
-                "- Translate only the content, not the LaTeX commands. \n"
-                "- Write a consistent LaTeX code. \n"
-                "- Do not translate the comments, indicated by '%' LaTeX command. \n"
-                "- Do not modify commands such as : `\\label{}`, `\\ref{}`, `\\cite{}`, etc. \n"
-                "- Translate the content of the formatting commands such as : `\\emph{}`, `\\textbf{}`, `\\section{}`, `\\caption{}`, etc. \n"
-            )
-        if len(self.tone_description) > 0:
-            prompt_instructions += f"- {self.tone_description}\n"
-        if self.keywords_list:
-            keywords_str = ", ".join(self.keywords_list)
-            prompt_instructions += (
-                f"- The text is related to the following keywords: {keywords_str}.\n"
-            )
-        if self.abstract_text:
-            prompt_instructions += f"- The abstract of the document is as follows:\n\n"
-            prompt_instructions += f"{self.abstract_text}\n"
-        if self.difficult_terms_dict:
-            terms_str = "\n".join(
-                [
-                    f"- '{f}' should be translated as '{e}'\n"
-                    for f, e in self.difficult_terms_dict.items()
-                ]
+def show_trace(tracer):
+    """Show the timeline of the stages of a translation, and export it."""
+    trace = tracer.to_json()
+    stage_durations = tracer.get_stage_durations()
+    st.dataframe(
+        [
+            {"Étape": stage, "Durée cumulée (s)": round(duration, 3)}
+            for stage, duration in stage_durations.items()
+        ],
+        hide_index=True,
+    )
+    timeline = get_timeline(trace)
+    if timeline:
+        import altair as alt
+
+        chart = (
+            alt.Chart(alt.Data(values=timeline))
+            .mark_bar()
+            .encode(
+                x=alt.X("start:Q", title="Temps (s)"),
+                x2="end:Q",
+                y=alt.Y("row:N", title=None, sort=None),
+                color=alt.Color("stage:N", title="Étape"),
+                tooltip=["row:N", "stage:N", "start:Q", "end:Q"],
             )
-            prompt_instructions += f"- Pay special attention to the following terms and use their provided translations:\n"
-            prompt_instructions += f"{terms_str}\n"
-        return prompt_instructions
+        )
+        st.altair_chart(chart, use_container_width=True)
+    column1, column2 = st.columns(2)
+    with column1:
+        st.download_button(
+            label="📥 Trace JSON",
+            data=json.dumps(trace, indent=2),
+            file_name="trace.json",
+            mime="application/json",
+        )
+    with column2:
+        st.download_button(
+            label="📥 Trace OpenTelemetry",
+            data=json.dumps(tracer.to_otlp(), indent=2),
+            file_name="trace_otlp.json",
+            mime="application/json",
+            help="Au format OTLP/JSON, à envoyer à un collecteur OpenTelemetry.",
+        )
 
-    def translate(self, latex_content: str) -> Tuple[str, int, str]:
-        """Translate a complete LaTeX document.
 
-        Parameters
-        ----------
-        latex_content : str
-            The LaTeX content to translate.
-
-        Returns
-        -------
-        traduction : str
-            The translated text.
-        total_tokens : int
-            The number of token used
-        finish_reason : str
-            The reason of finishing the AI job.
-        """
-
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-
-        status_text.text(f"Traduction en cours...")
-
-        try:
-            prompt_instructions = self.get_prompt()
-            print(f"prompt_instructions:\n{prompt_instructions}")
-            chat_completion = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt_instructions,
-                    },
-                    {"role": "user", "content": f"Here is the text: {latex_content}"},
-                ],
-                temperature=self.temperature,
-            )
-            translated_text = chat_completion.choices[0].message.content
-            total_tokens = chat_completion.usage.total_tokens
-            finish_reason = chat_completion.choices[0].finish_reason
-            translated_text = self.clean_llm_output(translated_text)
-        except Exception as e:
-            st.error(f"Erreur lors de la traduction : {str(e)}")
-            translated_text = latex_content
-            finish_reason = "Erreur"
-            total_tokens = 0
+def show_verdicts(verdicts):
+    """Show the verdicts of the validation of the chunks of a translation."""
+    number_valid = sum(verdict["valid"] for verdict in verdicts)
+    number_retried = sum(verdict["attempts"] > 1 for verdict in verdicts)
+    message = (
+        f"🧪 Vérification : {number_valid}/{len(verdicts)} blocs valides, "
+        f"{number_retried} retraduit(s)"
+    )
+    if number_valid < len(verdicts):
+        st.warning(message)
+    else:
+        st.info(message)
+    with st.expander("🧪 Verdicts par bloc"):
+        st.dataframe(
+            [
+                {
+                    "Bloc": verdict["index"],
+                    "Verdict": "✅" if verdict["valid"] else "❌",
+                    "Tentatives": verdict["attempts"],
+                    "Modèle": verdict.get("model", ""),
+                    "Problèmes": "; ".join(verdict["issues"]),
+                }
+                for verdict in verdicts
+            ],
+            hide_index=True,
+        )
 
-        progress_bar.empty()
-        status_text.empty()
 
-        return translated_text, total_tokens, finish_reason
+def show_comparison(results, latex_mode):
+    """Show the results of a comparison of models, side by side."""
+    st.dataframe(
+        [
+            {
+                "Modèle": result["model"],
+                "Température": result["temperature"],
+                "Tokens": result["tokens"],
+                "Premier token (s)": result["time_to_first_token"],
+                "Durée (s)": result["duration"],
+                "Tokens/s": result["tokens_per_second"],
+                "Blocs valides": (
+                    f"{result['valid_chunks']}/{result['checked_chunks']}"
+                    if result["checked_chunks"] > 0
+                    else "-"
+                ),
+                "Terminaison": result["finish_reason"],
+            }
+            for result in results
+        ],
+        hide_index=True,
+    )
+    # At most COMPARISON_COLUMNS outputs side by side, then another row
+    for row_start in range(0, len(results), COMPARISON_COLUMNS):
+        row_results = results[row_start : row_start + COMPARISON_COLUMNS]
+        for column, result in zip(st.columns(len(row_results)), row_results):
+            with column:
+                st.markdown(f"**{result['model']}** ({result['temperature']})")
+                for error in result["errors"]:
+                    st.error(error)
+                for issue in result["issues"]:
+                    st.warning(issue)
+                if latex_mode:
+                    st.code(result["translation"], language="latex")
+                else:
+                    st.text(result["translation"])
+
+
+@st.cache_resource
+def load_glossary(glossary_content: bytes, file_name: str):
+    """Return the glossary of an uploaded file, parsed once per content."""
+    delimiter = "\t" if file_name.lower().endswith(".tsv") else None
+    return parse_glossary(glossary_content.decode("utf-8-sig"), delimiter)
+
+
+@st.cache_resource
+def get_translation_cache():
+    """Return the translation cache shared by all the sessions of the server."""
+    return TranslationCache()
+
+
+@st.cache_resource
+def get_translation_memory():
+    """Return the translation memory shared by all the sessions of the server."""
+    return TranslationMemory()
+
+
+@st.cache_resource
+def get_checkpoint_directory():
+    """Return the directory of the checkpoints, without the old ones, once per server."""
+    checkpoint_directory = get_default_checkpoint_directory()
+    delete_old_checkpoints(checkpoint_directory)
+    return checkpoint_directory
+
+
+@st.cache_resource
+def get_job_queue():
+    """Return the queue of the translations shared by all the sessions of the server."""
+    return JobQueue()
+
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def show_jobs(job_queue, owner, latex_mode):
+    """Show the background translations of a user, refreshed periodically."""
+    jobs = job_queue.list_jobs(owner)
+    if not jobs:
+        return
+    st.subheader("🧵 Mes traductions")
+    for job in jobs:
+        with st.container(border=True):
+            st.markdown(f"**{job['description']}** — {JOB_STATUS_LABELS[job['status']]}")
+            if job["status"] == RUNNING and job["number_total"] > 0:
+                st.progress(
+                    job["number_done"] / job["number_total"],
+                    text=f"{job['number_done']}/{job['number_total']} blocs",
+                )
+            if job["status"] == DONE:
+                st.caption(
+                    f"🔢 Tokens utilisés : {job['total_tokens']}, "
+                    f"raison de terminaison : {job['finish_reason']}, "
+                    f"durée : {job['end_time'] - job['start_time']:.2f} (s)"
+                )
+                with st.expander("📄 Résultat"):
+                    if latex_mode:
+                        st.code(job["translation"], language="latex")
+                    else:
+                        st.text(job["translation"])
+                st.download_button(
+                    label="📥 Télécharger le fichier traduit",
+                    data=job["translation"],
+                    file_name="document_traduit.tex",
+                    mime="text/plain",
+                    key=f"download_{job['id']}",
+                )
+                if job["verdicts"]:
+                    show_verdicts(job["verdicts"])
+            for error in job["errors"]:
+                st.error(f"Erreur lors de la traduction : {error}")
+            if job["status"] != RUNNING:
+                st.button(
+                    "🗑️ Supprimer",
+                    key=f"delete_{job['id']}",
+                    on_click=job_queue.delete_job,
+                    args=(job["id"],),
+                )
 
 
 def main():
@@ -307,6 +359,14 @@ def main():
     default_abstract_input = ""
     default_difficult_terms_input = ""
     default_text_height = 400
+    default_use_cache = True
+    default_use_memory = True
+    default_streaming = False
+    default_use_masking = True
+    default_fallback_models = []
+    default_use_hedging = False
+    default_cascade_models = []
+    default_use_background = True
 
     # Initialize session state for advanced parameters
     if "selected_language_model" not in st.session_state:
@@ -323,6 +383,40 @@ def main():
         st.session_state.abstract_input = default_abstract_input
     if "difficult_terms_input" not in st.session_state:
         st.session_state.difficult_terms_input = default_difficult_terms_input
+    if "use_cache" not in st.session_state:
+        st.session_state.use_cache = default_use_cache
+    if "use_memory" not in st.session_state:
+        st.session_state.use_memory = default_use_memory
+    if "streaming" not in st.session_state:
+        st.session_state.streaming = default_streaming
+    if "use_masking" not in st.session_state:
+        st.session_state.use_masking = default_use_masking
+    if "fallback_models" not in st.session_state:
+        st.session_state.fallback_models = default_fallback_models
+    if "use_hedging" not in st.session_state:
+        st.session_state.use_hedging = default_use_hedging
+    if "cascade_models" not in st.session_state:
+        st.session_state.cascade_models = default_cascade_models
+    if "use_background" not in st.session_state:
+        st.session_state.use_background = default_use_background
+    # The translation of the project, reused for its unchanged files
+    if "project_translations" not in st.session_state:
+        st.session_state.project_translations = {}
+    if "translated_project" not in st.session_state:
+        st.session_state.translated_project = None
+    # The results of the last comparison of models
+    if "comparison_results" not in st.session_state:
+        st.session_state.comparison_results = None
+
+    translation_cache = get_translation_cache()
+    translation_memory = get_translation_memory()
+    checkpoint_directory = get_checkpoint_directory()
+    job_queue = get_job_queue()
+    # The identifier of the user is kept in the URL, so that the background
+    # translations are found again after a reconnection
+    if "user" not in st.query_params:
+        st.query_params["user"] = uuid.uuid4().hex
+    owner = st.query_params["user"]
 
     # Interface utilisateur
     col1, col2 = st.columns(2)
@@ -353,6 +447,54 @@ def main():
         else:
             latex_content = latex_input
 
+        # Traduction incrémentale : ne retraduire que les blocs modifiés
+        with st.expander("🔁 Traduction incrémentale"):
+            st.markdown(
+                "Fournissez la version précédente du document et sa traduction : "
+                "seuls les paragraphes et les sections modifiés seront traduits."
+            )
+            previous_source_file = st.file_uploader(
+                "Source précédente (.tex)",
+                type=["tex"],
+                help="La version précédente du document en français",
+            )
+            previous_translation_file = st.file_uploader(
+                "Traduction précédente (.tex)",
+                type=["tex"],
+                help="La traduction de la version précédente",
+            )
+        use_incremental = (
+            previous_source_file is not None and previous_translation_file is not None
+        )
+
+        # 🗂️ Projet en plusieurs fichiers
+        with st.expander("🗂️ Projet LaTeX en plusieurs fichiers"):
+            st.markdown(
+                "Chargez une archive ou un dossier : le fichier principal et les "
+                "fichiers qu'il inclut avec `\\input` ou `\\include` sont traduits, "
+                "et le projet traduit est téléchargé avec la même arborescence."
+            )
+            project_zip_file = st.file_uploader(
+                "Archive du projet (.zip)",
+                type=["zip"],
+                help="Les fichiers inchangés depuis la dernière traduction ne sont pas retraduits.",
+            )
+            project_directory_files = st.file_uploader(
+                "ou dossier du projet",
+                accept_multiple_files="directory",
+            )
+        project_files = {}
+        if project_zip_file is not None:
+            try:
+                project_files = read_zip_project(project_zip_file.getvalue())
+            except zipfile.BadZipFile:
+                st.error("❌ L'archive du projet est invalide.")
+        elif project_directory_files:
+            project_files = {
+                normalize_project_path(project_file.name): project_file.getvalue()
+                for project_file in project_directory_files
+            }
+
         # 🧩 Advanced Parameters Toggle
         show_advanced = st.checkbox("⚙️ Afficher les paramètres avancés", value=False)
 
@@ -367,6 +509,41 @@ def main():
                 groq_model_descriptions[st.session_state.selected_language_model]
             )
 
+            # 🛟 Fallback models
+            other_model_names = [
+                model_name
+                for model_name in model_names
+                if model_name != st.session_state.selected_language_model
+            ]
+            st.session_state.fallback_models = st.multiselect(
+                "🛟 Modèles de secours :",
+                options=other_model_names,
+                default=[
+                    model_name
+                    for model_name in st.session_state.fallback_models
+                    if model_name in other_model_names
+                ],
+                help="Si le modèle sélectionné échoue ou devient trop lent, les blocs sont envoyés à ces modèles, dans l'ordre.",
+            )
+            st.session_state.use_hedging = st.checkbox(
+                "🏁 Doubler les requêtes lentes",
+                value=st.session_state.use_hedging,
+                disabled=not st.session_state.fallback_models,
+                help="Quand une requête dépasse le 95e centile des durées du modèle, elle est aussi envoyée au premier modèle de secours, et la première réponse est gardée.",
+            )
+
+            # 🪜 Cascade
+            st.session_state.cascade_models = st.multiselect(
+                "🪜 Cascade : modèles plus gros pour les blocs invalides",
+                options=other_model_names,
+                default=[
+                    model_name
+                    for model_name in st.session_state.cascade_models
+                    if model_name in other_model_names
+                ],
+                help="Chaque bloc est traduit par le modèle sélectionné, par exemple llama3-8b-8192, puis vérifié : structure LaTeX et termes du glossaire. Seuls les blocs invalides sont envoyés à ces modèles, dans l'ordre.",
+            )
+
             # 🌡️ Temperature selector
             st.session_state.temperature = st.slider(
                 "🌡️ Modèle de température (0.0 à 1.0)",
@@ -440,13 +617,76 @@ def main():
                 placeholder="Entrez les termes difficiles et leur traduction préférée, un par ligne.\nExemple :\n'Apprentissage profond' -> 'Deep Learning'\n'Réseau de neurones' -> 'Neural network'",
                 help="Fournissez une liste de termes techniques spécifiques à traduire de manière précise. Utilisez le format 'Terme français' -> 'Terme anglais'.",
             )
+            # 📖 Glossary
+            glossary_file = st.file_uploader(
+                "📖 Glossaire (optionnel) :",
+                type=["tsv", "csv", "txt"],
+                key="glossary_file",
+                help="Un fichier TSV ou CSV : le terme français dans la première colonne, sa traduction dans la seconde. Seuls les termes présents dans un bloc sont envoyés avec ce bloc, quelle que soit la taille du glossaire.",
+            )
+            if glossary_file is not None:
+                glossary = load_glossary(glossary_file.getvalue(), glossary_file.name)
+                st.caption(f"📖 {len(glossary)} termes dans le glossaire")
+            # 🔒 Masking
+            st.session_state.use_masking = st.checkbox(
+                "🔒 Masquer les formules et les références",
+                value=st.session_state.use_masking,
+                help="En mode LaTeX, remplace les formules, les citations, les références, les labels, les chemins des figures et les commentaires par des marqueurs avant l'envoi à l'IA, puis les rétablit à l'identique.",
+            )
+            # ⚡ Streaming
+            st.session_state.streaming = st.checkbox(
+                "⚡ Affichage progressif (streaming)",
+                value=st.session_state.streaming,
+                help="Affiche la traduction au fur et à mesure de sa génération. Les blocs d'un long document sont alors traduits l'un après l'autre.",
+            )
+            # 🧵 Background translation
+            st.session_state.use_background = st.checkbox(
+                "🧵 Traduire en arrière-plan",
+                value=st.session_state.use_background,
+                disabled=st.session_state.streaming,
+                help="La traduction continue si vous modifiez les paramètres ou rechargez la page, et plusieurs traductions peuvent tourner à la fois. Leur suivi s'affiche dans « Mes traductions ». Sans effet avec l'affichage progressif.",
+            )
+            # 🗄️ Translation cache
+            st.session_state.use_cache = st.checkbox(
+                "🗄️ Utiliser le cache de traduction",
+                value=st.session_state.use_cache,
+                help="Réutilise les traductions déjà obtenues pour le même texte, le même prompt, le même modèle et la même température.",
+            )
+            cache_statistics = translation_cache.get_statistics()
+            st.caption(
+                f"Cache : {cache_statistics['entries']} entrées, "
+                f"{cache_statistics['size_bytes'] / 1024:.0f} Ko, "
+                f"{cache_statistics['hits']} succès, "
+                f"{cache_statistics['misses']} échecs"
+            )
+            if st.button("🗑️ Vider le cache"):
+                translation_cache.clear()
+            st.session_state.use_memory = st.checkbox(
+                "🧠 Utiliser la mémoire de traduction",
+                value=st.session_state.use_memory,
+                help="Reprend la traduction des paragraphes presque identiques à ceux des traductions passées, et envoie les paragraphes semblables comme exemples à l'IA.",
+            )
+            memory_statistics = translation_memory.get_statistics()
+            st.caption(
+                f"Mémoire : {memory_statistics['segments']} paragraphes, "
+                f"{memory_statistics['hits']}/{memory_statistics['lookups']} recherches fructueuses"
+            )
+            if st.button("🗑️ Vider la mémoire"):
+                translation_memory.clear()
         else:
             # Display current values in read-only mode
             short_parameters_description = (
                 f"Modèle : {st.session_state.selected_language_model}, "
                 f"Température : {st.session_state.temperature}, "
                 f"Mode LaTeX : {st.session_state.latex_mode}, "
-                f"Ton: {st.session_state.translation_tone}"
+                f"Ton: {st.session_state.translation_tone}, "
+                f"Cache : {st.session_state.use_cache}, "
+                f"Mémoire : {st.session_state.use_memory}, "
+                f"Masquage : {st.session_state.use_masking}, "
+                f"Secours : {', '.join(st.session_state.fallback_models) or 'aucun'}, "
+                f"Cascade : {', '.join(st.session_state.cascade_models) or 'aucune'}, "
+                f"Streaming : {st.session_state.streaming}, "
+                f"Arrière-plan : {st.session_state.use_background}"
             )
             if st.session_state.keywords_input:
                 short_parameters_description += (
@@ -461,83 +701,286 @@ def main():
 
             st.text(short_parameters_description)
 
+    def create_translator():
+        """Create the translator with the parameters of the session."""
+        router = None
+        if st.session_state.fallback_models:
+            router = Router(
+                [
+                    get_endpoint("groq", model_name)
+                    for model_name in [st.session_state.selected_language_model]
+                    + st.session_state.fallback_models
+                ],
+                hedge=st.session_state.use_hedging,
+            )
+        # Initialiser le traducteur
+        translator = LaTeXRawTranslator(
+            model=st.session_state.selected_language_model,
+            latex_mode=st.session_state.latex_mode,
+            temperature=st.session_state.temperature,
+            cache=(
+                translation_cache
+                if st.session_state.use_cache
+                else None
+            ),
+            reporter=StreamlitReporter(),
+            use_masking=st.session_state.use_masking,
+            router=router,
+            cascade_models=st.session_state.cascade_models,
+            memory=(
+                translation_memory
+                if st.session_state.use_memory
+                else None
+            ),
+            checkpoint_directory=checkpoint_directory,
+        )
+        # Get the selected tone description from the session state
+        tone_description = translation_tones[
+            st.session_state.translation_tone
+        ]
+        translator.set_tone(tone_description)
+
+        # Get the keywords
+        # In your translation function, after getting the input
+        keywords_list = [
+            keyword.strip()
+            for keyword in st.session_state.keywords_input.split(",")
+            if keyword.strip()
+        ]
+        translator.set_keywords(keywords_list)
+
+        # Get the abstract
+        abstract_text = st.session_state.abstract_input
+        translator.set_abstract(abstract_text)
+
+        # In your translation function, after getting the input
+        difficult_terms_dict = {}
+        if st.session_state.difficult_terms_input:
+            lines = (
+                st.session_state.difficult_terms_input.strip().split(
+                    "\n"
+                )
+            )
+            for line in lines:
+                if "->" in line:
+                    try:
+                        french_term, english_term = line.split("->", 1)
+                        difficult_terms_dict[french_term.strip()] = (
+                            english_term.strip()
+                        )
+                    except ValueError:
+                        # Handle malformed lines gracefully
+                        continue
+        translator.set_difficult_terms_dict(difficult_terms_dict)
+        glossary_file = st.session_state.get("glossary_file")
+        if glossary_file is not None:
+            translator.set_glossary(
+                load_glossary(glossary_file.getvalue(), glossary_file.name)
+            )
+        return translator
+
     with col2:
         st.subheader("🔄 Document traduit")
 
+        # 📊 Estimation avant la traduction
+        if latex_content.strip():
+            forecast = create_translator().forecast(
+                latex_content, 1 if st.session_state.streaming else None
+            )
+            forecast_description = (
+                f"📊 Estimation : {forecast['requests']} requête(s), "
+                f"{forecast['prompt_tokens']} tokens envoyés, "
+                f"{forecast['completion_tokens']} tokens générés, "
+                f"environ {forecast['duration']:.1f} (s)"
+            )
+            if forecast["cost"] is not None:
+                forecast_description += f", environ {forecast['cost']:.4f} $"
+            st.caption(forecast_description)
+            for warning in forecast["warnings"]:
+                st.warning(f"⚠️ {warning}")
+
+        use_background = (
+            st.session_state.use_background and not st.session_state.streaming
+        )
         if st.button("🚀 Traduire", type="primary", use_container_width=True):
-            if latex_content.strip():
+            if latex_content.strip() and use_background:
+                if uploaded_file is not None:
+                    job_description = uploaded_file.name
+                else:
+                    job_description = f"Texte de {len(latex_content)} caractères"
+                if use_incremental:
+                    job_queue.submit(
+                        create_translator(),
+                        latex_content,
+                        owner,
+                        job_description + " (incrémentale)",
+                        previous_source_file.getvalue().decode("utf-8"),
+                        previous_translation_file.getvalue().decode("utf-8"),
+                    )
+                else:
+                    job_queue.submit(
+                        create_translator(), latex_content, owner, job_description
+                    )
+                st.success("⏳ Traduction lancée en arrière-plan.")
+            elif latex_content.strip():
                 with st.spinner("Traduction en cours..."):
                     try:
                         start_time = time.time()
-                        # Initialiser le traducteur
-                        translator = LaTeXRawTranslator(
-                            model=st.session_state.selected_language_model,
-                            latex_mode=st.session_state.latex_mode,
-                            temperature=st.session_state.temperature,
-                        )
-                        # Get the selected tone description from the session state
-                        tone_description = translation_tones[
-                            st.session_state.translation_tone
-                        ]
-                        translator.set_tone(tone_description)
-
-                        # Get the keywords
-                        # In your translation function, after getting the input
-                        keywords_list = [
-                            keyword.strip()
-                            for keyword in st.session_state.keywords_input.split(",")
-                            if keyword.strip()
-                        ]
-                        translator.set_keywords(keywords_list)
-
-                        # Get the abstract
-                        abstract_text = st.session_state.abstract_input
-                        translator.set_abstract(abstract_text)
-
-                        # In your translation function, after getting the input
-                        difficult_terms_dict = {}
-                        if st.session_state.difficult_terms_input:
-                            lines = (
-                                st.session_state.difficult_terms_input.strip().split(
-                                    "\n"
-                                )
-                            )
-                            for line in lines:
-                                if "->" in line:
-                                    try:
-                                        french_term, english_term = line.split("->", 1)
-                                        difficult_terms_dict[french_term.strip()] = (
-                                            english_term.strip()
-                                        )
-                                    except ValueError:
-                                        # Handle malformed lines gracefully
-                                        continue
-                        translator.set_difficult_terms_dict(difficult_terms_dict)
+                        cache_hits = translation_cache.hits
+                        cache_misses = translation_cache.misses
+                        translator = create_translator()
+                        limiter_statistics = translator.rate_limiter.get_statistics()
 
                         # Translate
-                        translated_content, total_tokens, finish_reason = (
-                            translator.translate(latex_content)
-                        )
-                        prompt_instructions = translator.get_prompt()
-                        duration = time.time() - start_time
+                        time_to_first_token = None
+                        if use_incremental:
+                            translated_content, total_tokens, finish_reason = (
+                                translator.translate_incremental(
+                                    latex_content,
+                                    previous_source_file.getvalue().decode("utf-8"),
+                                    previous_translation_file.getvalue().decode(
+                                        "utf-8"
+                                    ),
+                                )
+                            )
+                        elif st.session_state.streaming:
+                            result_placeholder = st.empty()
+                            last_display_time = 0.0
+
+                            def show_partial_translation(partial_translation):
+                                nonlocal last_display_time
+                                # Limit the number of updates sent to the browser
+                                if time.time() - last_display_time < 0.1:
+                                    return
+                                last_display_time = time.time()
+                                result_placeholder.code(
+                                    partial_translation,
+                                    height=default_text_height,
+                                    language=(
+                                        "latex" if st.session_state.latex_mode else None
+                                    ),
+                                )
 
-                        # Afficher le résultat
-                        if st.session_state.latex_mode:
-                            st.code(
+                            (
                                 translated_content,
-                                height=default_text_height,
-                                language="latex",
+                                total_tokens,
+                                finish_reason,
+                                time_to_first_token,
+                            ) = translator.translate_streaming(
+                                latex_content, show_partial_translation
                             )
+                            result_placeholder.empty()
                         else:
-                            st.text_area(
-                                "Résultat traduit :",
-                                value=translated_content,
-                                height=default_text_height,
+                            translated_content, total_tokens, finish_reason = (
+                                translator.translate(latex_content)
                             )
+                        prompt_instructions = translator.get_prompt()
+                        duration = time.time() - start_time
+
+                        # Afficher le résultat
+                        with translator.tracer.span("render"):
+                            if st.session_state.latex_mode:
+                                st.code(
+                                    translated_content,
+                                    height=default_text_height,
+                                    language="latex",
+                                )
+                            else:
+                                st.text_area(
+                                    "Résultat traduit :",
+                                    value=translated_content,
+                                    height=default_text_height,
+                                )
                         # ✅ Affichage des tokens utilisés
                         st.info(f"🔢 Tokens utilisés : {total_tokens}")
                         st.info(f"ℹ️ Raison de terminaison : {finish_reason}")
                         st.info(f"🔢 Durée : {duration:.2f} (s)")
+                        if time_to_first_token is not None:
+                            st.info(
+                                f"⏱️ Temps avant le premier token : {time_to_first_token:.2f} (s)"
+                            )
+                        if use_incremental:
+                            if translator.statistics["aligned"]:
+                                st.info(
+                                    f"🔁 Blocs réutilisés : {translator.statistics['reused_pieces']}, "
+                                    f"passages retraduits : {translator.statistics['translated_pieces']}"
+                                )
+                            else:
+                                st.warning(
+                                    "⚠️ La traduction précédente n'a pas la même structure "
+                                    "que sa source : tout le document a été traduit."
+                                )
+                        if st.session_state.use_cache:
+                            st.info(
+                                f"🗄️ Cache : {translation_cache.hits - cache_hits} succès, "
+                                f"{translation_cache.misses - cache_misses} échecs"
+                            )
+                        if translator.resumed_chunks > 0:
+                            st.info(
+                                f"♻️ Reprise : {translator.resumed_chunks} bloc(s) "
+                                "repris du point de contrôle, sans nouvelle requête"
+                            )
+                        if translator.memory is not None:
+                            st.info(
+                                f"🧠 Mémoire : "
+                                f"{translator.memory_statistics.get('reused_blocks', 0)} paragraphe(s) repris, "
+                                f"{translator.memory_statistics.get('examples', 0)} exemple(s) envoyé(s), "
+                                f"{translator.memory_statistics.get('stored_segments', 0)} paragraphe(s) ajouté(s)"
+                            )
+                        new_limiter_statistics = translator.rate_limiter.get_statistics()
+                        throttled = (
+                            new_limiter_statistics["throttled"]
+                            - limiter_statistics["throttled"]
+                        )
+                        retries = (
+                            new_limiter_statistics["retries"] - limiter_statistics["retries"]
+                        )
+                        wait_time = (
+                            new_limiter_statistics["wait_time"]
+                            - limiter_statistics["wait_time"]
+                        )
+                        if throttled > 0 or retries > 0 or wait_time > 0.0:
+                            st.info(
+                                f"🚦 Limitation : {throttled} réponse(s) 429, "
+                                f"{retries} nouvelle(s) tentative(s), "
+                                f"{wait_time:.2f} (s) d'attente"
+                            )
+
+                        if translator.verdicts:
+                            show_verdicts(translator.verdicts)
+
+                        if translator.cascade_models:
+                            st.info("🪜 Cascade : blocs, tokens et durée par modèle")
+                            for tier in translator.get_tier_statistics():
+                                tier_description = (
+                                    f"{tier['model']} : {tier['chunks']} bloc(s), "
+                                    f"{tier['requests']} requête(s), "
+                                    f"{tier['tokens']} tokens, "
+                                    f"{tier['duration']:.2f} (s)"
+                                )
+                                if tier["requests"] > 0:
+                                    tier_description += (
+                                        f", {tier['duration'] / tier['requests']:.2f} (s) par requête"
+                                    )
+                                st.caption(tier_description)
+
+                        if translator.router is not None:
+                            routing_statistics = translator.router.get_statistics()
+                            st.info(
+                                f"🛟 Routage : {routing_statistics['failovers']} bascule(s), "
+                                f"{routing_statistics['hedged_requests']} requête(s) doublée(s)"
+                            )
+                            for endpoint_statistics in routing_statistics["endpoints"]:
+                                endpoint_description = (
+                                    f"{endpoint_statistics['name']} : "
+                                    f"{endpoint_statistics['requests']} requête(s), "
+                                    f"{endpoint_statistics['failures']} échec(s)"
+                                )
+                                if endpoint_statistics["p50"] is not None:
+                                    endpoint_description += (
+                                        f", durée médiane {endpoint_statistics['p50']:.2f} (s)"
+                                    )
+                                st.caption(endpoint_description)
 
                         # Bouton de téléchargement
                         st.download_button(
@@ -550,12 +993,116 @@ def main():
                         st.success("✅ Traduction terminée avec succès !")
                         with st.expander("ℹ️ prompt_instructions"):
                             st.markdown(prompt_instructions)
+                        with st.expander("⏱️ Chronologie de la traduction"):
+                            show_trace(translator.tracer)
 
                     except Exception as e:
                         st.error(f"❌ Erreur lors de la traduction : {str(e)}")
             else:
                 st.warning("⚠️ Veuillez fournir du contenu LaTeX à traduire.")
 
+        # 🗂️ Traduction du projet
+        if project_files:
+            st.subheader("🗂️ Projet traduit")
+            project_paths, missing_includes = get_project_files(
+                {
+                    path: decode_latex(content)[0]
+                    for path, content in project_files.items()
+                    if path.lower().endswith(".tex")
+                }
+            )
+            st.caption(
+                f"{len(project_paths)} fichier(s) à traduire : {', '.join(project_paths)}"
+            )
+            for missing_include in missing_includes:
+                st.warning(f"⚠️ Fichier inclus introuvable : {missing_include}")
+            if st.button("🚀 Traduire le projet", use_container_width=True):
+                start_time = time.time()
+                translated_files, translations, project_statistics = (
+                    translate_project(
+                        project_files,
+                        create_translator,
+                        st.session_state.project_translations,
+                        reporter=StreamlitReporter("fichiers"),
+                    )
+                )
+                st.session_state.project_translations = translations
+                st.session_state.translated_project = write_zip_project(
+                    translated_files
+                )
+                st.info(
+                    f"🗂️ Fichiers traduits : {project_statistics['translated']}, "
+                    f"retraduits en partie : {project_statistics['incremental']}, "
+                    f"inchangés : {project_statistics['reused']}"
+                )
+                st.info(f"🔢 Tokens utilisés : {project_statistics['tokens']}")
+                st.info(f"🔢 Durée : {time.time() - start_time:.2f} (s)")
+                for path, finish_reason in project_statistics["finish_reasons"].items():
+                    if finish_reason != "stop":
+                        st.warning(f"⚠️ {path} : {finish_reason}")
+            if st.session_state.translated_project is not None:
+                st.download_button(
+                    label="📥 Télécharger le projet traduit",
+                    data=st.session_state.translated_project,
+                    file_name="projet_traduit.zip",
+                    mime="application/zip",
+                )
+
+        # 🧵 Traductions en arrière-plan
+        show_jobs(job_queue, owner, st.session_state.latex_mode)
+
+    # ⚖️ Comparaison de modèles
+    with st.expander("⚖️ Comparer des modèles"):
+        st.markdown(
+            "Le document est traduit par chaque modèle, à chaque température, en "
+            "même temps, sans cache ni mémoire : comparez les durées, les tokens "
+            "et la vérification de la structure pour choisir le modèle le plus "
+            "rapide qui suffit. Un extrait du document suffit souvent."
+        )
+        compared_models = st.multiselect(
+            "Modèles à comparer :",
+            options=model_names,
+            default=[st.session_state.selected_language_model],
+        )
+        compared_temperatures = st.multiselect(
+            "Températures :",
+            options=[round(0.1 * step, 1) for step in range(11)],
+            default=[round(st.session_state.temperature, 1)],
+        )
+        if st.button(
+            "⚖️ Comparer",
+            disabled=not (compared_models and compared_temperatures),
+            use_container_width=True,
+        ):
+            if latex_content.strip():
+                st.session_state.comparison_results = compare_models(
+                    latex_content,
+                    create_translator,
+                    [
+                        (model_name, temperature)
+                        for model_name in compared_models
+                        for temperature in compared_temperatures
+                    ],
+                    reporter=StreamlitReporter("modèles"),
+                )
+                save_comparison(latex_content, st.session_state.comparison_results)
+            else:
+                st.warning("⚠️ Veuillez fournir du contenu LaTeX à traduire.")
+        if st.session_state.comparison_results is not None:
+            show_comparison(
+                st.session_state.comparison_results, st.session_state.latex_mode
+            )
+        history_path = get_default_history_path()
+        if os.path.exists(history_path):
+            with open(history_path, "rb") as history_file:
+                st.download_button(
+                    label="📥 Historique des comparaisons",
+                    data=history_file.read(),
+                    file_name="comparaisons.jsonl",
+                    mime="application/jsonl",
+                    help="Une ligne JSON par modèle et par comparaison, pour l'analyse.",
+                )
+
     # Section d'aide
     with st.expander("ℹ️ Aide et exemples"):
         st.markdown(